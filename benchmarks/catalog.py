@@ -0,0 +1,113 @@
+"""
+Нагрузочный тест чтения каталога: запросы в секунду и задержки (p50/p99) при N одновременных соединениях.
+Используется для сравнения WSGI (gunicorn, синхронные воркеры) и ASGI (uvicorn) на одних и тех же URL.
+
+Сервер:
+    gunicorn config.wsgi:application -w 4 --bind 127.0.0.1:8000
+    uvicorn config.asgi:application --workers 4 --host 127.0.0.1 --port 8000
+
+Тест:
+    python benchmarks/catalog.py http://127.0.0.1:8000 --connections 500 --duration 30
+"""
+
+import argparse
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = ["/", "/courses/", "/api/courses/"]
+
+
+async def read_response(reader):
+    """Читает HTTP/1.1 ответ (Content-Length или chunked) и возвращает код ответа и признак закрытия соединения"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Соединение закрыто сервером")
+    status = int(status_line.split()[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip().lower()
+
+    if headers.get("transfer-encoding") == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get("content-length", 0)))
+
+    return status, headers.get("connection") == "close"
+
+
+async def client(host, port, paths, deadline, stats):
+    """Одно keep-alive соединение, отправляющее запросы по кругу до окончания теста"""
+    connection = None
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection(host, port)
+            reader, writer = connection
+
+            started = time.perf_counter()
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n".encode())
+            status, closed = await read_response(reader)
+            stats["latencies"].append(time.perf_counter() - started)
+            if status >= 400:
+                stats["errors"] += 1
+        except (ConnectionError, asyncio.IncompleteReadError, OSError, ValueError):
+            stats["errors"] += 1
+            closed = True
+
+        if closed and connection is not None:
+            connection[1].close()
+            connection = None
+
+    if connection is not None:
+        connection[1].close()
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(url, paths, connections, duration):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    stats = {"latencies": [], "errors": 0}
+
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(client(host, port, paths, deadline, stats) for _ in range(connections)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(stats["latencies"])
+    print(f"URL: {url}, соединений: {connections}, длительность: {elapsed:.1f} с")
+    print(f"Запросов: {len(latencies)}, ошибок: {stats['errors']}")
+    print(f"Запросов в секунду: {len(latencies) / elapsed:.1f}")
+    print(f"p50: {percentile(latencies, 0.50) * 1000:.1f} мс, p99: {percentile(latencies, 0.99) * 1000:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест чтения каталога")
+    parser.add_argument("url", help="Адрес сервера, например http://127.0.0.1:8000")
+    parser.add_argument("--connections", type=int, default=500, help="Количество одновременных соединений")
+    parser.add_argument("--duration", type=float, default=30, help="Длительность теста в секундах")
+    parser.add_argument("--path", action="append", dest="paths", help="URL для запросов (можно несколько)")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.url, args.paths or DEFAULT_PATHS, args.connections, args.duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Скорость сериализации списков API в строках в секунду: ModelSerializer + JSONRenderer
+против ValuesSerializer (.values() и заранее выбранные преобразования полей) + FastJSONRenderer.
+Замеряется выборка из БД, представление и запись JSON — то, что делает list на каждую страницу.
+Тестовые записи создаются в транзакции, которая откатывается в конце.
+
+    python benchmarks/serialization.py --rows 5000 --repeat 5
+"""
+
+import argparse
+import os
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import transaction  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+
+from paperskill.models import Course, Lesson  # noqa: E402
+from paperskill.renderers import FastJSONRenderer, orjson  # noqa: E402
+from paperskill.serializers import (  # noqa: E402
+    CourseSerializer,
+    CourseSummarySerializer,
+    LessonSerializer,
+    ValuesSerializer,
+)
+from users.models import Payment, User  # noqa: E402
+from users.serializers import PaymentSerializer  # noqa: E402
+
+LESSONS_PER_COURSE = 5
+
+
+class Rollback(Exception):
+    pass
+
+
+def create_rows(rows):
+    owner = User.objects.create_user(phone_number="+79990000000", password="benchmark")
+    courses = Course.objects.bulk_create(
+        Course(
+            name=f"Курс {i}",
+            description="Описание курса " * 20,
+            owner=owner,
+            is_paid=bool(i % 2),
+            price=Decimal("1990.50"),
+            lesson_count=LESSONS_PER_COURSE,
+        )
+        for i in range(rows)
+    )
+    Lesson.objects.bulk_create(
+        Lesson(name=f"Урок {j}", description="Текст урока " * 20, course=course, owner=owner, order=j)
+        for course in courses[: rows // LESSONS_PER_COURSE]
+        for j in range(LESSONS_PER_COURSE)
+    )
+    Payment.objects.bulk_create(
+        Payment(user=owner, paid_course=course, payment_amount=course.price, payment_method="transfer")
+        for course in courses
+    )
+
+
+def drf(serializer_class, queryset, context):
+    return JSONRenderer().render(serializer_class(queryset, many=True, context=context).data)
+
+
+def fast(serializer_class, queryset, context):
+    values_serializer = ValuesSerializer(serializer_class(context=context))
+    return FastJSONRenderer().render(values_serializer.to_representation(list(values_serializer.values(queryset))))
+
+
+def measure(function, serializer_class, queryset, context, repeat):
+    """Лучшее время из repeat запусков"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(serializer_class, queryset, context)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(rows, repeat):
+    context = {"request": Request(RequestFactory().get("/"))}
+    cases = [
+        ("Курсы, краткие", CourseSummarySerializer, Course.objects.all()),
+        ("Курсы с уроками", CourseSerializer, Course.objects.prefetch_related("lessons")),
+        ("Уроки", LessonSerializer, Lesson.objects.all()),
+        ("Платежи", PaymentSerializer, Payment.objects.all()),
+    ]
+
+    print(f"Строк: {rows}, повторов: {repeat}, orjson: {'да' if orjson else 'нет'}")
+    print(f"{'':20}{'DRF, строк/с':>16}{'values, строк/с':>18}{'ускорение':>12}")
+    for title, serializer_class, queryset in cases:
+        count = queryset.count()
+        if drf(serializer_class, queryset, context) != fast(serializer_class, queryset, context):
+            print(f"{title}: ответы различаются")
+            continue
+        drf_time = measure(drf, serializer_class, queryset, context, repeat)
+        fast_time = measure(fast, serializer_class, queryset, context, repeat)
+        print(f"{title:20}{count / drf_time:>16,.0f}{count / fast_time:>18,.0f}{drf_time / fast_time:>11.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Скорость сериализации списков API")
+    parser.add_argument("--rows", type=int, default=5000, help="Количество курсов и платежей")
+    parser.add_argument("--repeat", type=int, default=5, help="Количество замеров (берётся лучший)")
+    args = parser.parse_args()
+
+    try:
+        with transaction.atomic():
+            create_rows(args.rows)
+            run(args.rows, args.repeat)
+            raise Rollback
+    except Rollback:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+from config.routers import PRIMARY_STICKY_COOKIE, SAFE_METHODS
+
+
+class ReplicaStickinessMiddleware(MiddlewareMixin):
+    """
+    После успешной записи ставит cookie, чтобы следующие чтения пользователя видели его изменения.
+    Работает и в синхронном, и в асинхронном стеке без переключения потоков
+    """
+
+    def process_response(self, request, response):
+        if settings.REPLICA_DATABASES and request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(
+                PRIMARY_STICKY_COOKIE, "1", max_age=settings.REPLICA_STICKY_SECONDS, httponly=True, samesite="Lax"
+            )
+        return response
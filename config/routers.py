@@ -0,0 +1,78 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Cookie, после записи пользователя на время REPLICA_STICKY_SECONDS отправляющий его чтения на основную БД
+PRIMARY_STICKY_COOKIE = "primary_reads"
+
+_replica_reads = ContextVar("replica_reads", default=False)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Внутри блока чтения моделей идут на реплики (enabled=False — принудительно на основную БД)"""
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_alias():
+    """
+    Одна из REPLICA_DATABASES (default, если реплик нет) — для запросов с явным .using(). Генераторы частей ответа
+    не держат блок replica_reads() открытым: под ASGI части читаются в разных копиях контекста (sync_to_async),
+    и блок закрылся бы не в той копии, где открылся
+    """
+    if settings.REPLICA_DATABASES:
+        return random.choice(settings.REPLICA_DATABASES)
+    return "default"
+
+
+class ReplicaRouter:
+    """Направляет чтения в блоке replica_reads() на одну из REPLICA_DATABASES, всё остальное — на default"""
+
+    def db_for_read(self, model, **hints):
+        # Таблицы DatabaseCache читаются с основной БД: на отстающей реплике сброшенная запись кэша ещё видна
+        if _replica_reads.get() and model._meta.app_label != "django_cache":
+            return replica_alias()
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
+
+
+class ReplicaReadMixin:
+    """
+    Безопасные запросы читают данные с реплики, если пользователь недавно ничего не записывал.
+    Шаблон рендерится внутри того же блока, чтобы ленивые запросы из шаблона тоже шли на реплику.
+    Для асинхронных представлений блок охватывает всю корутину обработчика
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in SAFE_METHODS or request.COOKIES.get(PRIMARY_STICKY_COOKIE):
+            return super().dispatch(request, *args, **kwargs)
+
+        if getattr(self, "view_is_async", False):
+            return self._adispatch_on_replica(request, *args, **kwargs)
+
+        with replica_reads():
+            response = super().dispatch(request, *args, **kwargs)
+            if hasattr(response, "render") and not response.is_rendered:
+                response.render()
+        return response
+
+    async def _adispatch_on_replica(self, request, *args, **kwargs):
+        # Контекст переменной копируется в потоки sync_to_async, поэтому асинхронный ORM видит блок
+        with replica_reads():
+            return await super().dispatch(request, *args, **kwargs)
@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
     "paperskill",
     "users",
+    "jobs",
     "drf_yasg",
     "rest_framework",
     "rest_framework_simplejwt",
@@ -54,6 +55,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "config.middleware.ReplicaStickinessMiddleware",
 ]
 
 ROOT_URLCONF = "config.urls"
@@ -89,6 +91,94 @@ DATABASES = {
     }
 }
 
+# Реплики только для чтения: DATABASE_REPLICA_HOSTS=replica1:5432,replica2:5432
+REPLICA_DATABASES = []
+for index, replica in enumerate(filter(None, os.getenv("DATABASE_REPLICA_HOSTS", "").split(",")), start=1):
+    host, _, port = replica.strip().partition(":")
+    alias = f"replica_{index}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": port or DATABASES["default"]["PORT"],
+        "TEST": {"MIRROR": "default"},
+    }
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ["config.routers.ReplicaRouter"]
+
+# Сколько секунд после записи чтения пользователя идут на основную БД
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS") or 10)
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+CACHES = {
+    # Права доступа к курсам, панели обучения, статистика. Сбрасываются из воркеров (run_jobs,
+    # process_stripe_events) и других процессов uvicorn, поэтому кэш общий для всех процессов; по умолчанию —
+    # таблица в БД (python manage.py createcachetable)
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND") or "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": os.getenv("CACHE_LOCATION") or "default_cache",
+    },
+    # Готовые страницы для анонимных пользователей. Кэш должен быть общим для всех процессов,
+    # иначе сброс страниц при изменении курса дойдёт только до одного из них; по умолчанию — таблица в БД
+    # (python manage.py createcachetable)
+    "pages": {
+        "BACKEND": os.getenv("PAGE_CACHE_BACKEND") or "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": os.getenv("PAGE_CACHE_LOCATION") or "page_cache",
+        "OPTIONS": {"MAX_ENTRIES": int(os.getenv("PAGE_CACHE_MAX_ENTRIES") or 10_000)},
+    },
+}
+
+# Время хранения страницы в кэше pages (сбрасывается раньше при изменении курсов и уроков)
+PAGE_CACHE_TIMEOUT = int(os.getenv("PAGE_CACHE_TIMEOUT") or 60 * 10)
+# Сколько секунд nginx отдаёт закэшированную у себя копию страницы без обращения к Django (X-Accel-Expires)
+PAGE_CACHE_PROXY_TIMEOUT = int(os.getenv("PAGE_CACHE_PROXY_TIMEOUT") or 2)
+
+# Время жизни кэша прав доступа пользователя к курсам (в секундах)
+ENTITLEMENTS_CACHE_TIMEOUT = int(os.getenv("ENTITLEMENTS_CACHE_TIMEOUT") or 60 * 15)
+
+# Панель обучения в профиле: время жизни кэша (в секундах) и количество последних платежей
+DASHBOARD_CACHE_TIMEOUT = int(os.getenv("DASHBOARD_CACHE_TIMEOUT") or 60 * 5)
+DASHBOARD_RECENT_PAYMENTS = int(os.getenv("DASHBOARD_RECENT_PAYMENTS") or 5)
+
+# Статистика главной страницы: время жизни кэша и оценка количества строк по pg_class.reltuples
+SITE_STATISTICS_CACHE_TIMEOUT = int(os.getenv("SITE_STATISTICS_CACHE_TIMEOUT") or 60 * 5)
+SITE_STATISTICS_ESTIMATED = os.getenv("SITE_STATISTICS_ESTIMATED") == "True"
+SITE_STATISTICS_ESTIMATE_THRESHOLD = int(os.getenv("SITE_STATISTICS_ESTIMATE_THRESHOLD") or 100_000)
+
+# Прохождение уроков: как часто страница урока присылает отметку присутствия, сколько секунд засчитывается
+# за одну отметку, сколько секунд нужно провести на уроке, чтобы отметить его пройденным, как часто (в секундах)
+# и при каком размере буфер отметок процесса записывается в БД
+PROGRESS_HEARTBEAT_INTERVAL = int(os.getenv("PROGRESS_HEARTBEAT_INTERVAL") or 15)
+PROGRESS_HEARTBEAT_MAX_SECONDS = int(os.getenv("PROGRESS_HEARTBEAT_MAX_SECONDS") or 60)
+PROGRESS_COMPLETE_MIN_SECONDS = int(os.getenv("PROGRESS_COMPLETE_MIN_SECONDS") or 60)
+PROGRESS_FLUSH_INTERVAL = int(os.getenv("PROGRESS_FLUSH_INTERVAL") or 10)
+PROGRESS_BUFFER_MAX_SIZE = int(os.getenv("PROGRESS_BUFFER_MAX_SIZE") or 1000)
+
+# Потоковые выгрузки (JSON Lines, CSV): сколько записей читается из курсора БД и отдаётся за раз
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE") or 2000)
+
+# Отчёт о выручке: период по умолчанию, дней
+REVENUE_REPORT_DAYS = int(os.getenv("REVENUE_REPORT_DAYS") or 30)
+
+# Админка: с какого количества строк без фильтров показывать оценку вместо COUNT(*)
+ADMIN_ESTIMATE_COUNT_THRESHOLD = int(os.getenv("ADMIN_ESTIMATE_COUNT_THRESHOLD") or 100_000)
+# Ограничение времени COUNT(*) для отфильтрованного списка в админке, мс
+ADMIN_COUNT_TIMEOUT = int(os.getenv("ADMIN_COUNT_TIMEOUT") or 200)
+
+# Исходящие письма: количество попыток отправки и базовая задержка между ними (в секундах)
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS") or 5)
+EMAIL_OUTBOX_RETRY_DELAY = int(os.getenv("EMAIL_OUTBOX_RETRY_DELAY") or 60)
+
+# Секрет для проверки подписи вебхуков Stripe
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+
+# Фоновые задачи (jobs): повтор зависших задач и экспоненциальная задержка между попытками (в секундах)
+JOBS_LOCK_TIMEOUT = int(os.getenv("JOBS_LOCK_TIMEOUT") or 60 * 5)
+JOBS_RETRY_BASE_DELAY = int(os.getenv("JOBS_RETRY_BASE_DELAY") or 10)
+JOBS_RETRY_MAX_DELAY = int(os.getenv("JOBS_RETRY_MAX_DELAY") or 60 * 60)
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -128,6 +218,17 @@ STATICFILES_DIRS = [BASE_DIR / "static"]
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+STORAGES = {
+    # Медиафайлы хранятся по хэшу содержимого с подсчётом ссылок (одинаковые загрузки — один файл)
+    "default": {"BACKEND": "paperskill.storage.ContentAddressedStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+# Через сколько секунд после загрузки файл без ссылок можно удалить
+MEDIA_BLOB_GRACE_PERIOD = int(os.getenv("MEDIA_BLOB_GRACE_PERIOD") or 60 * 60)
+
+# Версия выкладки (например, хэш коммита): входит в ETag, чтобы новая версия шаблонов сбрасывала кэш клиентов
+RELEASE_VERSION = os.getenv("RELEASE_VERSION") or ""
+
 AUTH_USER_MODEL = "users.User"
 
 PHONENUMBER_DEFAULT_REGION = "RU"
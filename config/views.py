@@ -1,20 +1,19 @@
-from django.db.models import Count
 from django.http import HttpResponse
 from django.shortcuts import render
 from django.views.generic import TemplateView
 
-from paperskill.models import Course
-from users.models import User
+from config.routers import ReplicaReadMixin
+from paperskill.services import aget_latest_courses_html, aget_site_statistics
+from paperskill.views import AnonymousPageCacheMixin, AsyncTemplateView
 
 
-class IndexView(TemplateView):
+class IndexView(AnonymousPageCacheMixin, ReplicaReadMixin, AsyncTemplateView):
     template_name = "paperskill/index.html"
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context["courses_count"] = Course.objects.count()
-        context["students_count"] = User.objects.count()
-        context["courses"] = Course.objects.annotate(lesson_count=Count("lessons")).order_by("-created_at")[:3]
+    async def get_context_data(self, **kwargs):
+        context = await super().get_context_data(**kwargs)
+        context.update(await aget_site_statistics())
+        context["latest_courses"] = await aget_latest_courses_html()
 
         return context
 
@@ -0,0 +1,10 @@
+from django.contrib import admin
+
+from jobs.models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "status", "attempts", "run_at", "created_at")
+    list_filter = ("status", "name")
+    readonly_fields = ("payload", "last_error", "locked_at")
@@ -0,0 +1,35 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from jobs.services import run_pending_jobs
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Воркер фоновых задач. Масштабируется запуском нескольких процессов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10, help="Сколько задач забирать за раз")
+        parser.add_argument("--sleep", type=float, default=1.0, help="Пауза (сек.), когда очередь пуста")
+        parser.add_argument("--once", action="store_true", help="Обработать одну пачку и завершиться")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        while True:
+            try:
+                processed = run_pending_jobs(batch_size)
+            except Exception:
+                # Сбой (например, БД недоступна) не останавливает воркер: задачи будут взяты снова после паузы
+                logger.exception("Не удалось обработать фоновые задачи")
+                close_old_connections()
+                processed = 0
+            if options["once"]:
+                self.stdout.write(self.style.SUCCESS(f"Обработано задач: {processed}"))
+                return
+            if not processed:
+                time.sleep(options["sleep"])
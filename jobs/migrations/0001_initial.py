@@ -0,0 +1,47 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:31
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="Job",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=100, verbose_name="Задача")),
+                ("payload", models.JSONField(blank=True, default=dict, verbose_name="Параметры")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "В очереди"),
+                            ("running", "Выполняется"),
+                            ("done", "Выполнена"),
+                            ("failed", "Ошибка"),
+                        ],
+                        default="pending",
+                        max_length=20,
+                        verbose_name="Статус",
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0, verbose_name="Попытки")),
+                ("max_attempts", models.PositiveIntegerField(default=5, verbose_name="Максимум попыток")),
+                ("run_at", models.DateTimeField(default=django.utils.timezone.now, verbose_name="Запустить после")),
+                ("locked_at", models.DateTimeField(blank=True, null=True, verbose_name="Взята в работу")),
+                ("last_error", models.TextField(blank=True, verbose_name="Последняя ошибка")),
+                ("created_at", models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")),
+            ],
+            options={
+                "verbose_name": "Фоновая задача",
+                "verbose_name_plural": "Фоновые задачи",
+                "indexes": [models.Index(fields=["status", "run_at"], name="job_status_run_at_idx")],
+            },
+        ),
+    ]
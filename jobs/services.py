@@ -0,0 +1,117 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class JobHandler:
+    """Зарегистрированный обработчик фоновой задачи"""
+
+    def __init__(self, name, func, max_attempts, on_failure):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+        self.on_failure = on_failure
+
+    def __call__(self, **payload):
+        return self.func(**payload)
+
+
+def job(name, max_attempts=5, on_failure=None):
+    """Декоратор: регистрирует функцию как обработчик задачи с именем name"""
+
+    def decorator(func):
+        handler = JobHandler(name, func, max_attempts, on_failure)
+        _registry[name] = handler
+        return handler
+
+    return decorator
+
+
+def get_handler(name):
+    return _registry[name]
+
+
+def enqueue(name, run_at=None, **payload):
+    """Ставит задачу в очередь. Задача становится видна воркерам после коммита транзакции"""
+    handler = get_handler(name)
+    return Job.objects.create(
+        name=name,
+        payload=payload,
+        max_attempts=handler.max_attempts,
+        run_at=run_at or timezone.now(),
+    )
+
+
+def claim_jobs(batch_size):
+    """
+    Забирает пачку готовых к выполнению задач через SELECT ... FOR UPDATE SKIP LOCKED,
+    поэтому несколько воркеров не получат одну и ту же задачу.
+    Задачи, зависшие у упавшего воркера дольше JOBS_LOCK_TIMEOUT, забираются повторно.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.JOBS_LOCK_TIMEOUT)
+
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=Job.STATUS_PENDING, run_at__lte=now) | Q(status=Job.STATUS_RUNNING, locked_at__lt=stale))
+            .order_by("run_at", "id")[:batch_size]
+        )
+        for claimed in jobs:
+            claimed.status = Job.STATUS_RUNNING
+            claimed.locked_at = now
+            claimed.attempts += 1
+        Job.objects.bulk_update(jobs, ["status", "locked_at", "attempts"])
+
+    return jobs
+
+
+def retry_delay(attempts):
+    """Экспоненциальная задержка перед повтором: base, 2*base, 4*base... но не больше JOBS_RETRY_MAX_DELAY"""
+    return min(settings.JOBS_RETRY_BASE_DELAY * 2 ** (attempts - 1), settings.JOBS_RETRY_MAX_DELAY)
+
+
+def run_job(claimed):
+    """Выполняет задачу и фиксирует результат: успех, повтор с задержкой или окончательная ошибка"""
+    try:
+        handler = get_handler(claimed.name)
+        handler(**claimed.payload)
+    except Exception as e:
+        logger.exception("Ошибка фоновой задачи %s", claimed)
+        claimed.last_error = repr(e)
+        claimed.locked_at = None
+
+        if claimed.attempts >= claimed.max_attempts or claimed.name not in _registry:
+            claimed.status = Job.STATUS_FAILED
+            claimed.save(update_fields=["status", "last_error", "locked_at"])
+            on_failure = getattr(_registry.get(claimed.name), "on_failure", None)
+            if on_failure:
+                on_failure(**claimed.payload)
+        else:
+            claimed.status = Job.STATUS_PENDING
+            claimed.run_at = timezone.now() + timedelta(seconds=retry_delay(claimed.attempts))
+            claimed.save(update_fields=["status", "last_error", "locked_at", "run_at"])
+        return False
+
+    claimed.status = Job.STATUS_DONE
+    claimed.locked_at = None
+    claimed.save(update_fields=["status", "locked_at"])
+    return True
+
+
+def run_pending_jobs(batch_size=10):
+    """Забирает и выполняет одну пачку задач. Возвращает количество обработанных задач"""
+    jobs = claim_jobs(batch_size)
+    for claimed in jobs:
+        run_job(claimed)
+    return len(jobs)
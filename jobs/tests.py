@@ -0,0 +1,72 @@
+import io
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+
+from jobs.models import Job
+from jobs.services import enqueue, job, run_pending_jobs
+
+calls = []
+
+
+@job("tests.record")
+def record(value):
+    calls.append(value)
+
+
+@job("tests.broken", max_attempts=2, on_failure=lambda value: calls.append(f"failed {value}"))
+def broken(value):
+    raise RuntimeError("Ошибка")
+
+
+@override_settings(JOBS_RETRY_BASE_DELAY=0)
+class JobQueueTestCase(TestCase):
+    """Тесты очереди фоновых задач"""
+
+    def setUp(self):
+        calls.clear()
+
+    def test_run_job(self):
+        """Тест выполнения задачи"""
+        queued = enqueue("tests.record", value=1)
+
+        self.assertEqual(run_pending_jobs(), 1)
+
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.STATUS_DONE)
+        self.assertEqual(queued.attempts, 1)
+        self.assertEqual(calls, [1])
+        self.assertEqual(run_pending_jobs(), 0)
+
+    def test_retry_and_fail(self):
+        """Тест повтора задачи с ошибкой и окончательной неудачи после max_attempts"""
+        queued = enqueue("tests.broken", value=2)
+
+        run_pending_jobs()
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.STATUS_PENDING)
+        self.assertIn("Ошибка", queued.last_error)
+
+        run_pending_jobs()
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.STATUS_FAILED)
+        self.assertEqual(queued.attempts, 2)
+        self.assertEqual(calls, ["failed 2"])
+
+    @override_settings(JOBS_RETRY_BASE_DELAY=60)
+    def test_retry_backoff(self):
+        """Тест отложенного повтора: задача не берётся до наступления run_at"""
+        enqueue("tests.broken", value=3)
+
+        self.assertEqual(run_pending_jobs(), 1)
+        self.assertEqual(run_pending_jobs(), 0)
+
+    def test_worker_survives_errors(self):
+        """Тест: ошибка БД записывается в лог, воркер не завершается"""
+        with (
+            mock.patch("jobs.management.commands.run_jobs.run_pending_jobs", side_effect=OperationalError),
+            self.assertLogs("jobs.management.commands.run_jobs", "ERROR"),
+        ):
+            call_command("run_jobs", "--once", stdout=io.StringIO())
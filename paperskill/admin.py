@@ -1,17 +1,88 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.db.models import Q
 
 from paperskill.models import Course, Lesson
+from paperskill.paginators import EstimatedCountPaginator
+from paperskill.services import prefix_search_query
+
+
+class AutocompleteFilter(admin.RelatedFieldListFilter):
+    """
+    Фильтр по связанной модели с поиском через autocomplete админки вместо списка всех значений.
+    В админке связанной модели должны быть заданы search_fields
+    """
+
+    template = "admin/autocomplete_filter.html"
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.widget_id = f"id_filter_{field_path}"
+        # Виджет берёт из ModelChoiceField набор значений, но загружает из него только выбранное
+        form_field = forms.ModelChoiceField(
+            queryset=field.remote_field.model._default_manager.all(),
+            widget=AutocompleteSelect(field, model_admin.admin_site),
+            required=False,
+        )
+        value = self.lookup_val[-1] if self.lookup_val else None
+        self.rendered_widget = form_field.widget.render(self.lookup_kwarg, value, attrs={"id": self.widget_id})
+
+    def field_choices(self, field, request, model_admin):
+        # Значения подгружаются виджетом по мере ввода, а не все сразу
+        return []
+
+    def has_output(self):
+        return True
+
+
+class LargeTableAdminMixin:
+    """Список без COUNT(*) по всей таблице: оценка количества строк и без «N всего» в результатах поиска"""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @property
+    def media(self):
+        return super().media + AutocompleteSelect(None, self.admin_site).media
 
 
 @admin.register(Course)
-class CourseAdmin(admin.ModelAdmin):
+class CourseAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ("id", "name", "owner", "created_at")
-    list_filter = ("owner",)
-    search_fields = ("name", "description", "owner")
+    list_filter = (("owner", AutocompleteFilter), "is_paid", "category")
+    list_select_related = ("owner",)
+    autocomplete_fields = ("owner",)
+    # Поиск идёт по полнотекстовому индексу (get_search_results), поле нужно для строки поиска и autocomplete
+    search_fields = ("name",)
+
+    def get_search_results(self, request, queryset, search_term):
+        query = prefix_search_query(search_term)
+        if query is None:
+            return queryset, False
+        condition = Q(search_vector=query)
+        if search_term.strip().isdigit():
+            condition |= Q(pk=search_term.strip())
+        return queryset.filter(condition), False
 
 
 @admin.register(Lesson)
-class LessonAdmin(admin.ModelAdmin):
+class LessonAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ("id", "name", "course", "owner", "created_at")
-    list_filter = ("owner", "course")
-    search_fields = ("name", "description", "owner", "course")
+    list_filter = (("course", AutocompleteFilter), ("owner", AutocompleteFilter))
+    list_select_related = ("course__owner", "owner")
+    autocomplete_fields = ("course", "owner")
+    # Порядок модели (order, id) индексирован только внутри курса, весь список идёт по первичному ключу
+    ordering = ("id",)
+    # Поиск идёт по полнотекстовому индексу (get_search_results), поле нужно для строки поиска и autocomplete
+    search_fields = ("name",)
+
+    def get_search_results(self, request, queryset, search_term):
+        query = prefix_search_query(search_term)
+        if query is None:
+            return queryset, False
+        # Курсы находятся по GIN-индексу текста их уроков, уроки внутри них — по индексу course_id
+        condition = Q(course__lessons_search_vector=query, search_vector=query)
+        if search_term.strip().isdigit():
+            condition |= Q(pk=search_term.strip())
+        return queryset.filter(condition), False
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PaperskillConfig(AppConfig):
     name = "paperskill"
+
+    def ready(self):
+        from paperskill import signals  # noqa: F401
@@ -0,0 +1,55 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    """
+    Строгий ETag из частей (id, updated_at, параметры запроса...). RELEASE_VERSION входит в хэш,
+    чтобы после выкладки новых шаблонов и сериализаторов клиенты не получали 304 на старые ответы
+    """
+    digest = hashlib.md5(repr((settings.RELEASE_VERSION, *parts)).encode(), usedforsecurity=False)
+    return quote_etag(digest.hexdigest())
+
+
+def page_etag(request, *parts):
+    """
+    ETag HTML-страницы, зависящей от пользователя. Если на странице будут показаны сообщения (messages),
+    валидатор не выдаётся: при следующем запросе страница будет уже без них
+    """
+    if len(get_messages(request)):
+        return None
+    return make_etag(request.user.pk, *parts)
+
+
+def set_validators(response, etag, last_modified=None, private=False):
+    """
+    Добавляет к успешному ответу ETag и Last-Modified и требует перепроверки перед использованием копии (no-cache).
+    Ответы для конкретного пользователя (private) не сохраняются общими кэшами и различаются по Cookie
+    """
+    if 200 <= response.status_code < 300 or response.status_code == 304:
+        if etag:
+            response.headers["ETag"] = etag
+        if last_modified:
+            response.headers["Last-Modified"] = http_date(last_modified.timestamp())
+        if private:
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ["Cookie"])
+        else:
+            patch_cache_control(response, no_cache=True)
+    return response
+
+
+def not_modified(request, etag, last_modified=None, private=False):
+    """Ответ 304 с теми же заголовками кэширования, если валидаторы клиента совпали, иначе None"""
+    if request.method not in ("GET", "HEAD") or not (etag or last_modified):
+        return None
+    headers = set_validators(HttpResponse(), etag, last_modified, private)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified and int(last_modified.timestamp()), response=headers
+    )
+    return None if response is headers else response
@@ -0,0 +1,130 @@
+import logging
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from paperskill.storage import release, retain
+
+logger = logging.getLogger(__name__)
+
+# Ширины производных изображений по полям моделей: карточки каталога (200px по высоте, ~350px по ширине),
+# страница курса/урока (до 800px) и аватар в профиле (120px), каждая с вариантом для экранов 2x
+RENDITION_WIDTHS = {
+    "paperskill.Course.image": (320, 640, 1280),
+    "paperskill.Lesson.image": (320, 640, 1280),
+    "users.User.avatar": (120, 240),
+}
+RENDITION_FORMATS = (
+    ("webp", "WEBP", {"quality": 80, "method": 4}),
+    ("jpeg", "JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+)
+
+
+def renditions_field(field_name):
+    """Имя поля модели, в котором хранятся производные изображения поля field_name"""
+    return f"{field_name}_renditions"
+
+
+def rendition_widths(model, field_name):
+    return RENDITION_WIDTHS[f"{model._meta.label}.{field_name}"]
+
+
+def needs_renditions(instance, field_name):
+    """Изменился ли исходный файл с момента последней генерации производных изображений"""
+    source = getattr(instance, field_name)
+    return (source.name or "") != getattr(instance, renditions_field(field_name)).get("source", "")
+
+
+def _rendition_name(source_name, width, extension):
+    """Имя для хранилища: images/photo_640.webp для images/photo.jpg (итоговое имя задаёт хэш содержимого)"""
+    return f"{posixpath.splitext(source_name)[0]}_{width}.{extension}"
+
+
+def rendition_names(renditions):
+    """Файлы всех производных изображений из описания, сохранённого в модели"""
+    return {name for extension, *_ in RENDITION_FORMATS for _, name in renditions.get(extension, [])}
+
+
+def render_renditions(source_name, widths):
+    """
+    Генерирует WebP и JPEG версии изображения указанных ширин (не больше исходной).
+    Возвращает описание для хранения в модели: исходный файл, его размеры и списки [ширина, файл] по форматам
+    """
+    with default_storage.open(source_name, "rb") as source:
+        image = Image.open(source)
+        # JPEG декодируется сразу в уменьшенном масштабе, если самая большая версия много меньше оригинала
+        image.draft("RGB", (max(widths), max(widths)))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+
+    source_width, source_height = image.size
+    targets = sorted({min(width, source_width) for width in widths})
+    renditions = {"source": source_name, "width": source_width, "height": source_height}
+
+    for extension, pil_format, options in RENDITION_FORMATS:
+        renditions[extension] = []
+        for width in targets:
+            height = max(round(source_height * width / source_width), 1)
+            resized = image.resize((width, height), Image.Resampling.LANCZOS) if width != source_width else image
+            if pil_format == "JPEG" and resized.mode != "RGB":
+                resized = resized.convert("RGB")
+
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, **options)
+            name = default_storage.save(_rendition_name(source_name, width, extension), ContentFile(buffer.getvalue()))
+            renditions[extension].append([width, name])
+
+    return renditions
+
+
+def update_renditions(instance, field_name):
+    """
+    Приводит производные изображения поля к текущему исходному файлу: генерирует новые, удаляет старые.
+    Сохраняет результат, только если исходник не сменился за время обработки. Возвращает True, если что-то изменилось
+    """
+    model = type(instance)
+    store_field = renditions_field(field_name)
+    if not needs_renditions(instance, field_name):
+        return False
+
+    old = getattr(instance, store_field)
+    source_name = getattr(instance, field_name).name
+    new = {}
+    if source_name:
+        try:
+            new = render_renditions(source_name, rendition_widths(model, field_name))
+        except (OSError, Image.DecompressionBombError):
+            # Битый или неподдерживаемый файл: запоминаем исходник, чтобы не обрабатывать его повторно,
+            # шаблоны покажут оригинал
+            logger.exception("Не удалось обработать изображение %s", source_name)
+            new = {"source": source_name}
+
+    if source_name:
+        same_source = Q(**{field_name: source_name})
+    else:
+        same_source = Q(**{field_name: ""}) | Q(**{f"{field_name}__isnull": True})
+    changes = {store_field: new}
+    if any(field.name == "updated_at" for field in model._meta.concrete_fields):
+        # Меняется разметка страниц (srcset), а значит и их ETag
+        changes["updated_at"] = timezone.now()
+
+    with transaction.atomic():
+        updated = model._default_manager.filter(same_source, pk=instance.pk).update(**changes)
+        if not updated:
+            # Изображение заменили или объект удалили, пока шла обработка: файлы без ссылок удалит collect_media
+            return False
+        old_names, new_names = rendition_names(old), rendition_names(new)
+        retain(*(new_names - old_names))
+        release(*(old_names - new_names))
+
+    setattr(instance, store_field, new)
+    return True
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from paperskill.storage import collect_blobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет медиафайлы без ссылок: освобождённые недавно (в пределах MEDIA_BLOB_GRACE_PERIOD) "
+        "и загруженные, но так и не сохранённые в модели. Запускается периодически (cron)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Количество файлов в одной транзакции")
+
+    def handle(self, *args, **options):
+        deleted = collect_blobs(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Удалено файлов: {deleted}"))
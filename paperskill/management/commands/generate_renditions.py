@@ -0,0 +1,49 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from jobs.services import enqueue
+from paperskill.images import RENDITION_WIDTHS, needs_renditions, renditions_field, update_renditions
+
+
+class Command(BaseCommand):
+    help = "Генерирует недостающие и устаревшие производные изображения (превью курсов и уроков, аватары)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Количество объектов в одной пачке")
+        parser.add_argument("--enqueue", action="store_true", help="Поставить задачи в очередь вместо обработки здесь")
+
+    def handle(self, *args, **options):
+        for key in RENDITION_WIDTHS:
+            label, field_name = key.rsplit(".", 1)
+            model = apps.get_model(label)
+            processed = self.process(model, field_name, options["batch_size"], options["enqueue"])
+            self.stdout.write(self.style.SUCCESS(f"{label}.{field_name}: обработано {processed}"))
+
+    def process(self, model, field_name, batch_size, to_queue):
+        processed = 0
+        last_id = 0
+        # Объекты без изображения и без сохранённых версий пропускаются ещё в запросе
+        has_image = ~Q(**{field_name: ""}) & Q(**{f"{field_name}__isnull": False})
+        has_work = has_image | ~Q(**{renditions_field(field_name): {}})
+
+        while True:
+            objects = list(
+                model._default_manager.filter(has_work, pk__gt=last_id)
+                .order_by("pk")
+                .only("pk", field_name, renditions_field(field_name))[:batch_size]
+            )
+            if not objects:
+                return processed
+            last_id = objects[-1].pk
+
+            for instance in objects:
+                if not needs_renditions(instance, field_name):
+                    continue
+                if to_queue:
+                    enqueue(
+                        "paperskill.generate_renditions", model=model._meta.label, pk=instance.pk, field=field_name
+                    )
+                else:
+                    update_renditions(instance, field_name)
+                processed += 1
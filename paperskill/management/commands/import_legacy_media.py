@@ -0,0 +1,69 @@
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from paperskill.images import RENDITION_WIDTHS
+from paperskill.models import MediaBlob
+from paperskill.storage import BLOBS_DIR
+
+
+class Command(BaseCommand):
+    help = (
+        "Переносит медиафайлы, загруженные до хранилища по содержимому, в blobs/: одинаковые файлы "
+        "сохраняются один раз, ссылки в моделях переписываются, исходные файлы удаляются. "
+        "После переноса производные изображения пересоздаются командой generate_renditions"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Количество файлов в одной пачке")
+        parser.add_argument("--dry-run", action="store_true", help="Только показать, сколько файлов будет перенесено")
+
+    def handle(self, *args, **options):
+        self.fields = [
+            (apps.get_model(label), field_name)
+            for label, field_name in (key.rsplit(".", 1) for key in RENDITION_WIDTHS)
+        ]
+        imported = missing = 0
+
+        for model, field_name in self.fields:
+            names = (
+                model._default_manager.exclude(**{f"{field_name}__startswith": f"{BLOBS_DIR}/"})
+                .exclude(**{field_name: ""})
+                .exclude(**{f"{field_name}__isnull": True})
+                .order_by(field_name)
+                .values_list(field_name, flat=True)
+                .distinct()
+            )
+            if options["dry_run"]:
+                self.stdout.write(f"{model._meta.label}.{field_name}: {names.count()}")
+                continue
+
+            last_name = ""
+            while True:
+                batch = list(names.filter(**{f"{field_name}__gt": last_name})[: options["batch_size"]])
+                if not batch:
+                    break
+                last_name = batch[-1]
+                for name in batch:
+                    if default_storage.exists(name):
+                        self.import_file(name)
+                        imported += 1
+                    else:
+                        missing += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Перенесено файлов: {imported}, не найдено: {missing}"))
+
+    def import_file(self, name):
+        """Сохраняет файл в хранилище по содержимому и переписывает на него все ссылки из моделей"""
+        with default_storage.open(name, "rb") as file:
+            blob_name = default_storage.save(name, file)
+
+        with transaction.atomic():
+            references = 0
+            for model, field_name in self.fields:
+                # UPDATE без сигналов: ссылки учитываются здесь одним запросом
+                references += model._default_manager.filter(**{field_name: name}).update(**{field_name: blob_name})
+            MediaBlob.objects.filter(name=blob_name).update(refcount=F("refcount") + references)
+            transaction.on_commit(lambda: default_storage.delete(name))
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from paperskill.models import Course, Lesson
+
+
+class Command(BaseCommand):
+    help = "Проверяет и исправляет счётчики уроков курсов (Course.lesson_count)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Количество курсов в одной пачке")
+        parser.add_argument("--dry-run", action="store_true", help="Только показать расхождения, ничего не менять")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        dry_run = options["dry_run"]
+        checked = repaired = 0
+        last_id = 0
+        lessons_count = (
+            Lesson.objects.filter(course_id=OuterRef("pk"))
+            .order_by()
+            .values("course_id")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+
+        while True:
+            courses = list(
+                Course.objects.filter(pk__gt=last_id).order_by("pk").only("id", "lesson_count")[:batch_size]
+            )
+            if not courses:
+                break
+            last_id = courses[-1].pk
+
+            actual = dict(
+                Lesson.objects.filter(course_id__in=[course.pk for course in courses])
+                .order_by()
+                .values("course_id")
+                .annotate(count=Count("id"))
+                .values_list("course_id", "count")
+            )
+
+            drifted = []
+            for course in courses:
+                count = actual.get(course.pk, 0)
+                if course.lesson_count != count:
+                    self.stdout.write(f"Курс {course.pk}: {course.lesson_count} -> {count}")
+                    course.lesson_count = count
+                    drifted.append(course)
+
+            checked += len(courses)
+            repaired += len(drifted)
+
+            if drifted and not dry_run:
+                # Пересчитываем одним UPDATE с подзапросом, чтобы не затереть параллельные изменения счётчика
+                Course.objects.filter(pk__in=[course.pk for course in drifted]).update(
+                    lesson_count=Coalesce(Subquery(lessons_count), Value(0))
+                )
+
+        action = "Найдено расхождений" if dry_run else "Исправлено"
+        self.stdout.write(self.style.SUCCESS(f"Проверено курсов: {checked}. {action}: {repaired}"))
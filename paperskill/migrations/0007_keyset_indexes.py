@@ -0,0 +1,21 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("paperskill", "0006_lesson_order"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="course",
+            index=models.Index(fields=["created_at", "id"], name="course_created_at_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="lesson",
+            index=models.Index(fields=["created_at", "id"], name="lesson_created_at_id_idx"),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:27
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_lesson_count(apps, schema_editor):
+    Course = apps.get_model("paperskill", "Course")
+    Lesson = apps.get_model("paperskill", "Lesson")
+    lessons_count = (
+        Lesson.objects.filter(course_id=OuterRef("pk"))
+        .order_by()
+        .values("course_id")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    Course.objects.update(lesson_count=Coalesce(Subquery(lessons_count), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("paperskill", "0007_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="lesson_count",
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name="Количество уроков"),
+        ),
+        migrations.RunPython(fill_lesson_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("paperskill", "0008_course_lesson_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="price_id",
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True, verbose_name="ID цены"),
+        ),
+        migrations.AddField(
+            model_name="course",
+            name="product_id",
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True, verbose_name="ID продукта"),
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:53
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.expressions import ArraySubquery
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import migrations
+from django.db.models import Func, OuterRef, TextField, Value
+
+BATCH_SIZE = 5000
+
+
+def _vector(*parts):
+    vector = None
+    for field, weight in parts:
+        part = SearchVector(field, weight=weight, config="russian")
+        vector = part if vector is None else vector + part
+    return vector
+
+
+def _lessons_text(Lesson, field):
+    return Func(
+        ArraySubquery(Lesson.objects.filter(course_id=OuterRef("pk")).order_by("order", "id").values(field)),
+        Value(" "),
+        function="array_to_string",
+        output_field=TextField(),
+    )
+
+
+def _fill(model, **vectors):
+    # Пачками по id, чтобы не держать блокировку всей таблицы одним UPDATE
+    last_id = 0
+    while True:
+        ids = list(model.objects.filter(pk__gt=last_id).order_by("pk").values_list("pk", flat=True)[:BATCH_SIZE])
+        if not ids:
+            break
+        model.objects.filter(pk__in=ids).update(**vectors)
+        last_id = ids[-1]
+
+
+def fill_search_vectors(apps, schema_editor):
+    Course = apps.get_model("paperskill", "Course")
+    Lesson = apps.get_model("paperskill", "Lesson")
+    _fill(Lesson, search_vector=_vector(("name", "A"), ("description", "B")))
+    _fill(
+        Course,
+        search_vector=_vector(("name", "A"), ("description", "B")),
+        # Как COURSE_LESSONS_SEARCH_VECTOR: без позиций и весов
+        lessons_search_vector=Func(
+            _vector((_lessons_text(Lesson, "name"), "A"), (_lessons_text(Lesson, "description"), "B")),
+            function="strip",
+            output_field=SearchVectorField(),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("paperskill", "0009_course_stripe_ids"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="lessons_search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name="Поисковый вектор уроков"
+            ),
+        ),
+        migrations.AddField(
+            model_name="course",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name="Поисковый вектор"
+            ),
+        ),
+        migrations.AddField(
+            model_name="lesson",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name="Поисковый вектор"
+            ),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="course",
+            index=django.contrib.postgres.indexes.GinIndex(fields=["search_vector"], name="course_search_vector_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="course",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["lessons_search_vector"], name="course_lessons_vector_idx"
+            ),
+        ),
+    ]
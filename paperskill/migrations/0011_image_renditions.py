@@ -0,0 +1,27 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("paperskill", "0010_search_vectors"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="image_renditions",
+            field=models.JSONField(
+                blank=True, default=dict, editable=False, verbose_name="Производные изображения превью"
+            ),
+        ),
+        migrations.AddField(
+            model_name="lesson",
+            name="image_renditions",
+            field=models.JSONField(
+                blank=True, default=dict, editable=False, verbose_name="Производные изображения превью"
+            ),
+        ),
+    ]
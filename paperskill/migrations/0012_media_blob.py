@@ -0,0 +1,36 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("paperskill", "0011_image_renditions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MediaBlob",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=255, unique=True, verbose_name="Файл")),
+                ("size", models.PositiveBigIntegerField(verbose_name="Размер")),
+                ("refcount", models.PositiveIntegerField(default=0, verbose_name="Количество ссылок")),
+                (
+                    "saved_at",
+                    models.DateTimeField(default=django.utils.timezone.now, verbose_name="Последняя загрузка"),
+                ),
+            ],
+            options={
+                "verbose_name": "Медиафайл",
+                "verbose_name_plural": "Медиафайлы",
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("refcount", 0)), fields=["saved_at"], name="mediablob_unreferenced_idx"
+                    )
+                ],
+            },
+        ),
+    ]
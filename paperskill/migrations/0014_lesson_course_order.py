@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("paperskill", "0013_updated_at"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="lesson",
+            options={"ordering": ["order", "id"], "verbose_name": "Урок", "verbose_name_plural": "Уроки"},
+        ),
+        migrations.AddIndex(
+            model_name="lesson",
+            index=models.Index(fields=["course", "order", "id"], name="lesson_course_order_idx"),
+        ),
+    ]
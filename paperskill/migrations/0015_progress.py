@@ -0,0 +1,90 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:45
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("paperskill", "0014_lesson_course_order"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CourseProgress",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("completed_lessons", models.PositiveIntegerField(default=0, verbose_name="Пройдено уроков")),
+                (
+                    "updated_at",
+                    models.DateTimeField(default=django.utils.timezone.now, verbose_name="Последняя активность"),
+                ),
+                (
+                    "course",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="progress",
+                        to="paperskill.course",
+                        verbose_name="Курс",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="course_progress",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Прохождение курса",
+                "verbose_name_plural": "Прохождение курсов",
+                "constraints": [
+                    models.UniqueConstraint(fields=("user", "course"), name="courseprogress_user_course_uniq")
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="LessonProgress",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("seconds_spent", models.PositiveIntegerField(default=0, verbose_name="Время на уроке, с")),
+                ("completed_at", models.DateTimeField(blank=True, null=True, verbose_name="Дата прохождения")),
+                (
+                    "updated_at",
+                    models.DateTimeField(default=django.utils.timezone.now, verbose_name="Последняя активность"),
+                ),
+                (
+                    "lesson",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="progress",
+                        to="paperskill.lesson",
+                        verbose_name="Урок",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="lesson_progress",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Прохождение урока",
+                "verbose_name_plural": "Прохождение уроков",
+                "constraints": [
+                    models.UniqueConstraint(fields=("user", "lesson"), name="lessonprogress_user_lesson_uniq")
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0.1 on 2026-10-18 15:10
+
+from django.contrib.postgres.search import SearchVectorField
+from django.db import migrations
+from django.db.models import F, Func
+
+BATCH_SIZE = 5000
+
+
+def strip_lessons_search_vectors(apps, schema_editor):
+    # Векторы уроков, заполненные 0010 до исправления, хранили позиции и веса, которые при обновлении
+    # курса отбрасываются (COURSE_LESSONS_SEARCH_VECTOR); strip повторно не меняет вектор
+    Course = apps.get_model("paperskill", "Course")
+    last_id = 0
+    while True:
+        ids = list(Course.objects.filter(pk__gt=last_id).order_by("pk").values_list("pk", flat=True)[:BATCH_SIZE])
+        if not ids:
+            break
+        Course.objects.filter(pk__in=ids, lessons_search_vector__isnull=False).update(
+            lessons_search_vector=Func(F("lessons_search_vector"), function="strip", output_field=SearchVectorField())
+        )
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("paperskill", "0015_progress"),
+    ]
+
+    operations = [
+        migrations.RunPython(strip_lessons_search_vectors, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,7 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 
 
 class Course(models.Model):
@@ -7,6 +10,9 @@ class Course(models.Model):
     name = models.CharField(max_length=255, verbose_name="Название")
     description = models.TextField(blank=True, verbose_name="Описание")
     image = models.ImageField(blank=True, null=True, upload_to="images/", verbose_name="Превью")
+    image_renditions = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Производные изображения превью"
+    )
     video_url = models.URLField(blank=True, null=True, verbose_name="Ссылка на видео")
     owner = models.ForeignKey(
         "users.User",
@@ -17,9 +23,15 @@ class Course(models.Model):
         verbose_name="Владелец",
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата изменения")
     is_paid = models.BooleanField(default=False, verbose_name="Платный курс")
     price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, verbose_name="Цена")
     category = models.CharField(max_length=20, choices=CATEGORIES, verbose_name="Категория")
+    lesson_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Количество уроков")
+    product_id = models.CharField(max_length=255, blank=True, null=True, editable=False, verbose_name="ID продукта")
+    price_id = models.CharField(max_length=255, blank=True, null=True, editable=False, verbose_name="ID цены")
+    search_vector = SearchVectorField(null=True, editable=False, verbose_name="Поисковый вектор")
+    lessons_search_vector = SearchVectorField(null=True, editable=False, verbose_name="Поисковый вектор уроков")
 
     def __str__(self):
         return f"{self.name} [Владелец: {self.owner}]"
@@ -28,12 +40,20 @@ class Course(models.Model):
         verbose_name = "Курс"
         verbose_name_plural = "Курсы"
         ordering = ["id"]
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="course_created_at_id_idx"),
+            GinIndex(fields=["search_vector"], name="course_search_vector_idx"),
+            GinIndex(fields=["lessons_search_vector"], name="course_lessons_vector_idx"),
+        ]
 
 
 class Lesson(models.Model):
     name = models.CharField(max_length=255, verbose_name="Заголовок")
     description = models.TextField(verbose_name="Описание")
     image = models.ImageField(blank=True, null=True, upload_to="images/", verbose_name="Превью")
+    image_renditions = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Производные изображения превью"
+    )
     owner = models.ForeignKey(
         "users.User",
         on_delete=models.CASCADE,
@@ -49,7 +69,9 @@ class Lesson(models.Model):
         verbose_name="Курс",
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата изменения")
     order = models.PositiveIntegerField(default=0, verbose_name="Порядковый номер")
+    search_vector = SearchVectorField(null=True, editable=False, verbose_name="Поисковый вектор")
 
     def __str__(self):
         return f"{self.name} [Курс: {self.course.name}]"
@@ -57,7 +79,80 @@ class Lesson(models.Model):
     class Meta:
         verbose_name = "Урок"
         verbose_name_plural = "Уроки"
-        ordering = ["id"]
+        ordering = ["order", "id"]
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="lesson_created_at_id_idx"),
+            # Уроки курса по порядку и переход к соседнему уроку — один проход по индексу
+            models.Index(fields=["course", "order", "id"], name="lesson_course_order_idx"),
+        ]
+
+
+class LessonProgress(models.Model):
+    """
+    Прохождение урока пользователем. Записывается пачками из буфера отметок присутствия
+    (paperskill.progress), а не при каждой отметке
+    """
+
+    user = models.ForeignKey(
+        "users.User", on_delete=models.CASCADE, related_name="lesson_progress", verbose_name="Пользователь"
+    )
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name="progress", verbose_name="Урок")
+    seconds_spent = models.PositiveIntegerField(default=0, verbose_name="Время на уроке, с")
+    completed_at = models.DateTimeField(blank=True, null=True, verbose_name="Дата прохождения")
+    updated_at = models.DateTimeField(default=timezone.now, verbose_name="Последняя активность")
+
+    def __str__(self):
+        return f"{self.user} - {self.lesson_id} [{self.seconds_spent} с]"
+
+    class Meta:
+        verbose_name = "Прохождение урока"
+        verbose_name_plural = "Прохождение уроков"
+        constraints = [models.UniqueConstraint(fields=["user", "lesson"], name="lessonprogress_user_lesson_uniq")]
+
+
+class CourseProgress(models.Model):
+    """Количество пройденных уроков курса: меняется на число новых прохождений при записи буфера"""
+
+    user = models.ForeignKey(
+        "users.User", on_delete=models.CASCADE, related_name="course_progress", verbose_name="Пользователь"
+    )
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name="progress", verbose_name="Курс")
+    completed_lessons = models.PositiveIntegerField(default=0, verbose_name="Пройдено уроков")
+    updated_at = models.DateTimeField(default=timezone.now, verbose_name="Последняя активность")
+
+    def __str__(self):
+        return f"{self.user} - {self.course_id} [{self.completed_lessons}]"
+
+    @property
+    def percent(self):
+        """Процент прохождения курса (нужен course.lesson_count)"""
+        if not self.course.lesson_count:
+            return 0
+        return min(100, self.completed_lessons * 100 // self.course.lesson_count)
+
+    class Meta:
+        verbose_name = "Прохождение курса"
+        verbose_name_plural = "Прохождение курсов"
+        constraints = [models.UniqueConstraint(fields=["user", "course"], name="courseprogress_user_course_uniq")]
+
+
+class MediaBlob(models.Model):
+    """Файл хранилища по содержимому и количество ссылок на него из моделей"""
+
+    name = models.CharField(max_length=255, unique=True, verbose_name="Файл")
+    size = models.PositiveBigIntegerField(verbose_name="Размер")
+    refcount = models.PositiveIntegerField(default=0, verbose_name="Количество ссылок")
+    saved_at = models.DateTimeField(default=timezone.now, verbose_name="Последняя загрузка")
+
+    def __str__(self):
+        return f"{self.name} [Ссылок: {self.refcount}]"
+
+    class Meta:
+        verbose_name = "Медиафайл"
+        verbose_name_plural = "Медиафайлы"
+        indexes = [
+            models.Index(fields=["saved_at"], condition=models.Q(refcount=0), name="mediablob_unreferenced_idx"),
+        ]
 
 
 # class CourseSubscription(models.Model):
@@ -1,13 +1,180 @@
-from rest_framework.pagination import PageNumberPagination
+import json
 
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import OperationalError, connections, transaction
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
 
-class CoursePagination(PageNumberPagination):
-    page_size = 10
-    page_size_query_param = "page_size"
-    max_page_size = 50
+from paperskill.services import estimate_count
 
 
-class LessonPagination(PageNumberPagination):
+class KeysetPagination(CursorPagination):
+    """
+    Курсорная пагинация по составному ключу (поле сортировки, id).
+    Следующая страница выбирается условием по индексу, без OFFSET.
+    """
+
     page_size = 10
     page_size_query_param = "page_size"
     max_page_size = 50
+    ordering = ("-created_at", "-id")
+
+    def get_ordering(self, request, queryset, view):
+        """Сортировка по первому полю (в том числе из OrderingFilter) с id для уникальности ключа"""
+        ordering = super().get_ordering(request, queryset, view)
+        field = ordering[0]
+        if field.lstrip("-") in ("id", "pk"):
+            return (field,)
+        return (field, "-id" if field.startswith("-") else "id")
+
+    def _get_position_from_instance(self, instance, ordering):
+        """Позиция курсора: значение поля сортировки и id через разделитель"""
+        field_name = ordering[0].lstrip("-")
+        value = instance[field_name] if isinstance(instance, dict) else getattr(instance, field_name)
+        pk = instance["id"] if isinstance(instance, dict) else instance.pk
+        if hasattr(value, "isoformat"):
+            value = value.isoformat()
+        if len(ordering) == 1:
+            return str(value)
+        return f"{value}|{pk}"
+
+    def _filter_by_position(self, queryset, position):
+        """Условие «после позиции курсора» в порядке текущей сортировки"""
+        order = self.ordering[0]
+        field_name = order.lstrip("-")
+        lookup = "lt" if self.cursor.reverse != order.startswith("-") else "gt"
+
+        try:
+            if len(self.ordering) == 1:
+                return queryset.filter(**{f"{field_name}__{lookup}": position})
+
+            value, _, pk = position.rpartition("|")
+            if not pk.isdigit():
+                raise ValueError(position)
+            return queryset.filter(
+                Q(**{f"{field_name}__{lookup}e": value})
+                & (Q(**{f"{field_name}__{lookup}": value}) | Q(**{field_name: value, f"id__{lookup}": pk}))
+            )
+        except (ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """
+        Запрос одной страницы без выполнения: вместе с set_page позволяет выбрать записи
+        асинхронно (async for) и не дублировать логику курсора
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            self.current_position, self.reverse = None, False
+        else:
+            _, self.reverse, self.current_position = self.cursor
+
+        if self.reverse:
+            queryset = queryset.order_by(*[o[1:] if o.startswith("-") else f"-{o}" for o in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if self.current_position is not None:
+            queryset = self._filter_by_position(queryset, self.current_position)
+
+        # Ключ уникален, поэтому смещение в курсоре не используется; берём на одну запись больше,
+        # чтобы понять, есть ли следующая страница
+        return queryset[: self.page_size + 1]
+
+    def set_page(self, results):
+        """Формирует страницу и позиции соседних страниц из результатов get_page_queryset"""
+        current_position = self.current_position
+        self.page = list(results[: self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if self.reverse:
+            self.page = list(reversed(self.page))
+
+            self.has_next = current_position is not None
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+
+class CoursePagination(KeysetPagination):
+    ordering = ("-created_at", "-id")
+
+
+class LessonPagination(KeysetPagination):
+    ordering = ("-created_at", "-id")
+
+
+class PaymentPagination(KeysetPagination):
+    ordering = ("-payment_date", "-id")
+
+
+class UserPagination(KeysetPagination):
+    ordering = ("-date_joined", "-id")
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор админки для таблиц с миллионами строк.
+    Без фильтров количество берётся из статистики PostgreSQL (pg_class.reltuples), с фильтрами COUNT(*)
+    выполняется с ограничением ADMIN_COUNT_TIMEOUT, а при превышении используется оценка планировщика
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if connections[queryset.db].vendor != "postgresql":
+            return super().count
+
+        if not queryset.query.where:
+            estimate = estimate_count(queryset.model)
+            if estimate is not None and estimate >= settings.ADMIN_ESTIMATE_COUNT_THRESHOLD:
+                return estimate
+
+        try:
+            with transaction.atomic(using=queryset.db):
+                with connections[queryset.db].cursor() as cursor:
+                    cursor.execute(
+                        "SELECT set_config('statement_timeout', %s, true)", [str(settings.ADMIN_COUNT_TIMEOUT)]
+                    )
+                return queryset.count()
+        except OperationalError:
+            plan = json.loads(queryset.order_by().explain(format="json"))
+            return int(plan[0]["Plan"]["Plan Rows"])
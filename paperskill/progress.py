@@ -0,0 +1,284 @@
+"""
+Прохождение уроков. Клиент, пока урок открыт, каждые несколько секунд присылает отметку присутствия (heartbeat).
+Отметки не пишутся в БД по одной: они копятся в буфере процесса, где отметки одного пользователя
+по одному уроку складываются в одну запись, и раз в PROGRESS_FLUSH_INTERVAL секунд (или при заполнении буфера)
+записываются несколькими пакетными INSERT ... ON CONFLICT. Раз в PROGRESS_FLUSH_INTERVAL буфер записывает фоновый
+поток процесса, поэтому при аварийной остановке воркера (SIGKILL) теряются отметки не более чем за этот интервал.
+Процент прохождения курса не пересчитывается по урокам: счётчик CourseProgress.completed_lessons увеличивается
+на число новых прохождений в пачке
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from paperskill.models import Course, CourseProgress, Lesson, LessonProgress
+from paperskill.services import invalidate_dashboards
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressBuffer:
+    """
+    Отметки присутствия, ещё не записанные в БД: {(id пользователя, id урока): (секунды, дата прохождения,
+    последняя отметка)}. Время последней отметки хранится и после записи буфера, пока по нему ещё считается
+    время следующей. Общий для потоков процесса; у каждого процесса свой буфер
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._seen = {}
+        self._flushed_at = time.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, user_id, lesson_id, seconds=0, completed=False, now=None):
+        now = now or timezone.now()
+        with self._lock:
+            self._merge(user_id, lesson_id, seconds, now if completed else None, now)
+
+    def add_heartbeat(self, user_id, lesson_id, seconds, now, seen_at=None):
+        """
+        Добавляет отметку присутствия и возвращает засчитанные секунды: не больше присланных клиентом,
+        прошедших с прошлой отметки (в процессе или seen_at из БД) и PROGRESS_HEARTBEAT_MAX_SECONDS.
+        Без прошлой отметки время не засчитывается, отметка только запоминается
+        """
+        with self._lock:
+            last_seen = max(filter(None, [self._seen.get((user_id, lesson_id)), seen_at]), default=now)
+            elapsed = max((now - last_seen).total_seconds(), 0)
+            seconds = int(min(seconds, elapsed, settings.PROGRESS_HEARTBEAT_MAX_SECONDS))
+            self._merge(user_id, lesson_id, seconds, None, now)
+        return seconds
+
+    def last_seen(self, user_id, lesson_id):
+        return self._seen.get((user_id, lesson_id))
+
+    def pending_seconds(self, user_id, lesson_id):
+        """Секунды на уроке, ещё не записанные в БД"""
+        with self._lock:
+            return self._entries.get((user_id, lesson_id), (0, None, None))[0]
+
+    def _merge(self, user_id, lesson_id, seconds, completed_at, seen_at):
+        key = (user_id, lesson_id)
+        if key in self._entries:
+            old_seconds, old_completed_at, old_seen_at = self._entries[key]
+            seconds += old_seconds
+            completed_at = old_completed_at or completed_at
+            seen_at = max(old_seen_at, seen_at)
+        self._entries[key] = (seconds, completed_at, seen_at)
+        self._seen[key] = max(self._seen.get(key, seen_at), seen_at)
+
+    def is_due(self):
+        """Пора ли записывать буфер: он заполнен или с прошлой записи прошло PROGRESS_FLUSH_INTERVAL секунд"""
+        return bool(self._entries) and (
+            len(self._entries) >= settings.PROGRESS_BUFFER_MAX_SIZE
+            or time.monotonic() - self._flushed_at >= settings.PROGRESS_FLUSH_INTERVAL
+        )
+
+    def flush(self):
+        """Записывает накопленные отметки в БД. Если запись не удалась, отметки возвращаются в буфер"""
+        with self._lock:
+            entries, self._entries = self._entries, {}
+            self._flushed_at = time.monotonic()
+            # По более старой отметке время всё равно ограничено PROGRESS_HEARTBEAT_MAX_SECONDS
+            expired = timezone.now() - timedelta(seconds=settings.PROGRESS_HEARTBEAT_MAX_SECONDS)
+            self._seen = {key: seen_at for key, seen_at in self._seen.items() if seen_at > expired}
+        if not entries:
+            return 0
+
+        try:
+            write_progress(entries)
+        except DatabaseError:
+            logger.exception("Не удалось записать прохождение уроков, отметок в буфере: %s", len(entries))
+            with self._lock:
+                for (user_id, lesson_id), entry in entries.items():
+                    self._merge(user_id, lesson_id, *entry)
+            return 0
+        return len(entries)
+
+
+class ProgressFlusher:
+    """
+    Поток, который раз в PROGRESS_FLUSH_INTERVAL секунд записывает буфер, не дожидаясь следующей отметки:
+    иначе отметки простаивающего воркера лежали бы в памяти до его следующего запроса.
+    Запускается при первой отметке в процессе и заново в дочернем процессе после fork
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stopped = threading.Event()
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name="progress-flusher", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(settings.PROGRESS_FLUSH_INTERVAL):
+            if not self.buffer.is_due():
+                continue
+            try:
+                self.buffer.flush()
+            except Exception:
+                logger.exception("Не удалось записать прохождение уроков")
+            finally:
+                # Соединение потока с БД закрывается по тем же правилам (CONN_MAX_AGE), что и после запроса
+                close_old_connections()
+
+
+buffer = ProgressBuffer()
+flusher = ProgressFlusher(buffer)
+# Остаток буфера записывается при остановке процесса (перезапуск воркеров)
+atexit.register(buffer.flush)
+
+
+def record_heartbeat(user_id, lesson_id, seconds=0, completed=False):
+    """
+    Учитывает отметку присутствия на уроке. Засчитывается время, прошедшее на сервере с прошлой отметки
+    (из буфера процесса, иначе из LessonProgress.updated_at), не больше присланного клиентом
+    и PROGRESS_HEARTBEAT_MAX_SECONDS. Урок засчитывается пройденным только после PROGRESS_COMPLETE_MIN_SECONDS
+    на нём; возвращает, принято ли прохождение. Прохождение записывается сразу вместе со всем буфером —
+    такие отметки редки, а пользователь ждёт увидеть урок пройденным
+    """
+    flusher.ensure_started()
+    # БД читается, только если процесс ещё не видел отметок по уроку или нужно проверить время для прохождения
+    stored_seen_at, stored_seconds = None, 0
+    if completed or buffer.last_seen(user_id, lesson_id) is None:
+        progress = LessonProgress.objects.filter(user_id=user_id, lesson_id=lesson_id)
+        stored_seen_at, stored_seconds = progress.values_list("updated_at", "seconds_spent").first() or (None, 0)
+
+    buffer.add_heartbeat(user_id, lesson_id, seconds, timezone.now(), stored_seen_at)
+    if completed:
+        spent = stored_seconds + buffer.pending_seconds(user_id, lesson_id)
+        completed = spent >= settings.PROGRESS_COMPLETE_MIN_SECONDS
+    if completed:
+        buffer.add(user_id, lesson_id, completed=True)
+    if completed or buffer.is_due():
+        buffer.flush()
+    return completed
+
+
+def _values(rows):
+    """Шаблон VALUES (%s, ...), (%s, ...) и плоский список параметров"""
+    rows = list(rows)
+    placeholders = ", ".join(["(" + ", ".join(["%s"] * len(rows[0])) + ")"] * len(rows))
+    return placeholders, [value for row in rows for value in row]
+
+
+@transaction.atomic
+def write_progress(entries):
+    """
+    Пакетная запись отметок {(id пользователя, id урока): (секунды, дата прохождения или None, последняя отметка)}:
+    время на уроках и новые прохождения — двумя запросами на всю пачку, счётчики курсов — одним.
+    Отметки по удалённым урокам и пользователям отбрасываются
+    """
+    lesson_courses = dict(Lesson.objects.filter(pk__in={key[1] for key in entries}).values_list("id", "course_id"))
+    user_ids = set(get_user_model().objects.filter(pk__in={key[0] for key in entries}).values_list("pk", flat=True))
+    # Строки блокируются в одном порядке, иначе параллельная запись двух буферов могла бы взаимно заблокироваться
+    entries = {key: entries[key] for key in sorted(entries) if key[0] in user_ids and key[1] in lesson_courses}
+    if not entries:
+        return
+
+    progress_table = connection.ops.quote_name(LessonProgress._meta.db_table)
+    course_progress_table = connection.ops.quote_name(CourseProgress._meta.db_table)
+
+    with connection.cursor() as cursor:
+        values, params = _values(
+            (user_id, lesson_id, seconds, seen_at) for (user_id, lesson_id), (seconds, _, seen_at) in entries.items()
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO {progress_table} (user_id, lesson_id, seconds_spent, updated_at)
+            SELECT v.user_id::bigint, v.lesson_id::bigint, v.seconds::integer, v.seen_at::timestamptz
+            FROM (VALUES {values}) AS v (user_id, lesson_id, seconds, seen_at)
+            ON CONFLICT (user_id, lesson_id) DO UPDATE SET
+                seconds_spent = {progress_table}.seconds_spent + EXCLUDED.seconds_spent,
+                updated_at = GREATEST({progress_table}.updated_at, EXCLUDED.updated_at)
+            """,
+            params,
+        )
+
+        completions = [(*key, completed_at) for key, (_, completed_at, _) in entries.items() if completed_at]
+        completed = []
+        if completions:
+            # Условие completed_at IS NULL перепроверяется после ожидания блокировки строки,
+            # поэтому при параллельной записи двух буферов прохождение засчитывается один раз
+            values, params = _values(completions)
+            cursor.execute(
+                f"""
+                UPDATE {progress_table} AS p SET completed_at = v.completed_at::timestamptz
+                FROM (VALUES {values}) AS v (user_id, lesson_id, completed_at)
+                WHERE p.user_id = v.user_id::bigint AND p.lesson_id = v.lesson_id::bigint
+                    AND p.completed_at IS NULL
+                RETURNING p.user_id, p.lesson_id
+                """,
+                params,
+            )
+            completed = cursor.fetchall()
+
+        completed_counts = Counter((user_id, lesson_courses[lesson_id]) for user_id, lesson_id in completed)
+        course_seen = {}
+        for (user_id, lesson_id), (_, _, seen_at) in entries.items():
+            key = (user_id, lesson_courses[lesson_id])
+            course_seen[key] = max(course_seen.get(key, seen_at), seen_at)
+        values, params = _values(
+            (user_id, course_id, completed_counts[user_id, course_id], seen_at)
+            for (user_id, course_id), seen_at in sorted(course_seen.items())
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO {course_progress_table} (user_id, course_id, completed_lessons, updated_at)
+            SELECT v.user_id::bigint, v.course_id::bigint, v.completed::integer, v.seen_at::timestamptz
+            FROM (VALUES {values}) AS v (user_id, course_id, completed, seen_at)
+            ON CONFLICT (user_id, course_id) DO UPDATE SET
+                completed_lessons = {course_progress_table}.completed_lessons + EXCLUDED.completed_lessons,
+                updated_at = GREATEST({course_progress_table}.updated_at, EXCLUDED.updated_at)
+            RETURNING user_id, course_id, completed_lessons, xmax = 0
+            """,
+            params,
+        )
+        rows = cursor.fetchall()
+
+    counts = {(user_id, course_id): count for user_id, course_id, count, _ in rows}
+    _mark_completed_courses({key: counts[key] for key in completed_counts if key in counts})
+    # Панель обучения меняется, когда курс начат (новая строка, xmax = 0) или пройден новый урок;
+    # время последнего занятия обновится по истечении DASHBOARD_CACHE_TIMEOUT
+    changed_users = {user_id for user_id, _, _, created in rows if created} | {key[0] for key in completed_counts}
+    transaction.on_commit(lambda: invalidate_dashboards(*changed_users))
+
+
+def _mark_completed_courses(counts):
+    """Добавляет в User.completed_courses курсы, все уроки которых пройдены ({(пользователь, курс): пройдено})"""
+    if not counts:
+        return
+    lesson_counts = dict(
+        Course.objects.filter(pk__in={course_id for _, course_id in counts}).values_list("id", "lesson_count")
+    )
+    through = get_user_model().completed_courses.through
+    through.objects.bulk_create(
+        [
+            through(user_id=user_id, course_id=course_id)
+            for (user_id, course_id), completed in counts.items()
+            if 0 < lesson_counts.get(course_id, 0) <= completed
+        ],
+        ignore_conflicts=True,
+    )
@@ -0,0 +1,43 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # orjson — в зависимостях проекта; в окружении без него ответ формирует JSONRenderer
+    orjson = None
+
+JSONL_CONTENT_TYPE = "application/x-ndjson"
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на orjson с тем же результатом для ответов API: компактный UTF-8 JSON,
+    U+2028/U+2029 экранированы, даты и Decimal — через JSONEncoder DRF. orjson пишет числа с плавающей точкой
+    от 1e-5 до 1e-4 без экспоненты, поэтому для ответов с float (ранг поиска) остаётся JSONRenderer
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            content = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS,
+            )
+        except TypeError:
+            # Ключи не строки, целые больше 64 бит и прочее, что orjson не записывает
+            return super().render(data, accepted_media_type, renderer_context)
+        return content.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+
+
+def render_jsonl(items):
+    """Записи в формате JSON Lines: по одному компактному JSON на строку"""
+    renderer = FastJSONRenderer()
+    return b"".join(renderer.render(item) + b"\n" for item in items)
@@ -1,24 +1,192 @@
 import re
+from functools import partial
+from itertools import islice
 
-from rest_framework import serializers
+from django.core.exceptions import FieldDoesNotExist
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import ManyToOneRel
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.settings import api_settings
 
-from .models import Course, Lesson
+from .models import Course, Lesson, LessonProgress
+from .services import bulk_create_lessons, bulk_update_lessons, get_entitlements
 from .validators import UrlValidator
 
+# Сколько уроков можно создать или изменить одним запросом
+LESSON_BULK_MAX_ITEMS = 1000
+
+
+class DynamicFieldsMixin:
+    """Позволяет ограничить набор полей сериализатора аргументом fields"""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop("fields", None)
+        super().__init__(*args, **kwargs)
+
+        if fields:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+
+def _to_pk(model, value):
+    """Первичный ключ из значения запроса или None, если значение им быть не может"""
+    if isinstance(value, bool):
+        return None
+    try:
+        return model._meta.pk.to_python(value)
+    except DjangoValidationError:
+        return None
+
+
+class PreloadedPrimaryKeyRelatedField(PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField, который при проверке списка берёт объекты из выбранных заранее одним запросом
+    (preloaded — {pk: объект}), а не выполняет запрос на каждый элемент
+    """
+
+    preloaded = None
+
+    def to_internal_value(self, data):
+        if self.preloaded is None or self.pk_field is not None:
+            return super().to_internal_value(data)
+        pk = _to_pk(self.get_queryset().model, data)
+        if pk is None:
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        if pk not in self.preloaded:
+            self.fail("does_not_exist", pk_value=data)
+        return self.preloaded[pk]
+
+    def preload(self, values):
+        """Выбирает одним запросом объекты для всех значений поля из списка"""
+        model = self.get_queryset().model
+        self.preloaded = self.get_queryset().in_bulk({pk for pk in (_to_pk(model, v) for v in values) if pk})
+
 
 class LessonSerializer(serializers.ModelSerializer):
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
+
     class Meta:
         model = Lesson
         fields = "__all__"
         read_only_fields = ["created_at", "owner"]
 
 
-class CourseSerializer(serializers.ModelSerializer):
-    lesson_count = serializers.IntegerField(read_only=True)
-    lessons = LessonSerializer(many=True, read_only=True)
+class LessonBulkSerializer(serializers.ListSerializer):
+    """
+    Создание и частичное изменение списка уроков одним запросом. Все элементы проверяются вместе:
+    курсы и изменяемые уроки выбираются одним запросом на весь список, права проверяются по каждому уроку.
+    Ошибки возвращаются по номерам элементов ({"3": {"course": [...]}}), при любой ошибке ничего не сохраняется
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            message = self.error_messages["not_a_list"].format(input_type=type(data).__name__)
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code="not_a_list")
+        if not data:
+            raise serializers.ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: [self.error_messages["empty"]]}, code="empty"
+            )
+        if self.max_length is not None and len(data) > self.max_length:
+            message = self.error_messages["max_length"].format(max_length=self.max_length)
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code="max_length")
+
+        items = [item for item in data if isinstance(item, dict)]
+        self.child.fields["course"].preload(item.get("course") for item in items)
+        if self.partial:
+            lesson_ids = {pk for pk in (_to_pk(Lesson, item.get("id")) for item in items) if pk}
+            self._lessons = Lesson.objects.select_related("course").in_bulk(lesson_ids)
+            self._seen_ids = set()
+        self._entitlements = get_entitlements(self.context["request"].user)
+
+        validated, errors = [], {}
+        for index, item in enumerate(data):
+            try:
+                validated.append(self.run_child_validation(item))
+            except serializers.ValidationError as exc:
+                errors[str(index)] = exc.detail
+        if errors:
+            raise serializers.ValidationError(errors)
+        return validated
+
+    def run_child_validation(self, data):
+        """Значения нового урока или, при изменении, пара (урок из БД, новые значения)"""
+        if not self.partial or not isinstance(data, dict):
+            attrs = self.child.run_validation(data)
+            self._check_course(attrs.get("course"))
+            return attrs
+
+        lesson_id = _to_pk(Lesson, data.get("id"))
+        lesson = self._lessons.get(lesson_id)
+        if lesson is None:
+            raise serializers.ValidationError({"id": ["Урок не найден"]})
+        if lesson_id in self._seen_ids:
+            raise serializers.ValidationError({"id": ["Урок указан в списке несколько раз"]})
+        self._seen_ids.add(lesson_id)
+        self._check_course(lesson.course)
+
+        self.child.instance = lesson
+        try:
+            attrs = self.child.run_validation(data)
+        finally:
+            self.child.instance = None
+        self._check_course(attrs.get("course"))
+        return lesson, attrs
+
+    def _check_course(self, course):
+        if course is not None and not self._entitlements.is_owner(course):
+            raise serializers.ValidationError({"course": ["Изменять уроки курса может только его владелец"]})
+
+    def save(self, **kwargs):
+        if self.partial:
+            changes = []
+            for lesson, attrs in self.validated_data:
+                old_course_id = lesson.course_id
+                for field, value in {**attrs, **kwargs}.items():
+                    setattr(lesson, field, value)
+                changes.append((lesson, [*attrs, *kwargs], old_course_id))
+            self.instance = bulk_update_lessons(changes)
+        else:
+            self.instance = bulk_create_lessons([Lesson(**attrs, **kwargs) for attrs in self.validated_data])
+        return self.instance
+
+
+class LessonBulkItemSerializer(LessonSerializer):
+    """Урок в массовом создании и изменении: файлы передаются только по одному, поэтому image — только для чтения"""
+
+    class Meta(LessonSerializer.Meta):
+        read_only_fields = LessonSerializer.Meta.read_only_fields + ["image"]
+        list_serializer_class = LessonBulkSerializer
+
+
+class LessonNeighbourSerializer(serializers.ModelSerializer):
+    """Соседний урок курса для перехода вперёд и назад"""
+
+    class Meta:
+        model = Lesson
+        fields = ["id", "name", "order", "course"]
+        read_only_fields = fields
+
+
+class HeartbeatSerializer(serializers.Serializer):
+    """
+    Отметка присутствия на уроке: секунды с прошлой отметки по данным клиента и признак прохождения урока.
+    Засчитывается не больше времени, прошедшего с прошлой отметки на сервере (paperskill.progress.record_heartbeat)
+    """
+
+    seconds = serializers.IntegerField(min_value=0, default=0)
+    completed = serializers.BooleanField(default=False)
+
+
+class LessonProgressSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LessonProgress
+        fields = ["lesson", "seconds_spent", "completed_at", "updated_at"]
+        read_only_fields = fields
+
 
-    def get_lesson_count(self, obj):
-        return obj.lessons.count()
+class CourseSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    lessons = LessonSerializer(many=True, read_only=True)
 
     def validate(self, attrs):
         video_url = attrs.get("video_url")
@@ -31,3 +199,231 @@ class CourseSerializer(serializers.ModelSerializer):
         fields = "__all__"
         validators = [UrlValidator(field="video_url")]
         read_only_fields = ["created_at", "owner"]
+
+
+class CourseSummarySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Краткое представление курса для списка: без описания и уроков"""
+
+    class Meta:
+        model = Course
+        fields = [
+            "id",
+            "name",
+            "image",
+            "video_url",
+            "owner",
+            "created_at",
+            "is_paid",
+            "price",
+            "category",
+            "lesson_count",
+        ]
+        read_only_fields = fields
+
+
+class LessonMatchSerializer(serializers.ModelSerializer):
+    """Урок, совпавший с поисковым запросом"""
+
+    name_highlight = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Lesson
+        fields = ["id", "name", "order", "name_highlight"]
+        read_only_fields = fields
+
+
+class CourseSearchSerializer(CourseSummarySerializer):
+    """Результат поиска: краткое представление курса, ранг и фрагменты с подсветкой совпадений (<mark>)"""
+
+    rank = serializers.FloatField(read_only=True)
+    name_highlight = serializers.CharField(read_only=True)
+    snippet = serializers.CharField(read_only=True)
+    lessons = LessonMatchSerializer(source="matched_lessons", many=True, read_only=True)
+
+    class Meta(CourseSummarySerializer.Meta):
+        fields = CourseSummarySerializer.Meta.fields + ["rank", "name_highlight", "snippet", "lessons"]
+        read_only_fields = fields
+
+
+# BigIntegerField (с COERCE_BIGINT_TO_STRING) появился в DRF 3.17; в более ранних версиях его нет
+_BIGINT_FIELDS = (serializers.BigIntegerField,) if hasattr(serializers, "BigIntegerField") else ()
+# Поля, значение которых из .values() уже совпадает с представлением DRF
+_IDENTITY_FIELDS = (serializers.CharField, serializers.BooleanField, serializers.JSONField, serializers.IntegerField)
+
+
+def _file_url(storage, request, name):
+    """Представление FileField/ImageField по имени файла, как FileField.to_representation"""
+    if not name:
+        return None
+    url = storage.url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def _datetime_converter(field):
+    """
+    DateTimeField.to_representation с часовым поясом, определённым один раз: поиск текущего пояса
+    на каждое значение занимает большую часть времени сериализации списка
+    """
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, "timezone") else field.default_timezone()
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        return value.removesuffix("+00:00") + "Z" if value.endswith("+00:00") else value
+
+    return convert
+
+
+class ValuesSerializer:
+    """
+    Быстрое представление списка только для чтения: строки собираются из словарей .values()
+    без создания моделей и обхода полей сериализатора для каждой записи.
+    Преобразование значения каждого поля выбирается один раз по полю исходного сериализатора,
+    поэтому результат совпадает с serializer.data. Вложенные списки (lessons) и списки id связей many-to-many
+    выбираются одним запросом на поле.
+    Если у сериализатора есть поля, которые так представить нельзя, for_serializer возвращает None
+    """
+
+    class Unsupported(Exception):
+        pass
+
+    def __init__(self, serializer):
+        self.model = serializer.Meta.model
+        self.pk_name = self.model._meta.pk.attname
+        self.plan = []
+        self.nested = []
+        self.many_ids = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.ListSerializer):
+                relation = self._get_model_field(field.source)
+                if not isinstance(relation, ManyToOneRel):
+                    raise self.Unsupported(name)
+                self.nested.append((name, ValuesSerializer(field.child), relation.field.attname))
+                self.plan.append((name, self.pk_name, None))
+            elif isinstance(field, serializers.ManyRelatedField):
+                relation = self._get_model_field(field.source)
+                child = field.child_relation
+                if not relation.many_to_many or not isinstance(child, PrimaryKeyRelatedField) or child.pk_field:
+                    raise self.Unsupported(name)
+                self.many_ids.append((name, relation))
+                self.plan.append((name, self.pk_name, None))
+            else:
+                self.plan.append((name, field.source, self._get_converter(field)))
+        self.sources = list(dict.fromkeys(source for _, source, _ in self.plan))
+
+    @classmethod
+    def for_serializer(cls, serializer):
+        try:
+            return cls(serializer)
+        except cls.Unsupported:
+            return None
+
+    def _get_model_field(self, source):
+        try:
+            return self.model._meta.get_field(source)
+        except FieldDoesNotExist:
+            raise self.Unsupported(source)
+
+    def _get_converter(self, field):
+        """Функция значение -> представление (None — значение не меняется)"""
+        model_field = self._get_model_field(field.source)
+        if isinstance(model_field, ManyToOneRel) or model_field.many_to_many:
+            raise self.Unsupported(field.field_name)
+        if isinstance(field, PrimaryKeyRelatedField):
+            if field.pk_field is not None:
+                raise self.Unsupported(field.field_name)
+            return None
+        if isinstance(field, serializers.FileField):
+            if not getattr(field, "use_url", api_settings.UPLOADED_FILES_USE_URL):
+                return None
+            return partial(_file_url, model_field.storage, field.context.get("request"))
+        if isinstance(field, serializers.DateTimeField):
+            return _datetime_converter(field)
+        if isinstance(field, serializers.ModelField):
+            # ModelField.to_representation: model_field.value_to_string, т. е. str() значения
+            return str
+        if isinstance(field, (serializers.RelatedField, serializers.SerializerMethodField, serializers.HiddenField)):
+            raise self.Unsupported(field.field_name)
+        if isinstance(field, _BIGINT_FIELDS) and getattr(
+            field, "coerce_to_string", api_settings.COERCE_BIGINT_TO_STRING
+        ):
+            return str
+        if isinstance(field, serializers.JSONField) and field.binary:
+            return field.to_representation
+        if isinstance(field, serializers.CharField) and hasattr(model_field, "from_db_value"):
+            # Значение из БД — объект (например, PhoneNumber), а не строка
+            return field.to_representation
+        if isinstance(field, _IDENTITY_FIELDS):
+            return None
+        if isinstance(field, serializers.ChoiceField) and all(isinstance(key, str) for key in field.choices):
+            return None
+        # Даты, десятичные и прочие значения: to_representation поля, но без самого сериализатора
+        return field.to_representation
+
+    def values(self, queryset, *extra):
+        """Запрос словарей с полями, нужными для представления (и extra, например, для позиции курсора)"""
+        return queryset.prefetch_related(None).values(*dict.fromkeys([*self.sources, *extra]))
+
+    def _load_children(self, rows, child, parent_attname, using):
+        """Представления вложенных записей по id родителя одним запросом"""
+        groups = {}
+        parent_ids = [row[self.pk_name] for row in rows]
+        if parent_ids:
+            queryset = child.model._default_manager.db_manager(using).filter(**{f"{parent_attname}__in": parent_ids})
+            child_rows = list(child.values(queryset, parent_attname))
+            for child_row, item in zip(child_rows, child.to_representation(child_rows, using)):
+                groups.setdefault(child_row[parent_attname], []).append(item)
+        return lambda pk: groups.get(pk, [])
+
+    def _load_related_ids(self, rows, relation, using):
+        """Списки id связанных записей (many-to-many) по id родителя одним запросом, в порядке связанной модели"""
+        groups = {}
+        parent_ids = [row[self.pk_name] for row in rows]
+        if parent_ids:
+            # Имя связи со стороны связанной модели обратно к этой
+            query_name = relation.related_query_name() if relation.concrete else relation.field.name
+            pairs = (
+                relation.related_model._default_manager.db_manager(using)
+                .filter(**{f"{query_name}__in": parent_ids})
+                .values_list(query_name, "pk")
+            )
+            for parent_id, related_id in pairs:
+                groups.setdefault(parent_id, []).append(related_id)
+        return lambda pk: groups.get(pk, [])
+
+    def to_representation(self, rows, using=None):
+        """
+        Представления строк .values(); вложенные списки и id связей many-to-many дозапрашиваются
+        из БД using (None — по роутеру)
+        """
+        plan = self.plan
+        if self.nested or self.many_ids:
+            children = {name: self._load_children(rows, child, attname, using) for name, child, attname in self.nested}
+            children.update({name: self._load_related_ids(rows, relation, using) for name, relation in self.many_ids})
+            plan = [(name, source, children.get(name, convert)) for name, source, convert in plan]
+
+        data = []
+        for row in rows:
+            item = {}
+            for name, source, convert in plan:
+                value = row[source]
+                item[name] = value if value is None or convert is None else convert(value)
+            data.append(item)
+        return data
+
+    def iter_chunks(self, queryset, chunk_size):
+        """
+        Представления всех записей запроса списками по chunk_size: строки читаются курсором на сервере БД
+        (iterator), вложенные данные дозапрашиваются на каждую часть из той же БД, поэтому память не растёт
+        с размером выборки
+        """
+        using = queryset.db
+        rows = self.values(queryset.using(using)).iterator(chunk_size=chunk_size)
+        while chunk := list(islice(rows, chunk_size)):
+            yield self.to_representation(chunk, using)
@@ -0,0 +1,462 @@
+import hashlib
+import re
+from collections import Counter
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.expressions import ArraySubquery
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector, SearchVectorField
+from django.core.cache import cache, caches
+from django.db import connection, transaction
+from django.db.models import Case, Count, Exists, F, Func, OuterRef, Q, Subquery, TextField, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from config.routers import replica_reads
+from paperskill.models import Course, CourseProgress, Lesson, LessonProgress
+
+ENTITLEMENTS_CACHE_KEY = "entitlements:{user_id}"
+DASHBOARD_CACHE_KEY = "dashboard:{user_id}"
+SITE_STATISTICS_CACHE_KEY = "site_statistics"
+LATEST_COURSES_CACHE_KEY = "latest_courses"
+LATEST_COURSES_CACHE_TIMEOUT = 60 * 60
+
+# Кэш готовых страниц для анонимных пользователей: ключ страницы включает текущие версии её тегов,
+# поэтому сброс тега (новая версия) делает недействительными все страницы с этим тегом сразу
+PAGE_CACHE_KEY = "page:{digest}"
+PAGE_CACHE_TAG_KEY = "page_tag:{tag}"
+# Страницы, на которых показан список курсов (главная, каталог)
+CATALOG_PAGE_TAG = "catalog"
+
+# Конфигурация russian в PostgreSQL обрабатывает кириллицу словарём russian_stem, а латиницу — english_stem,
+# поэтому одна конфигурация покрывает и русский, и английский текст
+SEARCH_CONFIG = "russian"
+# Сколько совпавших уроков показывать у каждого курса в результатах поиска
+SEARCH_LESSONS_PER_COURSE = 3
+# Надбавка к рангу курса за совпадение в его уроках (ниже типичного ts_rank совпадения в названии курса)
+LESSON_MATCH_RANK = 0.1
+
+
+class Entitlements:
+    """Курсы, к которым у пользователя есть доступ: купленные и собственные"""
+
+    def __init__(self, user, bought_ids=frozenset(), owned_ids=frozenset()):
+        self.user = user
+        self.bought_ids = bought_ids
+        self.owned_ids = owned_ids
+        self.course_ids = bought_ids | owned_ids
+
+    def has_course(self, course):
+        """Есть ли у пользователя доступ к урокам курса"""
+        if not self.user.is_authenticated:
+            return False
+        return not course.is_paid or self.user.is_superuser or course.id in self.course_ids
+
+    def is_bought(self, course):
+        """Куплен ли курс пользователем"""
+        return course.id in self.bought_ids
+
+    def is_owner(self, course):
+        """Является ли пользователь владельцем курса или суперпользователем"""
+        return self.user.is_authenticated and (course.id in self.owned_ids or self.user.is_superuser)
+
+
+def _load_course_ids(user):
+    """Загружает id купленных и собственных курсов пользователя из основной БД (реплика может отставать)"""
+    with replica_reads(False):
+        bought_ids = frozenset(user.bought_courses.values_list("id", flat=True))
+        owned_ids = frozenset(Course.objects.filter(owner_id=user.id).values_list("id", flat=True))
+    return bought_ids, owned_ids
+
+
+def get_entitlements(user):
+    """Возвращает права доступа пользователя из кэша, при промахе загружает их из БД"""
+    entitlements = getattr(user, "_entitlements", None)
+    if entitlements is not None:
+        return entitlements
+
+    if user.is_authenticated:
+        key = ENTITLEMENTS_CACHE_KEY.format(user_id=user.id)
+        course_ids = cache.get(key)
+        if course_ids is None:
+            course_ids = _load_course_ids(user)
+            cache.set(key, course_ids, settings.ENTITLEMENTS_CACHE_TIMEOUT)
+        entitlements = Entitlements(user, *course_ids)
+    else:
+        entitlements = Entitlements(user)
+
+    # Запоминаем на объекте пользователя, чтобы не ходить в кэш повторно в рамках запроса
+    user._entitlements = entitlements
+    return entitlements
+
+
+async def _aload_course_ids(user):
+    """Асинхронный вариант _load_course_ids"""
+    with replica_reads(False):
+        bought_ids = frozenset([pk async for pk in user.bought_courses.values_list("id", flat=True)])
+        owned_ids = frozenset(
+            [pk async for pk in Course.objects.filter(owner_id=user.id).values_list("id", flat=True)]
+        )
+    return bought_ids, owned_ids
+
+
+async def aget_entitlements(user):
+    """Асинхронный вариант get_entitlements для асинхронных представлений"""
+    entitlements = getattr(user, "_entitlements", None)
+    if entitlements is not None:
+        return entitlements
+
+    if user.is_authenticated:
+        key = ENTITLEMENTS_CACHE_KEY.format(user_id=user.id)
+        course_ids = await cache.aget(key)
+        if course_ids is None:
+            course_ids = await _aload_course_ids(user)
+            await cache.aset(key, course_ids, settings.ENTITLEMENTS_CACHE_TIMEOUT)
+        entitlements = Entitlements(user, *course_ids)
+    else:
+        entitlements = Entitlements(user)
+
+    user._entitlements = entitlements
+    return entitlements
+
+
+def invalidate_entitlements(*user_ids):
+    """Сбрасывает кэш прав доступа указанных пользователей"""
+    keys = [ENTITLEMENTS_CACHE_KEY.format(user_id=user_id) for user_id in user_ids if user_id is not None]
+    if keys:
+        cache.delete_many(keys)
+
+
+def invalidate_dashboards(*user_ids):
+    """Сбрасывает закэшированные панели обучения (профиль) указанных пользователей"""
+    keys = [DASHBOARD_CACHE_KEY.format(user_id=user_id) for user_id in user_ids if user_id is not None]
+    if keys:
+        cache.delete_many(keys)
+
+
+def touch_courses(*ids):
+    """Отмечает курсы изменёнными (updated_at), например при изменении их уроков: меняются ETag и Last-Modified"""
+    Course.objects.filter(pk__in=ids).update(updated_at=timezone.now())
+
+
+def change_lesson_counts(deltas):
+    """Атомарно изменяет счётчики уроков курсов ({id курса: изменение}) и отмечает курсы изменёнными"""
+    now = timezone.now()
+    for course_id, delta in deltas.items():
+        if delta:
+            Course.objects.filter(pk=course_id).update(
+                lesson_count=Greatest(F("lesson_count") + delta, 0), updated_at=now
+            )
+    invalidate_latest_courses()
+
+
+def recount_course_progress(*course_ids):
+    """
+    Пересчитывает счётчики пройденных уроков курсов по LessonProgress. Нужен, когда уроки удаляют
+    или переносят в другой курс — в остальных случаях счётчики меняются только приращениями
+    """
+    course_ids = [course_id for course_id in course_ids if course_id is not None]
+    if not course_ids:
+        return
+    counts = (
+        LessonProgress.objects.filter(
+            user_id=OuterRef("user_id"), lesson__course_id=OuterRef("course_id"), completed_at__isnull=False
+        )
+        .order_by()
+        .values("user_id")
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    with transaction.atomic():
+        CourseProgress.objects.filter(course_id__in=course_ids).update(completed_lessons=Coalesce(Subquery(counts), 0))
+        # Уроки, перенесённые из другого курса, могли быть пройдены пользователями без записи о новом курсе
+        missing = (
+            LessonProgress.objects.filter(lesson__course_id__in=course_ids, completed_at__isnull=False)
+            .exclude(
+                Exists(
+                    CourseProgress.objects.filter(user_id=OuterRef("user_id"), course_id=OuterRef("lesson__course_id"))
+                )
+            )
+            .order_by()
+            .values("user_id", "lesson__course_id")
+            .annotate(count=Count("*"))
+        )
+        CourseProgress.objects.bulk_create(
+            [
+                CourseProgress(
+                    user_id=row["user_id"], course_id=row["lesson__course_id"], completed_lessons=row["count"]
+                )
+                for row in missing
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def _lessons_written(lessons, course_ids, search_changed):
+    """
+    То, что при сохранении одного урока делают сигналы: поисковые векторы, updated_at курсов
+    и сброс закэшированных страниц после коммита
+    """
+    if search_changed:
+        update_search_vectors(Lesson, [lesson.pk for lesson in lessons])
+        update_search_vectors(Course, course_ids)
+    transaction.on_commit(lambda: invalidate_pages(*course_ids))
+
+
+@transaction.atomic
+def bulk_create_lessons(lessons):
+    """Создаёт уроки одним INSERT; сигналы post_save не вызываются, их работа выполняется здесь же"""
+    lessons = Lesson.objects.bulk_create(lessons)
+    counts = Counter(lesson.course_id for lesson in lessons)
+    change_lesson_counts(counts)
+    _lessons_written(lessons, set(counts), search_changed=True)
+    return lessons
+
+
+@transaction.atomic
+def bulk_update_lessons(changes):
+    """
+    Сохраняет изменения уроков: список (урок с новыми значениями, изменённые поля, прежний id курса).
+    Уроки с одинаковым набором полей обновляются одним UPDATE, остальные поля не перезаписываются
+    """
+    now = timezone.now()
+    groups = {}
+    deltas = Counter()
+    course_ids = set()
+    search_changed = False
+    for lesson, fields, old_course_id in changes:
+        course_ids |= {old_course_id, lesson.course_id}
+        if old_course_id != lesson.course_id:
+            deltas[old_course_id] -= 1
+            deltas[lesson.course_id] += 1
+        search_changed |= bool({"name", "description", "course"} & set(fields))
+        lesson.updated_at = now
+        groups.setdefault(frozenset(fields) | {"updated_at"}, []).append(lesson)
+
+    for fields, group in groups.items():
+        Lesson.objects.bulk_update(group, sorted(fields))
+    change_lesson_counts(deltas)
+    recount_course_progress(*(course_id for course_id, delta in deltas.items() if delta))
+    touch_courses(*course_ids)
+    lessons = [lesson for lesson, _, _ in changes]
+    _lessons_written(lessons, course_ids, search_changed)
+    return lessons
+
+
+def get_lesson_neighbours(lesson, fields=("id", "name", "order", "course_id")):
+    """
+    Предыдущий и следующий уроки курса в порядке (order, id) или None. Каждый выбирается отдельным запросом,
+    который читает из индекса lesson_course_order_idx одну строку, а не весь список уроков курса
+    """
+    siblings = Lesson.objects.filter(course_id=lesson.course_id).only(*fields)
+    # Условие order >= / <= задаёт границу просмотра индекса, OR по id только отсекает уроки с тем же order
+    previous = (
+        siblings.filter(Q(order__lt=lesson.order) | Q(order=lesson.order, id__lt=lesson.pk), order__lte=lesson.order)
+        .order_by("-order", "-id")
+        .first()
+    )
+    following = (
+        siblings.filter(Q(order__gt=lesson.order) | Q(order=lesson.order, id__gt=lesson.pk), order__gte=lesson.order)
+        .order_by("order", "id")
+        .first()
+    )
+    return previous, following
+
+
+def estimate_count(model):
+    """Оценка количества строк по статистике планировщика PostgreSQL (pg_class.reltuples)"""
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+        row = cursor.fetchone()
+    # reltuples = -1, если таблица ещё ни разу не анализировалась
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+def _count(model):
+    """Количество записей: оценка для больших таблиц в режиме SITE_STATISTICS_ESTIMATED, иначе COUNT(*)"""
+    if settings.SITE_STATISTICS_ESTIMATED:
+        estimate = estimate_count(model)
+        if estimate is not None and estimate >= settings.SITE_STATISTICS_ESTIMATE_THRESHOLD:
+            return estimate
+    return model.objects.count()
+
+
+def get_site_statistics():
+    """Статистика для главной страницы (количество курсов и студентов) из кэша"""
+    statistics = cache.get(SITE_STATISTICS_CACHE_KEY)
+    if statistics is None:
+        statistics = {
+            "courses_count": _count(Course),
+            "students_count": _count(get_user_model()),
+        }
+        cache.set(SITE_STATISTICS_CACHE_KEY, statistics, settings.SITE_STATISTICS_CACHE_TIMEOUT)
+    return statistics
+
+
+async def aget_site_statistics():
+    """Асинхронный вариант get_site_statistics: при попадании в кэш не занимает поток"""
+    statistics = await cache.aget(SITE_STATISTICS_CACHE_KEY)
+    if statistics is None:
+        statistics = await sync_to_async(get_site_statistics)()
+    return statistics
+
+
+async def aget_latest_courses_html():
+    """HTML-блок последних курсов главной страницы из кэша, при промахе рендерится заново"""
+    html = await cache.aget(LATEST_COURSES_CACHE_KEY)
+    if html is None:
+        courses = [course async for course in Course.objects.order_by("-created_at")[:3]]
+        html = render_to_string("paperskill/course/latest.html", {"courses": courses})
+        await cache.aset(LATEST_COURSES_CACHE_KEY, html, LATEST_COURSES_CACHE_TIMEOUT)
+    return mark_safe(html)
+
+
+def invalidate_latest_courses():
+    """Сбрасывает закэшированный блок последних курсов на главной странице"""
+    cache.delete(LATEST_COURSES_CACHE_KEY)
+
+
+def course_page_tag(course_id):
+    """Тег закэшированных страниц, на которых показан курс"""
+    return f"course:{course_id}"
+
+
+async def aget_page_cache_key(url, tags):
+    """Ключ закэшированной страницы: URL и текущие версии её тегов (отсутствующая версия создаётся)"""
+    page_cache = caches["pages"]
+    tag_keys = [PAGE_CACHE_TAG_KEY.format(tag=tag) for tag in tags]
+    versions = await page_cache.aget_many(tag_keys)
+    for key in tag_keys:
+        if key not in versions:
+            version = uuid4().hex
+            # Версию мог одновременно создать другой процесс: используем ту, что попала в кэш
+            if not await page_cache.aadd(key, version, None):
+                version = await page_cache.aget(key, version)
+            versions[key] = version
+    parts = [url, *(versions[key] for key in tag_keys)]
+    digest = hashlib.md5("\n".join(parts).encode(), usedforsecurity=False).hexdigest()
+    return PAGE_CACHE_KEY.format(digest=digest)
+
+
+def invalidate_pages(*course_ids):
+    """Сбрасывает закэшированные страницы каталога и страницы указанных курсов"""
+    tags = [CATALOG_PAGE_TAG, *(course_page_tag(course_id) for course_id in course_ids if course_id is not None)]
+    caches["pages"].delete_many([PAGE_CACHE_TAG_KEY.format(tag=tag) for tag in tags])
+
+
+def _search_vector(*parts):
+    """Поисковый вектор из пар (поле или выражение, вес)"""
+    vector = None
+    for field, weight in parts:
+        part = SearchVector(field, weight=weight, config=SEARCH_CONFIG)
+        vector = part if vector is None else vector + part
+    return vector
+
+
+def _lessons_text(field):
+    """Текст поля всех уроков курса одной строкой (для подзапроса в UPDATE курса)"""
+    return Func(
+        ArraySubquery(Lesson.objects.filter(course_id=OuterRef("pk")).order_by("order", "id").values(field)),
+        Value(" "),
+        function="array_to_string",
+        output_field=TextField(),
+    )
+
+
+COURSE_SEARCH_VECTOR = _search_vector(("name", "A"), ("description", "B"))
+# Лексемы всех уроков курса без позиций и весов (strip): только для поиска курса по GIN-индексу.
+# ts_rank по нему не считается, поэтому вектор остаётся компактным и не зависит от объёма уроков при ранжировании
+COURSE_LESSONS_SEARCH_VECTOR = Func(
+    _search_vector((_lessons_text("name"), "A"), (_lessons_text("description"), "B")),
+    function="strip",
+    output_field=SearchVectorField(),
+)
+LESSON_SEARCH_VECTOR = _search_vector(("name", "A"), ("description", "B"))
+
+
+def update_search_vectors(model, ids):
+    """Пересчитывает сохранённые поисковые векторы курсов или уроков с указанными id"""
+    if model is Course:
+        Course.objects.filter(pk__in=ids).update(
+            search_vector=COURSE_SEARCH_VECTOR, lessons_search_vector=COURSE_LESSONS_SEARCH_VECTOR
+        )
+    else:
+        Lesson.objects.filter(pk__in=ids).update(search_vector=LESSON_SEARCH_VECTOR)
+
+
+def _search_query(text):
+    return SearchQuery(text, config=SEARCH_CONFIG, search_type="websearch")
+
+
+def prefix_search_query(text):
+    """Запрос «все слова по началу» (прогр → программирование) для поиска в админке; None, если слов нет"""
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return SearchQuery(" & ".join(f"{word}:*" for word in words), config=SEARCH_CONFIG, search_type="raw")
+
+
+def _highlight(text):
+    """Экранирует фрагмент ts_headline, оставляя только разметку совпадений <mark>"""
+    return mark_safe(escape(text).replace("&lt;mark&gt;", "<mark>").replace("&lt;/mark&gt;", "</mark>"))
+
+
+def _headline(field, query, **options):
+    return SearchHeadline(field, query, config=SEARCH_CONFIG, start_sel="<mark>", stop_sel="</mark>", **options)
+
+
+def search_courses(text, limit=20, offset=0):
+    """
+    Полнотекстовый поиск курсов с учётом уроков, ранжированный по ts_rank названия и описания курса.
+    Совпадение в уроках находит курс и добавляет к рангу LESSON_MATCH_RANK.
+    Фрагменты с подсветкой строятся только для страницы результатов.
+    Возвращает курсы с атрибутами rank, name_highlight, snippet и matched_lessons
+    """
+    query = _search_query(text)
+
+    courses = list(
+        Course.objects.filter(Q(search_vector=query) | Q(lessons_search_vector=query))
+        .select_related("owner")
+        .defer("search_vector", "lessons_search_vector")
+        .annotate(
+            rank=SearchRank(F("search_vector"), query)
+            + Case(When(lessons_search_vector=query, then=Value(LESSON_MATCH_RANK)), default=Value(0.0)),
+            name_headline=_headline("name", query, highlight_all=True),
+            description_headline=_headline("description", query, max_words=35, min_words=15, max_fragments=2),
+        )
+        .order_by("-rank", "id")[offset : offset + limit]
+    )
+    if not courses:
+        return []
+
+    lessons = (
+        Lesson.objects.filter(course_id__in=[course.id for course in courses], search_vector=query)
+        .annotate(
+            rank=SearchRank(F("search_vector"), query),
+            name_headline=_headline("name", query, highlight_all=True),
+        )
+        .order_by("course_id", "-rank", "id")
+        .only("id", "name", "course_id", "order")
+    )
+
+    matched_lessons = {}
+    for lesson in lessons:
+        course_lessons = matched_lessons.setdefault(lesson.course_id, [])
+        if len(course_lessons) < SEARCH_LESSONS_PER_COURSE:
+            lesson.name_highlight = _highlight(lesson.name_headline)
+            course_lessons.append(lesson)
+
+    for course in courses:
+        course.name_highlight = _highlight(course.name_headline)
+        course.snippet = _highlight(course.description_headline) if course.description else ""
+        course.matched_lessons = matched_lessons.get(course.id, [])
+    return courses
@@ -0,0 +1,218 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from jobs.services import enqueue
+from paperskill.images import needs_renditions, rendition_names, renditions_field
+from paperskill.models import Course, Lesson
+from paperskill.services import (
+    change_lesson_counts,
+    invalidate_dashboards,
+    invalidate_entitlements,
+    invalidate_latest_courses,
+    invalidate_pages,
+    recount_course_progress,
+    touch_courses,
+    update_search_vectors,
+)
+from paperskill.storage import release, retain
+from users.models import User
+
+
+@receiver(m2m_changed, sender=User.bought_courses.through)
+def bought_courses_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Сбрасывает кэш доступа при изменении списка купленных курсов"""
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            instance.__dict__.pop("_entitlements", None)
+            invalidate_entitlements(instance.pk)
+    elif action == "pre_clear":
+        instance._cleared_buyer_ids = list(instance.buyers.values_list("id", flat=True))
+    elif action == "post_clear":
+        invalidate_entitlements(*instance.__dict__.pop("_cleared_buyer_ids", []))
+    elif action in ("post_add", "post_remove"):
+        invalidate_entitlements(*pk_set)
+
+
+@receiver(m2m_changed, sender=User.bought_courses.through)
+@receiver(m2m_changed, sender=User.courses.through)
+@receiver(m2m_changed, sender=User.completed_courses.through)
+def enrollment_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Сбрасывает панель обучения при изменении купленных, начатых и завершённых курсов"""
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            invalidate_dashboards(instance.pk)
+    elif action == "pre_clear":
+        instance._cleared_dashboard_user_ids = list(
+            sender.objects.filter(course_id=instance.pk).values_list("user_id", flat=True)
+        )
+    elif action == "post_clear":
+        invalidate_dashboards(*instance.__dict__.pop("_cleared_dashboard_user_ids", []))
+    elif action in ("post_add", "post_remove"):
+        invalidate_dashboards(*pk_set)
+
+
+@receiver(pre_save, sender=Course)
+def remember_course_state(sender, instance, raw, **kwargs):
+    """Запоминает прежнего владельца курса; при изменении цены сбрасывает цену Stripe"""
+    if raw or instance.pk is None:
+        instance._old_owner_id = None
+        return
+    old = Course.objects.filter(pk=instance.pk).values("owner_id", "price").first() or {}
+    instance._old_owner_id = old.get("owner_id")
+    if old and old["price"] != instance.price:
+        # Новая цена в Stripe будет создана при следующей оплате
+        instance.price_id = None
+
+
+@receiver(post_save, sender=Course)
+def course_owner_changed(sender, instance, created, raw, **kwargs):
+    """Сбрасывает кэш доступа старого и нового владельца при смене владельца курса"""
+    if raw:
+        return
+    invalidate_latest_courses()
+    old_owner_id = getattr(instance, "_old_owner_id", None)
+    if created or old_owner_id != instance.owner_id:
+        invalidate_entitlements(old_owner_id, instance.owner_id)
+
+
+def _search_fields_changed(update_fields, fields=("name", "description")):
+    return update_fields is None or bool(set(fields) & set(update_fields))
+
+
+@receiver(post_save, sender=Course)
+def course_search_vector_update(sender, instance, raw, update_fields, **kwargs):
+    """Пересчитывает поисковый вектор курса при изменении названия или описания"""
+    if not raw and _search_fields_changed(update_fields):
+        update_search_vectors(Course, [instance.pk])
+
+
+@receiver(post_save, sender=Lesson)
+def lesson_search_vector_update(sender, instance, raw, update_fields, **kwargs):
+    """Пересчитывает вектор урока и векторы курсов, в которые входит его текст"""
+    if raw or not _search_fields_changed(update_fields, ("name", "description", "course", "course_id")):
+        return
+    update_search_vectors(Lesson, [instance.pk])
+    old_course_id = getattr(instance, "_old_course_id", None)
+    update_search_vectors(Course, {instance.course_id, old_course_id} - {None})
+
+
+IMAGE_FIELDS = {Course: "image", Lesson: "image", User: "avatar"}
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=User)
+def image_renditions_update(sender, instance, raw, update_fields, **kwargs):
+    """Ставит в очередь генерацию производных изображений, если исходный файл изменился"""
+    field_name = IMAGE_FIELDS[sender]
+    if raw or (update_fields is not None and field_name not in update_fields):
+        return
+    if needs_renditions(instance, field_name):
+        enqueue("paperskill.generate_renditions", model=sender._meta.label, pk=instance.pk, field=field_name)
+
+
+@receiver(pre_save, sender=Course)
+@receiver(pre_save, sender=Lesson)
+@receiver(pre_save, sender=User)
+def remember_image_name(sender, instance, raw, update_fields, **kwargs):
+    """Запоминает прежний файл изображения, чтобы перенести на новый ссылку в хранилище"""
+    field_name = IMAGE_FIELDS[sender]
+    instance._old_image_name = None
+    if raw or instance.pk is None or (update_fields is not None and field_name not in update_fields):
+        return
+    instance._old_image_name = (
+        sender._default_manager.filter(pk=instance.pk).values_list(field_name, flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=User)
+def image_references_update(sender, instance, raw, update_fields, **kwargs):
+    """Учитывает ссылку на новый файл изображения и освобождает прежний"""
+    field_name = IMAGE_FIELDS[sender]
+    if raw or (update_fields is not None and field_name not in update_fields):
+        return
+    new_name = getattr(instance, field_name).name or ""
+    old_name = getattr(instance, "_old_image_name", None) or ""
+    if new_name != old_name:
+        retain(new_name)
+        release(old_name)
+
+
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=User)
+def image_references_delete(sender, instance, **kwargs):
+    """Освобождает файл изображения и его производные версии удалённого объекта"""
+    field_name = IMAGE_FIELDS[sender]
+    release(getattr(instance, field_name).name, *rendition_names(getattr(instance, renditions_field(field_name))))
+
+
+@receiver(post_delete, sender=Course)
+def course_deleted(sender, instance, **kwargs):
+    invalidate_entitlements(instance.owner_id)
+    invalidate_latest_courses()
+
+
+@receiver(pre_save, sender=Lesson)
+def remember_lesson_course(sender, instance, raw, **kwargs):
+    """Запоминает прежний курс урока перед сохранением"""
+    if raw or instance.pk is None:
+        instance._old_course_id = None
+        return
+    instance._old_course_id = Lesson.objects.filter(pk=instance.pk).values_list("course_id", flat=True).first()
+
+
+@receiver(post_save, sender=Lesson)
+def lesson_saved(sender, instance, created, raw, **kwargs):
+    """Обновляет счётчики уроков при создании урока и переносе в другой курс, иначе отмечает курс изменённым"""
+    if raw:
+        return
+    old_course_id = getattr(instance, "_old_course_id", None)
+    if created:
+        change_lesson_counts({instance.course_id: 1})
+    elif old_course_id is not None and old_course_id != instance.course_id:
+        change_lesson_counts({old_course_id: -1, instance.course_id: 1})
+        recount_course_progress(old_course_id, instance.course_id)
+    else:
+        touch_courses(instance.course_id)
+
+
+@receiver(post_delete, sender=Lesson)
+def lesson_deleted(sender, instance, **kwargs):
+    change_lesson_counts({instance.course_id: -1})
+    recount_course_progress(instance.course_id)
+    update_search_vectors(Course, [instance.course_id])
+
+
+def _invalidate_pages_on_commit(*course_ids):
+    # После коммита: иначе параллельный запрос успел бы снова закэшировать страницу со старыми данными
+    transaction.on_commit(lambda: invalidate_pages(*course_ids))
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_pages_invalidate(sender, instance, raw=False, **kwargs):
+    """Сбрасывает закэшированные страницы каталога и страницу курса"""
+    if not raw:
+        _invalidate_pages_on_commit(instance.pk)
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def lesson_pages_invalidate(sender, instance, raw=False, **kwargs):
+    """Сбрасывает закэшированные страницы курса урока (и прежнего курса при переносе) и каталога"""
+    if not raw:
+        _invalidate_pages_on_commit(instance.course_id, getattr(instance, "_old_course_id", None))
+
+
+@receiver(post_save, sender=User)
+def owner_pages_invalidate(sender, instance, raw, update_fields, **kwargs):
+    """Имя автора показывается в каталоге и на странице курса: сбрасывает страницы его курсов"""
+    if raw or (update_fields is not None and "username" not in update_fields):
+        return
+    course_ids = list(Course.objects.filter(owner_id=instance.pk).values_list("id", flat=True))
+    if course_ids:
+        _invalidate_pages_on_commit(*course_ids)
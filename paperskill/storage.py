@@ -0,0 +1,134 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from paperskill.models import MediaBlob
+
+BLOBS_DIR = "blobs"
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище медиафайлов по содержимому: файл сохраняется один раз под SHA-256 своего содержимого
+    (blobs/ab/cd/abcd...ef.jpg), повторная загрузка того же файла возвращает уже существующее имя.
+    Загрузка хэшируется по частям (chunks), целиком в память не читается.
+    Ссылки на файлы считаются в MediaBlob (retain/release), файл удаляется, когда ссылок не осталось
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Итоговое имя определяется содержимым в _save, подбирать свободное имя не нужно
+        return name
+
+    def _save(self, name, content):
+        extension = posixpath.splitext(name)[1].lower()
+        digest = hashlib.sha256()
+        size = 0
+
+        if hasattr(content, "temporary_file_path"):
+            # Большая загрузка уже лежит во временном файле на диске: хэшируем его и переносим без копирования
+            source_path = content.temporary_file_path()
+            for chunk in content.chunks():
+                digest.update(chunk)
+                size += len(chunk)
+        else:
+            self._ensure_directory(BLOBS_DIR)
+            with tempfile.NamedTemporaryFile(dir=self.path(BLOBS_DIR), prefix=".upload-", delete=False) as temporary:
+                source_path = temporary.name
+                try:
+                    for chunk in content.chunks():
+                        digest.update(chunk)
+                        size += len(chunk)
+                        temporary.write(chunk)
+                except BaseException:
+                    os.unlink(source_path)
+                    raise
+
+        blob_name = self._blob_name(digest.hexdigest(), extension)
+        try:
+            # Запись о файле обновляется до его записи на диск: collect_blobs не удалит только что загруженный файл
+            register_blob(blob_name, size)
+            self._ensure_directory(blob_name)
+            # Содержимое одинаковое, поэтому замена существующего файла ничего не меняет для читателей
+            file_move_safe(source_path, self.path(blob_name), allow_overwrite=True)
+        except BaseException:
+            if not hasattr(content, "temporary_file_path") and os.path.exists(source_path):
+                os.unlink(source_path)
+            raise
+
+        if self.file_permissions_mode is not None:
+            os.chmod(self.path(blob_name), self.file_permissions_mode)
+        return blob_name
+
+    def _blob_name(self, hexdigest, extension):
+        return posixpath.join(BLOBS_DIR, hexdigest[:2], hexdigest[2:4], f"{hexdigest}{extension}")
+
+    def _ensure_directory(self, name):
+        directory = self.path(name) if name == BLOBS_DIR else os.path.dirname(self.path(name))
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+
+def register_blob(name, size):
+    """Создаёт запись о файле или отмечает повторную загрузку (удаление откладывается на MEDIA_BLOB_GRACE_PERIOD)"""
+    MediaBlob.objects.update_or_create(
+        name=name, defaults={"saved_at": timezone.now()}, create_defaults={"size": size}
+    )
+
+
+def _managed(names):
+    """Имена файлов хранилища по содержимому; файлы, загруженные до его появления, не учитываются"""
+    return {name for name in names if name and name.startswith(f"{BLOBS_DIR}/")}
+
+
+def retain(*names):
+    """Добавляет по ссылке на каждый файл"""
+    names = _managed(names)
+    if names:
+        MediaBlob.objects.filter(name__in=names).update(refcount=F("refcount") + 1)
+
+
+def release(*names):
+    """Убирает по ссылке на каждый файл; файлы без ссылок удаляются после коммита транзакции"""
+    names = _managed(names)
+    if names:
+        MediaBlob.objects.filter(name__in=names).update(refcount=Greatest(F("refcount") - 1, 0))
+        transaction.on_commit(lambda: collect_blobs(names))
+
+
+def collect_blobs(names=None, batch_size=500):
+    """
+    Удаляет файлы без ссылок, загруженные раньше MEDIA_BLOB_GRACE_PERIOD секунд назад.
+    Задержка защищает файл, который только что загрузили повторно, но ещё не сохранили ссылку на него.
+    Возвращает количество удалённых файлов
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.MEDIA_BLOB_GRACE_PERIOD)
+    unreferenced = MediaBlob.objects.filter(refcount=0, saved_at__lt=cutoff)
+    if names is not None:
+        unreferenced = unreferenced.filter(name__in=names)
+
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            blobs = list(unreferenced.select_for_update(skip_locked=True).order_by("saved_at")[:batch_size])
+            for blob in blobs:
+                default_storage.delete(blob.name)
+            MediaBlob.objects.filter(pk__in=[blob.pk for blob in blobs]).delete()
+        deleted += len(blobs)
+        if len(blobs) < batch_size:
+            return deleted
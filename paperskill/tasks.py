@@ -0,0 +1,14 @@
+from django.apps import apps
+
+from jobs.services import job
+from paperskill.images import update_renditions
+from paperskill.services import invalidate_pages
+
+
+@job("paperskill.generate_renditions", max_attempts=3)
+def generate_renditions(model, pk, field):
+    """Генерирует производные изображения поля field объекта model (app_label.ModelName) с первичным ключом pk"""
+    instance = apps.get_model(model)._default_manager.filter(pk=pk).first()
+    if instance is not None and update_renditions(instance, field) and model == "paperskill.Course":
+        # Изображения курса показываются в каталоге и на странице курса
+        invalidate_pages(pk)
@@ -0,0 +1,31 @@
+from django import template
+from django.core.files.storage import default_storage
+
+register = template.Library()
+
+
+def _srcset(items):
+    return ", ".join(f"{default_storage.url(name)} {width}w" for width, name in items)
+
+
+@register.inclusion_tag("paperskill/includes/picture.html")
+def picture(image, renditions, sizes="100vw", alt="", css_class="", style="", loading="lazy"):
+    """
+    Адаптивное изображение: <picture> с WebP и JPEG версиями разных ширин (srcset).
+    Пока производные изображения не готовы или устарели, выводится оригинал
+    """
+    context = {"image": image, "alt": alt, "css_class": css_class, "style": style, "loading": loading}
+    if not image or not renditions or renditions.get("source") != image.name or not renditions.get("jpeg"):
+        return context
+
+    # src для браузеров без srcset: средняя по размеру версия
+    width, name = renditions["jpeg"][len(renditions["jpeg"]) // 2]
+    context.update(
+        src=default_storage.url(name),
+        width=width,
+        height=round(renditions["height"] * width / renditions["width"]),
+        webp_srcset=_srcset(renditions.get("webp", [])),
+        jpeg_srcset=_srcset(renditions["jpeg"]),
+        sizes=sizes,
+    )
+    return context
@@ -1,8 +1,48 @@
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.apps import apps
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
 from django.core.exceptions import PermissionDenied
-from django.test import RequestFactory, TestCase
-
-from paperskill.models import Course, Lesson
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.views import View
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from config.middleware import ReplicaStickinessMiddleware
+from config.routers import PRIMARY_STICKY_COOKIE, ReplicaReadMixin, ReplicaRouter, replica_reads
+from jobs.models import Job
+from jobs.services import run_pending_jobs
+from paperskill.models import Course, CourseProgress, Lesson, LessonProgress, MediaBlob
+from paperskill.paginators import EstimatedCountPaginator
+from paperskill.progress import ProgressBuffer, ProgressFlusher
+from paperskill.renderers import FastJSONRenderer
+from paperskill.serializers import (
+    CourseSearchSerializer,
+    CourseSerializer,
+    CourseSummarySerializer,
+    LessonSerializer,
+    ValuesSerializer,
+)
+from paperskill.services import DASHBOARD_CACHE_KEY, get_entitlements, get_lesson_neighbours, search_courses
 from paperskill.views import LessonDetailView
 
 User = get_user_model()
@@ -62,6 +102,7 @@ class CourseModelTest(TestCase):
 
 class LessonDetailViewTestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.factory = RequestFactory()
 
         # Создаем пользователей
@@ -288,3 +329,1101 @@ class LessonDetailViewTestCase(TestCase):
 
         context = view.get_context_data()
         self.assertTrue(context["can_edit"])
+
+
+# Кэш default в памяти процесса: тесты числа запросов не считают обращения к таблице кэша
+IN_MEMORY_CACHE = {**settings.CACHES, "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+class EntitlementsTestCase(TestCase):
+    """Тесты кэша прав доступа к курсам"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(
+            phone_number="+79991112233", email="owner@test.com", password="testpass123"
+        )
+        self.student = User.objects.create_user(
+            phone_number="+79992223344", email="student@test.com", password="testpass123"
+        )
+        self.course_paid = Course.objects.create(name="Платный курс", owner=self.owner, is_paid=True, price=1000)
+        self.course_free = Course.objects.create(name="Бесплатный курс", owner=self.owner, is_paid=False)
+
+    def _fresh_entitlements(self, user):
+        """Права доступа без кэша на уровне объекта пользователя"""
+        user = User.objects.get(pk=user.pk)
+        return get_entitlements(user)
+
+    def test_access_rules(self):
+        """Тест правил доступа: бесплатный, собственный и некупленный курс"""
+        student = self._fresh_entitlements(self.student)
+        owner = self._fresh_entitlements(self.owner)
+
+        self.assertTrue(student.has_course(self.course_free))
+        self.assertFalse(student.has_course(self.course_paid))
+        self.assertTrue(owner.has_course(self.course_paid))
+        self.assertTrue(owner.is_owner(self.course_paid))
+
+    @override_settings(CACHES=IN_MEMORY_CACHE)
+    def test_warm_cache_without_queries(self):
+        """Тест проверки доступа без запросов к БД при прогретом кэше"""
+        self._fresh_entitlements(self.student)
+        student = User.objects.get(pk=self.student.pk)
+
+        with self.assertNumQueries(0):
+            self.assertFalse(get_entitlements(student).has_course(self.course_paid))
+
+    def test_invalidation_on_purchase(self):
+        """Тест сброса кэша при покупке курса"""
+        self.assertFalse(self._fresh_entitlements(self.student).has_course(self.course_paid))
+
+        self.student.bought_courses.add(self.course_paid)
+        entitlements = self._fresh_entitlements(self.student)
+        self.assertTrue(entitlements.has_course(self.course_paid))
+        self.assertTrue(entitlements.is_bought(self.course_paid))
+
+        self.course_paid.buyers.clear()
+        self.assertFalse(self._fresh_entitlements(self.student).has_course(self.course_paid))
+
+    def test_invalidation_on_owner_change(self):
+        """Тест сброса кэша при смене владельца курса"""
+        self.assertTrue(self._fresh_entitlements(self.owner).has_course(self.course_paid))
+
+        self.course_paid.owner = self.student
+        self.course_paid.save()
+
+        self.assertFalse(self._fresh_entitlements(self.owner).has_course(self.course_paid))
+        self.assertTrue(self._fresh_entitlements(self.student).has_course(self.course_paid))
+
+
+class CourseAPIFieldsTestCase(TestCase):
+    """Тесты выборочных полей и раскрытия уроков в API курсов"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse("paperskill:courses-list", kwargs={"format": "json"})
+        self.owner = User.objects.create_user(
+            phone_number="+79991112233", email="owner@test.com", password="testpass123"
+        )
+        self.course = Course.objects.create(name="Курс", description="Длинное описание", owner=self.owner)
+        Lesson.objects.create(name="Урок", description="Содержание", course=self.course, owner=self.owner)
+
+    def test_list_is_summary_by_default(self):
+        """Тест краткого представления списка курсов"""
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        course = response.json()["results"][0]
+        self.assertNotIn("lessons", course)
+        self.assertNotIn("description", course)
+        self.assertEqual(course["lesson_count"], 1)
+
+    def test_list_expand_lessons(self):
+        """Тест раскрытия уроков через ?expand=lessons"""
+        response = self.client.get(self.url, {"expand": "lessons"})
+
+        course = response.json()["results"][0]
+        self.assertEqual(len(course["lessons"]), 1)
+        self.assertEqual(course["description"], "Длинное описание")
+
+    def test_sparse_fields(self):
+        """Тест ограничения полей через ?fields="""
+        response = self.client.get(self.url, {"fields": "id,name"})
+
+        self.assertEqual(response.json()["results"], [{"id": self.course.id, "name": "Курс"}])
+
+
+class CoursePaginationTestCase(TestCase):
+    """Тесты курсорной пагинации API курсов"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse("paperskill:courses-list", kwargs={"format": "json"})
+        self.courses = [Course.objects.create(name=f"Курс {i}") for i in range(7)]
+
+    def test_pages_cover_all_courses_in_order(self):
+        """Тест обхода всех страниц вперёд и возврата назад"""
+        ids = []
+        response = self.client.get(self.url, {"page_size": 3}).json()
+        pages = [response]
+        ids += [course["id"] for course in response["results"]]
+        while response["next"]:
+            response = self.client.get(response["next"]).json()
+            pages.append(response)
+            ids += [course["id"] for course in response["results"]]
+
+        expected = [course.id for course in sorted(self.courses, key=lambda c: (c.created_at, c.id), reverse=True)]
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(pages), 3)
+
+        previous = self.client.get(pages[-1]["previous"]).json()
+        self.assertEqual(previous["results"], pages[-2]["results"])
+
+    def test_invalid_cursor(self):
+        """Тест некорректного курсора"""
+        response = self.client.get(self.url, {"cursor": "bad"})
+
+        self.assertEqual(response.status_code, 404)
+
+
+class LessonCountTestCase(TestCase):
+    """Тесты счётчика уроков курса"""
+
+    def setUp(self):
+        self.course = Course.objects.create(name="Курс")
+        self.other_course = Course.objects.create(name="Другой курс")
+
+    def _counts(self):
+        self.course.refresh_from_db()
+        self.other_course.refresh_from_db()
+        return self.course.lesson_count, self.other_course.lesson_count
+
+    def test_counter_follows_lessons(self):
+        """Тест изменения счётчика при создании, переносе и удалении урока"""
+        lesson = Lesson.objects.create(name="Урок", description="Описание", course=self.course)
+        Lesson.objects.create(name="Урок 2", description="Описание", course=self.course)
+        self.assertEqual(self._counts(), (2, 0))
+
+        lesson.course = self.other_course
+        lesson.save()
+        self.assertEqual(self._counts(), (1, 1))
+
+        lesson.delete()
+        self.assertEqual(self._counts(), (1, 0))
+
+    def test_repair_command(self):
+        """Тест исправления расхождений командой repair_lesson_counts"""
+        Lesson.objects.create(name="Урок", description="Описание", course=self.course)
+        Course.objects.filter(pk=self.course.pk).update(lesson_count=5)
+        Course.objects.filter(pk=self.other_course.pk).update(lesson_count=3)
+
+        call_command("repair_lesson_counts", "--dry-run", stdout=StringIO())
+        self.assertEqual(self._counts(), (5, 3))
+
+        out = StringIO()
+        call_command("repair_lesson_counts", "--batch-size", "1", stdout=out)
+        self.assertEqual(self._counts(), (1, 0))
+        self.assertIn("Исправлено: 2", out.getvalue())
+
+
+# Кэш страниц отключён: тесты проверяют данные и запросы за ним
+WITHOUT_PAGE_CACHE = {**IN_MEMORY_CACHE, "pages": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+
+
+@override_settings(CACHES=WITHOUT_PAGE_CACHE)
+class IndexViewCacheTestCase(TestCase):
+    """Тесты кэширования главной страницы"""
+
+    def setUp(self):
+        cache.clear()
+        self.course = Course.objects.create(name="Первый курс")
+
+    def test_warm_cache_without_queries(self):
+        """Тест главной страницы без запросов к БД при прогретом кэше"""
+        self.client.get(reverse("home"))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("home"))
+
+        self.assertEqual(response.context["courses_count"], 1)
+        self.assertContains(response, "Первый курс")
+
+    def test_latest_courses_invalidated_on_save(self):
+        """Тест сброса блока последних курсов при сохранении курса"""
+        self.client.get(reverse("home"))
+
+        Course.objects.create(name="Новый курс")
+        response = self.client.get(reverse("home"))
+
+        self.assertContains(response, "Новый курс")
+
+
+class RouterProbeView(ReplicaReadMixin, View):
+    """Отвечает именем БД, выбранной роутером для чтения курсов"""
+
+    def get(self, request):
+        return HttpResponse(ReplicaRouter().db_for_read(Course))
+
+    def post(self, request):
+        return HttpResponse(ReplicaRouter().db_for_read(Course))
+
+
+@override_settings(REPLICA_DATABASES=["replica_1"])
+class ReplicaRouterTestCase(TestCase):
+    """Тесты маршрутизации чтений на реплики"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.view = RouterProbeView.as_view()
+
+    def test_reads_outside_replica_block(self):
+        """Тест: без replica_reads() и для записи используется основная БД"""
+        router = ReplicaRouter()
+
+        self.assertEqual(router.db_for_read(Course), "default")
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Course), "replica_1")
+            self.assertEqual(router.db_for_write(Course), "default")
+            with replica_reads(False):
+                self.assertEqual(router.db_for_read(Course), "default")
+
+    def test_cache_table_read_from_primary(self):
+        """Тест: таблица DatabaseCache читается с основной БД, чтобы сброс кэша был виден сразу"""
+        with replica_reads():
+            self.assertEqual(ReplicaRouter().db_for_read(caches["default"].cache_model_class), "default")
+
+    def test_safe_request_reads_from_replica(self):
+        """Тест: GET читает с реплики, POST — с основной БД"""
+        self.assertEqual(self.view(self.factory.get("/")).content, b"replica_1")
+        self.assertEqual(self.view(self.factory.post("/")).content, b"default")
+
+    def test_read_your_writes(self):
+        """Тест: после записи ставится cookie, и чтения пользователя идут на основную БД"""
+        middleware = ReplicaStickinessMiddleware(self.view)
+        response = middleware(self.factory.post("/"))
+        self.assertIn(PRIMARY_STICKY_COOKIE, response.cookies)
+
+        request = self.factory.get("/")
+        request.COOKIES[PRIMARY_STICKY_COOKIE] = "1"
+        self.assertEqual(self.view(request).content, b"default")
+
+
+class AsyncCatalogTestCase(TestCase):
+    """Тесты асинхронных представлений каталога"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.owner = User.objects.create_user(
+            phone_number="+79991112233", email="owner@test.com", password="testpass123"
+        )
+        self.course = Course.objects.create(
+            name="Платный курс", description="Описание", owner=self.owner, is_paid=True, price=1000
+        )
+        Lesson.objects.create(name="Секретный урок", course=self.course, owner=self.owner)
+        for i in range(4):
+            Course.objects.create(name=f"Курс {i}")
+
+    def test_api_list_matches_viewset(self):
+        """Тест совпадения асинхронного списка курсов с ответом CourseViewSet"""
+        params = {"page_size": 2, "expand": "lessons"}
+        expected = self.client.get(reverse("paperskill:courses-list", kwargs={"format": "json"}), params).json()
+        response = self.client.get(reverse("paperskill:api_courses_list"), params).json()
+
+        self.assertEqual(response["results"], expected["results"])
+        next_page = self.client.get(response["next"]).json()
+        self.assertEqual(len(next_page["results"]), 2)
+        self.assertIsNotNone(next_page["previous"])
+
+    def test_api_detail(self):
+        """Тест асинхронного детального просмотра курса и ответа 404"""
+        expected = self.client.get(
+            reverse("paperskill:courses-detail", kwargs={"pk": self.course.pk, "format": "json"})
+        ).json()
+        response = self.client.get(reverse("paperskill:api_course_detail", kwargs={"pk": self.course.pk}))
+
+        self.assertEqual(response.json(), expected)
+        missing = self.client.get(reverse("paperskill:api_course_detail", kwargs={"pk": 0}))
+        self.assertEqual(missing.status_code, 404)
+
+    def test_course_detail_lessons_only_with_access(self):
+        """Тест: уроки платного курса видит владелец, но не аноним"""
+        url = reverse("paperskill:course_detail", kwargs={"pk": self.course.pk})
+
+        self.assertNotContains(self.client.get(url), "Секретный урок")
+        self.client.force_login(self.owner)
+        response = self.client.get(url)
+        self.assertContains(response, "Секретный урок")
+        self.assertTrue(response.context["is_owner"])
+
+    async def test_course_list_async_client(self):
+        """Тест списка курсов через асинхронный клиент (как под ASGI)"""
+        response = await self.async_client.get(reverse("paperskill:courses_list"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["courses"]), 5)
+        self.assertContains(response, "Платный курс")
+
+
+class CourseSearchTestCase(TestCase):
+    """Тесты полнотекстового поиска курсов и уроков"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse("paperskill:courses-search")
+        self.python = Course.objects.create(name="Программирование на Python", description="Основы языка")
+        self.design = Course.objects.create(name="Дизайн интерфейсов", description="Figma и <b>прототипы</b>")
+        Lesson.objects.create(name="Автоматизация на Python", description="Скрипты", course=self.design)
+
+    def test_vector_maintained_on_save(self):
+        """Тест пересчёта поискового вектора при изменении названия"""
+        self.assertEqual(search_courses("кулинария"), [])
+
+        self.python.name = "Кулинария"
+        self.python.save()
+
+        self.assertEqual([course.id for course in search_courses("кулинария")], [self.python.id])
+
+    def test_lessons_roll_up_to_course(self):
+        """Тест: курс находится по совпадению в уроке, но ниже курса с совпадением в названии"""
+        results = search_courses("python")
+
+        self.assertEqual([course.id for course in results], [self.python.id, self.design.id])
+        self.assertGreater(results[0].rank, results[1].rank)
+        self.assertEqual([lesson.name for lesson in results[1].matched_lessons], ["Автоматизация на Python"])
+        self.assertIn("<mark>Python</mark>", results[1].matched_lessons[0].name_highlight)
+
+    def test_lesson_delete_updates_course(self):
+        """Тест: после удаления урока курс больше не находится по его тексту"""
+        Lesson.objects.filter(course=self.design).delete()
+        Lesson.objects.create(name="Цвет", description="Палитры", course=self.design).delete()
+
+        self.assertEqual([course.id for course in search_courses("автоматизация")], [])
+
+    def test_russian_morphology_and_escaped_snippet(self):
+        """Тест поиска по словоформе и экранирования фрагмента описания"""
+        results = search_courses("прототип")
+
+        self.assertEqual([course.id for course in results], [self.design.id])
+        self.assertIn("<mark>прототипы</mark>", results[0].snippet)
+        self.assertNotIn("<b>", results[0].snippet)
+
+    def test_migration_backfill_matches_runtime_vectors(self):
+        """Тест: векторы, заполненные миграцией, совпадают с пересчитанными при сохранении"""
+        fields = ("id", "search_vector", "lessons_search_vector")
+        runtime = {row[0]: row for row in Course.objects.values_list(*fields)}
+        Course.objects.update(search_vector=None, lessons_search_vector=None)
+
+        import_module("paperskill.migrations.0010_search_vectors").fill_search_vectors(apps, None)
+
+        self.assertEqual({row[0]: row for row in Course.objects.values_list(*fields)}, runtime)
+
+    def test_search_api(self):
+        """Тест API поиска и обязательного параметра q"""
+        response = self.client.get(self.url, {"q": "программирование"})
+
+        self.assertEqual(response.status_code, 200)
+        result = response.json()["results"][0]
+        self.assertEqual(result["id"], self.python.id)
+        self.assertIn("<mark>", result["name_highlight"])
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+    def test_search_page(self):
+        """Тест страницы результатов поиска"""
+        response = self.client.get(reverse("paperskill:courses_list"), {"q": "figma"})
+
+        self.assertContains(response, "<mark>Figma</mark>")
+        self.assertNotContains(response, "Программирование на Python")
+
+
+class AdminTestCase(TestCase):
+    """Тесты админки курсов и уроков для больших таблиц"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            phone_number="+79990000000", email="admin@test.com", password="testpass123"
+        )
+        self.client.force_login(self.admin)
+        self.course = Course.objects.create(name="Программирование на Python", owner=self.admin)
+        self.other = Course.objects.create(name="Дизайн интерфейсов", owner=self.admin)
+        self.url = reverse("admin:paperskill_lesson_changelist")
+
+    def _create_lessons(self, count):
+        start = Lesson.objects.count()
+        for i in range(start, start + count):
+            owner = User.objects.create_user(phone_number=f"+7999111{i:04d}", email=f"u{i}@test.com")
+            Lesson.objects.create(name=f"Урок {i}", description="Текст", course=self.other, owner=owner)
+
+    def test_changelist_queries_do_not_depend_on_rows(self):
+        """Тест: количество запросов списка уроков не растёт с числом строк"""
+        self._create_lessons(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url)
+        self._create_lessons(5)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(self.url)
+
+        self.assertEqual(len(few), len(many))
+
+    def test_filter_uses_autocomplete(self):
+        """Тест: фильтр по курсу — виджет autocomplete без списка всех курсов"""
+        response = self.client.get(self.url, {"course__id__exact": self.course.id})
+
+        self.assertContains(response, "admin-autocomplete")
+        self.assertContains(response, "Программирование на Python")
+        self.assertNotContains(response, "Дизайн интерфейсов")
+
+    def test_full_text_search(self):
+        """Тест поиска курсов в админке по началу слова через полнотекстовый индекс"""
+        response = self.client.get(reverse("admin:paperskill_course_changelist"), {"q": "прогр"})
+        self.assertEqual(list(response.context["cl"].result_list), [self.course])
+
+        response = self.client.get(
+            reverse("admin:autocomplete"),
+            {"term": "прогр", "app_label": "paperskill", "model_name": "lesson", "field_name": "course"},
+        )
+        self.assertEqual([item["id"] for item in response.json()["results"]], [str(self.course.id)])
+
+
+class EstimatedCountPaginatorTestCase(TestCase):
+    """Тесты пагинатора админки с оценкой количества строк"""
+
+    def setUp(self):
+        for i in range(3):
+            Course.objects.create(name=f"Курс {i}")
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE paperskill_course")
+
+    @override_settings(ADMIN_ESTIMATE_COUNT_THRESHOLD=1)
+    def test_unfiltered_uses_table_statistics(self):
+        """Тест: без фильтров количество берётся из статистики таблицы без COUNT(*)"""
+        paginator = EstimatedCountPaginator(Course.objects.all(), 10)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(paginator.count, 3)
+
+    def test_filtered_count_falls_back_to_planner_estimate(self):
+        """Тест: при превышении времени COUNT(*) используется оценка планировщика"""
+        paginator = EstimatedCountPaginator(Course.objects.filter(name__startswith="Курс"), 10)
+
+        with mock.patch("django.db.models.query.QuerySet.count", side_effect=OperationalError):
+            self.assertGreaterEqual(paginator.count, 1)
+
+
+def make_image(width=2000, height=1000, color="red"):
+    """Загружаемый JPEG указанного размера"""
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, "JPEG")
+    return SimpleUploadedFile("photo.jpg", buffer.getvalue(), content_type="image/jpeg")
+
+
+class TemporaryMediaMixin:
+    """MEDIA_ROOT во временном каталоге; файлы без ссылок удаляются сразу после коммита"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.settings_override = override_settings(MEDIA_ROOT=media_root, MEDIA_BLOB_GRACE_PERIOD=-1)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+
+class ImageRenditionsTestCase(TemporaryMediaMixin, TestCase):
+    """Тесты генерации производных изображений"""
+
+    def test_renditions_generated_off_request_path(self):
+        """Тест: после загрузки ставится задача, воркер создаёт WebP и JPEG версии, шаблон выводит srcset"""
+        course = Course.objects.create(name="Курс с превью", image=make_image())
+
+        self.assertEqual(course.image_renditions, {})
+        self.assertEqual(Job.objects.filter(name="paperskill.generate_renditions").count(), 1)
+        run_pending_jobs()
+
+        course.refresh_from_db()
+        renditions = course.image_renditions
+        self.assertEqual(renditions["source"], course.image.name)
+        self.assertEqual([width for width, _ in renditions["webp"]], [320, 640, 1280])
+        for width, name in renditions["jpeg"]:
+            with default_storage.open(name) as file:
+                self.assertEqual(Image.open(file).size, (width, width // 2))
+
+        response = self.client.get(reverse("paperskill:courses_list"))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, f"{default_storage.url(renditions['webp'][0][1])} 320w")
+
+    def test_regenerated_only_when_source_changes(self):
+        """Тест: сохранение без смены файла не ставит задачу, новая картинка заменяет старые версии"""
+        course = Course.objects.create(name="Курс", image=make_image(width=500, height=500))
+        run_pending_jobs()
+        course.refresh_from_db()
+        old_names = [name for _, name in course.image_renditions["jpeg"]]
+        # Версии шире оригинала не создаются
+        self.assertEqual([width for width, _ in course.image_renditions["jpeg"]], [320, 500])
+
+        course.name = "Новое название"
+        course.save()
+        self.assertFalse(Job.objects.filter(status=Job.STATUS_PENDING).exists())
+
+        course.image = make_image(color="blue")
+        course.save()
+        response = self.client.get(reverse("paperskill:course_detail", args=[course.pk]))
+        # Пока версии не готовы, выводится оригинал, а не версии старой картинки
+        self.assertNotContains(response, old_names[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            run_pending_jobs()
+
+        course.refresh_from_db()
+        self.assertEqual(course.image_renditions["source"], course.image.name)
+        self.assertFalse(any(default_storage.exists(name) for name in old_names))
+
+    def test_backfill_command(self):
+        """Тест генерации версий для изображений, загруженных до появления конвейера"""
+        user = User.objects.create_user(phone_number="+79990001122", email="avatar@example.com", password="pass")
+        User.objects.filter(pk=user.pk).update(avatar=default_storage.save("photo.jpg", make_image(300, 300)))
+
+        call_command("generate_renditions", stdout=StringIO())
+
+        user.refresh_from_db()
+        self.assertEqual([width for width, _ in user.avatar_renditions["webp"]], [120, 240])
+
+
+class ContentAddressedStorageTestCase(TemporaryMediaMixin, TestCase):
+    """Тесты хранилища медиафайлов по содержимому"""
+
+    def test_identical_uploads_stored_once(self):
+        """Тест: одинаковые файлы сохраняются один раз под хэшем содержимого"""
+        first = Course.objects.create(name="Первый", image=make_image())
+        second = Course.objects.create(name="Второй", image=make_image())
+        lesson = Lesson.objects.create(name="Урок", description="Описание", course=first, image=make_image())
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image.name, lesson.image.name)
+        self.assertRegex(first.image.name, r"^blobs/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$")
+        self.assertEqual(MediaBlob.objects.get(name=first.image.name).refcount, 3)
+
+    def test_large_upload_moved_from_temporary_file(self):
+        """Тест: большая загрузка (во временном файле) хэшируется по частям и переносится без копирования"""
+        upload = TemporaryUploadedFile("big.jpg", "image/jpeg", 0, None)
+        for chunk in make_image().chunks():
+            upload.write(chunk)
+        upload.seek(0)
+        temporary_path = upload.temporary_file_path()
+
+        course = Course.objects.create(name="Курс", image=upload)
+
+        self.assertFalse(os.path.exists(temporary_path))
+        self.assertEqual(course.image.name, Course.objects.create(name="Копия", image=make_image()).image.name)
+
+    def test_file_deleted_when_last_reference_released(self):
+        """Тест: файл удаляется только после удаления последней ссылки на него"""
+        first = Course.objects.create(name="Первый", image=make_image())
+        second = Course.objects.create(name="Второй", image=make_image())
+        name = first.image.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.image = make_image(color="green")
+            second.save()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+
+    @override_settings(MEDIA_BLOB_GRACE_PERIOD=3600)
+    def test_recent_upload_kept_until_grace_period(self):
+        """Тест: недавно загруженный файл без ссылок не удаляется, его удалит collect_media позже"""
+        course = Course.objects.create(name="Курс", image=make_image())
+        name = course.image.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            course.delete()
+        self.assertTrue(default_storage.exists(name))
+
+        with override_settings(MEDIA_BLOB_GRACE_PERIOD=-1):
+            call_command("collect_media", stdout=StringIO())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_import_legacy_media(self):
+        """Тест переноса файлов, загруженных до хранилища по содержимому"""
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, "images"))
+        for legacy_name in ("images/a.jpg", "images/b.jpg"):
+            with open(os.path.join(settings.MEDIA_ROOT, legacy_name), "wb") as file:
+                file.write(make_image().read())
+        first = Course.objects.create(name="Первый")
+        second = Course.objects.create(name="Второй")
+        Course.objects.filter(pk=first.pk).update(image="images/a.jpg")
+        Course.objects.filter(pk=second.pk).update(image="images/b.jpg")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("import_legacy_media", stdout=StringIO())
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(MediaBlob.objects.get(name=first.image.name).refcount, 2)
+        self.assertFalse(default_storage.exists("images/a.jpg"))
+        self.assertFalse(default_storage.exists("images/b.jpg"))
+
+
+class ConditionalGetTestCase(TestCase):
+    """Тесты ETag / Last-Modified и ответов 304"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(phone_number="+79995554433", email="etag@test.com", password="pass")
+        self.course = Course.objects.create(name="Курс", description="Описание", owner=self.owner)
+        self.lesson = Lesson.objects.create(name="Урок", description="Текст", course=self.course, owner=self.owner)
+        self.detail_url = reverse("paperskill:courses-detail", kwargs={"pk": self.course.pk, "format": "json"})
+
+    def test_course_detail_not_modified(self):
+        """Тест: повторный запрос с If-None-Match или If-Modified-Since получает 304 без выборки уроков"""
+        response = self.client.get(self.detail_url)
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+        self.assertIn("no-cache", response["Cache-Control"])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.detail_url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        response = self.client.get(self.detail_url, headers={"if-modified-since": last_modified})
+        self.assertEqual(response.status_code, 304)
+
+        # Другой набор полей — другое представление
+        response = self.client.get(self.detail_url, {"fields": "id"}, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_lesson_change_bumps_course(self):
+        """Тест: изменение урока меняет updated_at и ETag курса"""
+        etag = self.client.get(self.detail_url)["ETag"]
+        updated_at = Course.objects.get(pk=self.course.pk).updated_at
+
+        self.lesson.name = "Новое название"
+        self.lesson.save()
+
+        self.assertGreater(Course.objects.get(pk=self.course.pk).updated_at, updated_at)
+        response = self.client.get(self.detail_url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["lessons"][0]["name"], "Новое название")
+
+    def test_course_list_not_modified(self):
+        """Тест: 304 для неизменной страницы списка, новая запись меняет ETag"""
+        for url in (
+            reverse("paperskill:courses-list", kwargs={"format": "json"}),
+            reverse("paperskill:api_courses_list"),
+        ):
+            etag = self.client.get(url)["ETag"]
+            self.assertEqual(self.client.get(url, headers={"if-none-match": etag}).status_code, 304)
+
+            course = Course.objects.create(name="Новый курс")
+            self.assertEqual(self.client.get(url, headers={"if-none-match": etag}).status_code, 200)
+            course.delete()
+
+    def test_async_api_detail_not_modified(self):
+        """Тест 304 в асинхронном API курса"""
+        url = reverse("paperskill:api_course_detail", kwargs={"pk": self.course.pk})
+        etag = self.client.get(url)["ETag"]
+
+        self.assertEqual(self.client.get(url, headers={"if-none-match": etag}).status_code, 304)
+
+    def test_html_pages_depend_on_user(self):
+        """Тест: ETag страниц курса и урока зависит от пользователя и его доступа"""
+        course_url = reverse("paperskill:course_detail", kwargs={"pk": self.course.pk})
+        lesson_url = reverse("paperskill:lesson_detail", kwargs={"pk": self.course.pk, "lesson_id": self.lesson.pk})
+
+        response = self.client.get(course_url)
+        anonymous_etag = response["ETag"]
+        self.assertIn("private", response["Cache-Control"])
+        self.assertEqual(self.client.get(course_url, headers={"if-none-match": anonymous_etag}).status_code, 304)
+
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get(course_url, headers={"if-none-match": anonymous_etag}).status_code, 200)
+
+        etag = self.client.get(lesson_url)["ETag"]
+        self.assertEqual(self.client.get(lesson_url, headers={"if-none-match": etag}).status_code, 304)
+        self.course.name = "Переименованный курс"
+        self.course.save()
+        self.assertEqual(self.client.get(lesson_url, headers={"if-none-match": etag}).status_code, 200)
+
+
+class AnonymousPageCacheTestCase(TestCase):
+    """Тесты кэша страниц для анонимных пользователей"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(phone_number="+79995554422", email="pages@test.com", password="pass")
+        self.course = Course.objects.create(name="Курс", description="Описание", owner=self.owner)
+        self.lesson = Lesson.objects.create(name="Урок", course=self.course, owner=self.owner)
+        self.list_url = reverse("paperskill:courses_list")
+        self.detail_url = reverse("paperskill:course_detail", kwargs={"pk": self.course.pk})
+
+    def test_repeated_request_served_from_cache(self):
+        """Тест: повторный анонимный запрос не рендерит шаблон, ответ разрешено кэшировать nginx"""
+        for url in (reverse("home"), self.list_url, self.detail_url):
+            first = self.client.get(url)
+            self.assertEqual(first["X-Accel-Expires"], str(settings.PAGE_CACHE_PROXY_TIMEOUT))
+            self.assertNotIn("csrftoken", first.cookies)
+
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            self.assertIsNone(response.context)
+            self.assertEqual(response.content, first.content)
+
+    def test_cached_detail_not_modified(self):
+        """Тест: ETag закэшированной страницы курса проверяется без обращения к представлению"""
+        etag = self.client.get(self.detail_url)["ETag"]
+
+        response = self.client.get(self.detail_url, headers={"if-none-match": etag})
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_course_change_purges_pages(self):
+        """Тест: изменение курса сбрасывает каталог и страницу курса"""
+        other = Course.objects.create(name="Другой курс")
+        other_url = reverse("paperskill:course_detail", kwargs={"pk": other.pk})
+        for url in (self.list_url, self.detail_url, other_url):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.name = "Новое название"
+            self.course.save()
+
+        self.assertContains(self.client.get(self.list_url), "Новое название")
+        self.assertContains(self.client.get(self.detail_url), "Новое название")
+        # Страница другого курса осталась в кэше
+        self.assertIsNone(self.client.get(other_url).context)
+
+    def test_lesson_change_purges_course_page(self):
+        """Тест: добавление урока сбрасывает страницу курса (количество уроков)"""
+        self.assertContains(self.client.get(self.detail_url), "Курс")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Lesson.objects.create(name="Второй урок", course=self.course, owner=self.owner)
+
+        self.assertIsNotNone(self.client.get(self.detail_url).context)
+
+    def test_authenticated_not_cached(self):
+        """Тест: страницы вошедших пользователей не кэшируются"""
+        self.client.force_login(self.owner)
+        self.client.get(self.detail_url)
+
+        response = self.client.get(self.detail_url)
+
+        self.assertNotIn("X-Accel-Expires", response)
+        self.assertTrue(response.context["is_owner"])
+
+
+class ValuesSerializerTestCase(TemporaryMediaMixin, TestCase):
+    """Тесты быстрого представления списков: ответ должен совпадать с ModelSerializer побайтно"""
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user(phone_number="+79995554411", email="values@test.com", password="pass")
+        self.course = Course.objects.create(
+            name="Курс «Python»\u2028",
+            description="Описание",
+            owner=self.owner,
+            image=make_image(100, 50),
+            is_paid=True,
+            price="1990.50",
+            category="IT",
+        )
+        Course.objects.create(name="Курс без уроков")
+        for order in range(3):
+            Lesson.objects.create(name=f"Урок {order}", course=self.course, owner=self.owner, order=order)
+        self.context = {"request": Request(RequestFactory().get("/"))}
+
+    def test_parity_with_serializers(self):
+        """Тест: ValuesSerializer + FastJSONRenderer дают те же байты, что сериализатор + JSONRenderer"""
+        for serializer_class, queryset in (
+            (CourseSummarySerializer, Course.objects.all()),
+            (CourseSerializer, Course.objects.all()),
+            (LessonSerializer, Lesson.objects.all()),
+        ):
+            with self.subTest(serializer=serializer_class.__name__):
+                expected = JSONRenderer().render(serializer_class(queryset, many=True, context=self.context).data)
+
+                values_serializer = ValuesSerializer(serializer_class(context=self.context))
+                with self.assertNumQueries(2 if serializer_class is CourseSerializer else 1):
+                    data = values_serializer.to_representation(list(values_serializer.values(queryset)))
+
+                self.assertEqual(FastJSONRenderer().render(data), expected)
+
+    def test_api_list_parity(self):
+        """Тест: ответы списков API (поля, уроки, курсор) не зависят от способа сериализации"""
+        courses_url = reverse("paperskill:courses-list", kwargs={"format": "json"})
+        lessons_url = reverse("paperskill:lessons-list", kwargs={"format": "json"})
+        for url, params in (
+            (courses_url, {}),
+            (courses_url, {"expand": "lessons", "page_size": 1}),
+            (courses_url, {"fields": "name,price"}),
+            (lessons_url, {"page_size": 2}),
+        ):
+            with self.subTest(url=url, params=params):
+                fast = self.client.get(url, params)
+                with mock.patch.object(ValuesSerializer, "for_serializer", return_value=None):
+                    expected = self.client.get(url, params)
+                self.assertEqual(fast.status_code, 200)
+                self.assertEqual(fast.content, expected.content)
+
+    def test_unsupported_serializer(self):
+        """Тест: сериализатор с вычисляемыми полями представляется обычным способом"""
+        self.assertIsNone(ValuesSerializer.for_serializer(CourseSearchSerializer()))
+
+
+class LessonBulkTestCase(TestCase):
+    """Тесты массового создания и изменения уроков"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.owner = User.objects.create_user(phone_number="+79995554400", email="bulk@test.com", password="pass")
+        self.stranger = User.objects.create_user(phone_number="+79995554401", email="other@test.com", password="x")
+        self.course = Course.objects.create(name="Курс", owner=self.owner)
+        self.second_course = Course.objects.create(name="Второй курс", owner=self.owner)
+        self.foreign_course = Course.objects.create(name="Чужой курс", owner=self.stranger)
+        self.url = reverse("paperskill:lessons-bulk", kwargs={"format": "json"})
+        self.client.force_authenticate(self.owner)
+
+    def _items(self, count, course):
+        return [
+            {"name": f"Урок {i}", "description": "Рекурсия", "course": course.pk, "order": i} for i in range(count)
+        ]
+
+    def test_create(self):
+        """Тест: уроки создаются одним запросом, счётчики, поиск и кэш страниц обновляются как при сохранении"""
+        # Количество запросов не зависит от числа уроков (первый запрос заполняет кэш прав доступа)
+        self.client.post(self.url, self._items(1, self.second_course), format="json")
+        with CaptureQueriesContext(connection) as few:
+            self.client.post(self.url, self._items(2, self.second_course), format="json")
+        updated_at = Course.objects.get(pk=self.course.pk).updated_at
+
+        items = self._items(50, self.course)
+        with mock.patch("paperskill.services.invalidate_pages") as invalidate_pages:
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertNumQueries(len(few.captured_queries)):
+                    response = self.client.post(self.url, items, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()), 50)
+        course = Course.objects.get(pk=self.course.pk)
+        self.assertEqual(course.lesson_count, 50)
+        self.assertGreater(course.updated_at, updated_at)
+        self.assertEqual(Lesson.objects.filter(course=course, owner=self.owner).count(), 50)
+        self.assertEqual({found.pk for found in search_courses("рекурсии")}, {self.course.pk, self.second_course.pk})
+        invalidate_pages.assert_called_once_with(self.course.pk)
+
+    def test_per_item_errors(self):
+        """Тест: ошибки возвращаются по номерам элементов, ничего не сохраняется"""
+        items = self._items(3, self.course)
+        del items[1]["name"]
+        items[2]["course"] = self.foreign_course.pk
+
+        response = self.client.post(self.url, items, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {"1", "2"})
+        self.assertIn("name", response.json()["1"])
+        self.assertIn("course", response.json()["2"])
+        self.assertFalse(Lesson.objects.exists())
+
+    def test_partial_update(self):
+        """Тест: частичное изменение списком, перенос урока в другой курс меняет счётчики обоих курсов"""
+        lessons = [Lesson.objects.create(name=f"Урок {i}", course=self.course, owner=self.owner) for i in range(3)]
+        foreign = Lesson.objects.create(name="Чужой", course=self.foreign_course, owner=self.stranger)
+
+        response = self.client.patch(
+            self.url,
+            [{"id": lessons[0].pk, "id_": 0}, {"id": lessons[0].pk, "name": "Дубль"}, {"id": foreign.pk}, {"id": 0}],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {"1", "2", "3"})
+
+        response = self.client.patch(
+            self.url,
+            [{"id": lessons[0].pk, "name": "Новое название"}, {"id": lessons[1].pk, "course": self.second_course.pk}],
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Lesson.objects.get(pk=lessons[0].pk).name, "Новое название")
+        self.assertEqual(Lesson.objects.get(pk=lessons[1].pk).course_id, self.second_course.pk)
+        self.assertEqual(Lesson.objects.get(pk=lessons[2].pk).name, "Урок 2")
+        self.assertEqual(Course.objects.get(pk=self.course.pk).lesson_count, 2)
+        self.assertEqual(Course.objects.get(pk=self.second_course.pk).lesson_count, 1)
+
+    def test_requires_authentication(self):
+        """Тест: анонимный пользователь не может создавать уроки"""
+        self.client.force_authenticate(None)
+
+        response = self.client.post(self.url, self._items(1, self.course), format="json")
+
+        self.assertIn(response.status_code, (401, 403))
+
+
+class LessonNavigationTestCase(TestCase):
+    """Тесты порядка уроков и перехода к соседним урокам"""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(phone_number="+79995554500", email="nav@test.com", password="pass")
+        self.course = Course.objects.create(name="Курс", owner=self.owner)
+        other = Course.objects.create(name="Другой курс", owner=self.owner)
+        # Порядок (order, id): "Введение" и "Основы" с одинаковым order различаются по id
+        self.third = Lesson.objects.create(name="Итоги", description="-", course=self.course, order=3)
+        self.first = Lesson.objects.create(name="Введение", description="-", course=self.course, order=1)
+        self.second = Lesson.objects.create(name="Основы", description="-", course=self.course, order=1)
+        Lesson.objects.create(name="Чужой урок", description="-", course=other, order=2)
+
+    def test_lessons_ordered(self):
+        """Тест: уроки курса идут в порядке (order, id), в том числе на странице курса"""
+        self.assertEqual(list(self.course.lessons.all()), [self.first, self.second, self.third])
+
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse("paperskill:course_detail", kwargs={"pk": self.course.pk}))
+        self.assertEqual(list(response.context["course"].lessons.all()), [self.first, self.second, self.third])
+
+    def test_neighbours(self):
+        """Тест: соседи выбираются в пределах курса, по одному запросу на каждого"""
+        with self.assertNumQueries(2):
+            self.assertEqual(get_lesson_neighbours(self.second), (self.first, self.third))
+        self.assertEqual(get_lesson_neighbours(self.first), (None, self.second))
+        self.assertEqual(get_lesson_neighbours(self.third), (self.second, None))
+
+    def test_lesson_page_and_api(self):
+        """Тест: ссылки на соседние уроки на странице урока и в API"""
+        self.client.force_login(self.owner)
+        response = self.client.get(
+            reverse("paperskill:lesson_detail", kwargs={"pk": self.course.pk, "lesson_id": self.first.pk})
+        )
+        self.assertIsNone(response.context["previous_lesson"])
+        self.assertEqual(response.context["next_lesson"], self.second)
+        self.assertContains(
+            response, reverse("paperskill:lesson_detail", kwargs={"pk": self.course.pk, "lesson_id": self.second.pk})
+        )
+
+        url = reverse("paperskill:lessons-neighbours", kwargs={"pk": self.second.pk, "format": "json"})
+        data = self.client.get(url).json()
+        self.assertEqual(
+            data["previous"], {"id": self.first.pk, "name": "Введение", "order": 1, "course": self.course.pk}
+        )
+        self.assertEqual(data["next"]["id"], self.third.pk)
+
+
+@override_settings(PROGRESS_FLUSH_INTERVAL=3600, PROGRESS_BUFFER_MAX_SIZE=1000, PROGRESS_HEARTBEAT_MAX_SECONDS=60)
+class LessonProgressTestCase(TestCase):
+    """Тесты отметок присутствия на уроках и прохождения курсов"""
+
+    def setUp(self):
+        cache.clear()
+        self.buffer = ProgressBuffer()
+        patcher = mock.patch("paperskill.progress.buffer", self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(phone_number="+79995554600", email="learner@test.com", password="pass")
+        self.client.force_authenticate(self.user)
+        self.course = Course.objects.create(name="Курс", owner=None)
+        self.first = Lesson.objects.create(name="Первый", description="-", course=self.course, order=1)
+        self.second = Lesson.objects.create(name="Второй", description="-", course=self.course, order=2)
+        self.start = timezone.now()
+
+    def _heartbeat(self, lesson, **data):
+        url = reverse("paperskill:lessons-heartbeat", kwargs={"pk": lesson.pk, "format": "json"})
+        return self.client.post(url, data, format="json")
+
+    def _progress(self):
+        url = reverse("paperskill:courses-progress", kwargs={"pk": self.course.pk, "format": "json"})
+        return self.client.get(url).json()
+
+    def _heartbeat_at(self, offset, lesson, **data):
+        """Отметка в момент start + offset секунд по часам сервера"""
+        now = self.start + timedelta(seconds=offset)
+        with mock.patch("paperskill.progress.timezone.now", return_value=now):
+            return self._heartbeat(lesson, **data)
+
+    def test_heartbeats_buffered_and_coalesced(self):
+        """Тест: отметки не пишутся в БД по одной, а складываются в буфере и записываются пачкой"""
+        self.assertEqual(self._heartbeat_at(0, self.first).status_code, 204)
+        self._heartbeat_at(10, self.first, seconds=10)
+        self._heartbeat_at(30, self.first, seconds=20)
+        self._heartbeat_at(3630, self.first, seconds=3600)
+        self.assertEqual(len(self.buffer), 1)
+        self.assertFalse(LessonProgress.objects.exists())
+
+        self.buffer.flush()
+        progress = LessonProgress.objects.get(user=self.user, lesson=self.first)
+        self.assertEqual(progress.seconds_spent, 90)
+        self.assertIsNone(progress.completed_at)
+        self.assertEqual(CourseProgress.objects.get(user=self.user, course=self.course).completed_lessons, 0)
+
+    def test_seconds_counted_by_server_clock(self):
+        """Тест: засчитывается не больше прошедшего на сервере с прошлой отметки, в том числе записанной в БД"""
+        self._heartbeat_at(0, self.first, seconds=60)
+        for _ in range(20):
+            self._heartbeat_at(1, self.first, seconds=60)
+        self._heartbeat_at(5, self.first, seconds=2)
+        self.buffer.flush()
+        self.assertEqual(LessonProgress.objects.get(user=self.user, lesson=self.first).seconds_spent, 3)
+
+        # Процесс, не видевший прошлых отметок, считает время от LessonProgress.updated_at
+        self.buffer = ProgressBuffer()
+        with mock.patch("paperskill.progress.buffer", self.buffer):
+            self._heartbeat_at(20, self.first, seconds=60)
+            self.buffer.flush()
+        self.assertEqual(LessonProgress.objects.get(user=self.user, lesson=self.first).seconds_spent, 18)
+
+    @override_settings(PROGRESS_COMPLETE_MIN_SECONDS=30)
+    def test_completion_requires_time_on_lesson(self):
+        """Тест: урок отмечается пройденным только после PROGRESS_COMPLETE_MIN_SECONDS на нём"""
+        self._heartbeat_at(0, self.first)
+        response = self._heartbeat_at(15, self.first, seconds=15, completed=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("completed", response.json())
+        self.assertFalse(self.user.completed_courses.exists())
+
+        self.assertEqual(self._heartbeat_at(30, self.first, seconds=15, completed=True).status_code, 204)
+        progress = LessonProgress.objects.get(user=self.user, lesson=self.first)
+        self.assertEqual(progress.seconds_spent, 30)
+        self.assertIsNotNone(progress.completed_at)
+
+    @override_settings(PROGRESS_FLUSH_INTERVAL=0.01)
+    def test_flusher_writes_buffer_without_heartbeats(self):
+        """Тест: фоновый поток записывает буфер по времени, не дожидаясь следующей отметки; один поток на процесс"""
+        flushed = threading.Event()
+        buffer = mock.Mock(**{"is_due.return_value": True, "flush.side_effect": lambda: flushed.set()})
+        flusher = ProgressFlusher(buffer)
+        self.addCleanup(flusher.stop)
+
+        with mock.patch("paperskill.progress.threading.Thread", wraps=threading.Thread) as thread:
+            flusher.ensure_started()
+            flusher.ensure_started()
+        self.assertEqual(thread.call_count, 1)
+        self.assertTrue(flushed.wait(5))
+
+    def test_flush_query_count_independent_of_size(self):
+        """Тест: запись буфера — одно и то же количество запросов для любого числа отметок"""
+        self.buffer.add(self.user.pk, self.first.pk, 5)
+        with CaptureQueriesContext(connection) as few:
+            self.buffer.flush()
+
+        users = [
+            User.objects.create_user(phone_number=f"+7999555470{i}", email=f"learner{i}@test.com") for i in range(5)
+        ]
+        for user in users:
+            for lesson in (self.first, self.second):
+                self.buffer.add(user.pk, lesson.pk, 5)
+        with self.assertNumQueries(len(few.captured_queries)):
+            self.assertEqual(self.buffer.flush(), 10)
+        self.assertEqual(LessonProgress.objects.count(), 11)
+
+    @override_settings(PROGRESS_COMPLETE_MIN_SECONDS=0)
+    def test_completion_percent(self):
+        """Тест: прохождение урока записывается сразу, процент курса считается по счётчику"""
+        self._heartbeat(self.first, seconds=5, completed=True)
+        self._heartbeat(self.first, completed=True)
+        self.buffer.flush()
+        data = self._progress()
+        self.assertEqual((data["completed_lessons"], data["lesson_count"], data["percent"]), (1, 2, 50))
+        self.assertFalse(self.user.completed_courses.exists())
+
+        dashboard_key = DASHBOARD_CACHE_KEY.format(user_id=self.user.pk)
+        cache.set(dashboard_key, {})
+        with self.captureOnCommitCallbacks(execute=True):
+            self._heartbeat(self.second, completed=True)
+        self.assertIsNone(cache.get(dashboard_key))
+        self.assertEqual(self._progress()["percent"], 100)
+        self.assertEqual(list(self.user.completed_courses.all()), [self.course])
+
+        # Удаление пройденного урока пересчитывает счётчик курса
+        self.first.delete()
+        self.assertEqual(CourseProgress.objects.get(user=self.user, course=self.course).completed_lessons, 1)
+
+    def test_heartbeat_requires_access(self):
+        """Тест: отметки принимаются только по урокам доступных курсов"""
+        self.course.is_paid = True
+        self.course.save()
+        self.assertEqual(self._heartbeat(self.first, seconds=5).status_code, 403)
+        self.assertEqual(len(self.buffer), 0)
@@ -24,5 +24,7 @@ urlpatterns = [
     path("courses/<int:pk>/lessons/<int:lesson_id>/update/", views.LessonUpdateView.as_view(), name="lesson_update"),
     path("courses/<int:pk>/lessons/<int:lesson_id>/delete/", views.LessonDeleteView.as_view(), name="lesson_delete"),
     path("courses/<int:pk>/lessons/create/", views.LessonCreateView.as_view(), name="lesson_create"),
+    path("api/courses/", views.CourseAsyncAPIView.as_view(), name="api_courses_list"),
+    path("api/courses/<int:pk>/", views.CourseAsyncAPIView.as_view(), name="api_course_detail"),
     # path('courses/<int:pk>/lessons/', views.LessonListView.as_view(), name='lessons_list'),
 ] + router.urls
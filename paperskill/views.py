@@ -1,44 +1,414 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.messages import get_messages
+from django.core.cache import caches
 from django.core.exceptions import PermissionDenied
-from django.db.models import Count
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import aprefetch_related_objects
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.urls import reverse, reverse_lazy
-from django.views.generic import CreateView, DeleteView, DetailView, ListView, UpdateView
-from rest_framework import viewsets
+from django.utils.cache import get_conditional_response
+from django.views.generic import CreateView, DeleteView, DetailView, UpdateView, View
+from django.views.generic.base import ContextMixin, TemplateResponseMixin
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, NotFound, ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
+from config.routers import ReplicaReadMixin
+from paperskill.conditional import make_etag, not_modified, page_etag, set_validators
 from paperskill.form import CourseForm, LessonForm
-from paperskill.models import Course, Lesson
-from paperskill.serializers import CourseSerializer, LessonSerializer
+from paperskill.models import Course, CourseProgress, Lesson, LessonProgress
+from paperskill.paginators import CoursePagination, LessonPagination
+from paperskill.progress import record_heartbeat
+from paperskill.renderers import FastJSONRenderer
+from paperskill.serializers import (
+    LESSON_BULK_MAX_ITEMS,
+    CourseSearchSerializer,
+    CourseSerializer,
+    CourseSummarySerializer,
+    HeartbeatSerializer,
+    LessonBulkItemSerializer,
+    LessonNeighbourSerializer,
+    LessonProgressSerializer,
+    LessonSerializer,
+    ValuesSerializer,
+)
+from paperskill.services import (
+    CATALOG_PAGE_TAG,
+    aget_entitlements,
+    aget_page_cache_key,
+    course_page_tag,
+    get_entitlements,
+    get_lesson_neighbours,
+    search_courses,
+)
+
+
+class AsyncTemplateView(TemplateResponseMixin, ContextMixin, View):
+    """
+    Асинхронный аналог TemplateView для ASGI: данные собираются через асинхронный ORM и кэш,
+    а шаблон рендерится без обращений к БД
+    """
+
+    async def get(self, request, *args, **kwargs):
+        # Ленивый request.user выполнил бы синхронный запрос к БД при рендеринге шаблона
+        request.user = await request.auser()
+        context = await self.get_context_data(**kwargs)
+        return self.render_to_response(context).render()
+
+    async def get_context_data(self, **kwargs):
+        return super().get_context_data(**kwargs)
+
+
+class AnonymousPageCacheMixin:
+    """
+    Кэш готовых страниц для анонимных пользователей по URL (кэш pages) для асинхронных представлений.
+    Страницы сбрасываются сигналами при изменении курсов и уроков (invalidate_pages) по тегам из get_page_cache_tags,
+    PAGE_CACHE_TIMEOUT лишь ограничивает срок хранения. Заголовок X-Accel-Expires разрешает nginx
+    держать такие ответы у себя PAGE_CACHE_PROXY_TIMEOUT секунд (micro-caching)
+    """
+
+    page_cache_tags = (CATALOG_PAGE_TAG,)
+
+    def get_page_cache_tags(self):
+        return self.page_cache_tags
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD") or (await request.auser()).is_authenticated:
+            return await super().dispatch(request, *args, **kwargs)
+        # Страница с сообщениями (messages) показывается один раз
+        if len(get_messages(request)):
+            return await super().dispatch(request, *args, **kwargs)
+
+        page_cache = caches["pages"]
+        key = await aget_page_cache_key(request.build_absolute_uri(), self.get_page_cache_tags())
+        response = await page_cache.aget(key)
+        if response is not None:
+            return get_conditional_response(request, etag=response.get("ETag"), response=response)
+
+        response = await super().dispatch(request, *args, **kwargs)
+        if self._is_page_cacheable(request, response):
+            response.headers["X-Accel-Expires"] = str(settings.PAGE_CACHE_PROXY_TIMEOUT)
+            await page_cache.aset(key, response, settings.PAGE_CACHE_TIMEOUT)
+        return response
+
+    def _is_page_cacheable(self, request, response):
+        """Сохраняются только успешные ответы, не устанавливающие cookie (CSRF-токен, сессия)"""
+        session = getattr(request, "session", None)
+        return (
+            response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and not request.META.get("CSRF_COOKIE_NEEDS_UPDATE")
+            and not (session is not None and session.modified)
+        )
+
+
+class ConditionalGetMixin:
+    """
+    ETag и Last-Modified для list и retrieve по полю updated_at. Валидаторы считаются лёгким запросом
+    (только id и updated_at), при совпадении с If-None-Match/If-Modified-Since отдаётся 304
+    без выборки связанных данных и сериализации
+    """
 
+    def get_representation_key(self):
+        """Всё, от чего зависит тело ответа помимо данных: формат и параметры запроса (?fields=, ?expand=...)"""
+        return self.basename, self.request.accepted_renderer.format, sorted(self.request.query_params.lists())
 
-class CourseViewSet(viewsets.ModelViewSet):
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        updated_at = (
+            self.queryset.filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+            .values_list("updated_at", flat=True)
+            .first()
+        )
+        if updated_at is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        etag = make_etag(self.get_representation_key(), kwargs[lookup_url_kwarg], updated_at)
+        response = not_modified(request, etag, updated_at) or super().retrieve(request, *args, **kwargs)
+        return set_validators(response, etag, updated_at)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page_queryset = self.paginator.get_page_queryset(queryset, request, self)
+        if page_queryset is None:
+            return super().list(request, *args, **kwargs)
+
+        # Страница определяется составом и версиями записей (включая запись, по которой строится ссылка next)
+        rows = list(page_queryset.prefetch_related(None).values_list("id", "updated_at"))
+        etag = make_etag(self.get_representation_key(), rows)
+        response = not_modified(request, etag) or super().list(request, *args, **kwargs)
+        return set_validators(response, etag)
+
+
+class ValuesListMixin:
+    """
+    Быстрый list для больших страниц: записи выбираются через .values() и представляются ValuesSerializer
+    (результат тот же, что у сериализатора), ответ пишет FastJSONRenderer.
+    Если сериализатор так представить нельзя, используется обычный list
+    """
+
+    renderer_classes = [FastJSONRenderer, *api_settings.DEFAULT_RENDERER_CLASSES]
+
+    def list(self, request, *args, **kwargs):
+        values_serializer = ValuesSerializer.for_serializer(self.get_serializer())
+        if values_serializer is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page_queryset = self.paginator.get_page_queryset(queryset, request, self) if self.paginator else None
+        if page_queryset is None:
+            return Response(values_serializer.to_representation(list(values_serializer.values(queryset))))
+
+        # Позиция курсора строится по исходным значениям полей сортировки, поэтому они тоже выбираются
+        ordering = [field.lstrip("-") for field in self.paginator.ordering]
+        page = self.paginator.set_page(list(values_serializer.values(page_queryset, *ordering)))
+        return self.get_paginated_response(values_serializer.to_representation(page))
+
+
+async def _aiterate(iterator):
+    """
+    Асинхронный обход синхронного генератора: каждая часть читается в потоке sync_to_async.
+    StreamingHttpResponse под ASGI иначе сначала собрал бы весь синхронный генератор в памяти
+    """
+    next_part = sync_to_async(next, thread_sensitive=True)
+    while (part := await next_part(iterator, None)) is not None:
+        yield part
+
+
+def streaming_export(request, parts, content_type, filename):
+    """
+    Ответ-файл, который отдаётся по частям по мере формирования (parts — генератор bytes).
+    Память не зависит от размера выгрузки, а первые байты уходят клиенту сразу
+    """
+    if isinstance(request, Request):
+        request = request._request
+    response = StreamingHttpResponse(
+        _aiterate(parts) if isinstance(request, ASGIRequest) else parts, content_type=content_type
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    # nginx передаёт части клиенту сразу, не накапливая ответ во временном файле
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+class CourseViewSet(ConditionalGetMixin, ValuesListMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = CourseSerializer
     queryset = Course.objects.all()
+    pagination_class = CoursePagination
 
-    # pagination_class = None
     # permission_classes = [IsAuthenticated]
 
+    def _get_query_list(self, name):
+        """Список значений параметра запроса через запятую (?fields=id,name)"""
+        value = self.request.query_params.get(name, "")
+        return [item.strip() for item in value.split(",") if item.strip()]
+
+    def get_requested_fields(self):
+        """Поля, запрошенные клиентом через ?fields=, только для чтения"""
+        if self.request.method != "GET":
+            return []
+        return self._get_query_list("fields")
+
+    def expand_lessons(self):
+        """Нужно ли включать уроки в ответ: всегда для одного курса, для списка только с ?expand=lessons"""
+        if self.action != "list":
+            return True
+        return "lessons" in self._get_query_list("expand")
+
+    def get_serializer_class(self):
+        if self.action == "search":
+            return CourseSearchSerializer
+        if self.action == "list" and not self.expand_lessons():
+            return CourseSummarySerializer
+        return super().get_serializer_class()
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault("fields", self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
     def get_queryset(self):
-        return self.queryset.prefetch_related("lessons").annotate(lesson_count=Count("lessons"))
+        queryset = self.queryset
+        fields = self.get_requested_fields()
+
+        if self.expand_lessons() and (not fields or "lessons" in fields):
+            queryset = queryset.prefetch_related("lessons")
+        elif not self.expand_lessons():
+            queryset = queryset.defer("description")
+
+        model_fields = {field.name for field in Course._meta.concrete_fields} & set(fields)
+        if model_fields:
+            queryset = queryset.only("id", *model_fields)
+
+        return queryset
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
+    @action(detail=False, methods=["get"], renderer_classes=api_settings.DEFAULT_RENDERER_CLASSES)
+    def search(self, request, *args, **kwargs):
+        """Полнотекстовый поиск курсов и уроков: ?q=запрос&limit=20&offset=0"""
+        text = request.query_params.get("q", "").strip()
+        if not text:
+            raise ValidationError({"q": "Укажите поисковый запрос"})
+        try:
+            limit = min(max(int(request.query_params.get("limit", 20)), 1), self.paginator.max_page_size)
+            offset = max(int(request.query_params.get("offset", 0)), 0)
+        except ValueError:
+            raise ValidationError({"limit": "limit и offset должны быть числами"})
+
+        results = search_courses(text, limit=limit, offset=offset)
+        return Response({"results": self.get_serializer(results, many=True).data})
+
+    @action(detail=True, methods=["get"], permission_classes=[IsAuthenticated])
+    def progress(self, request, *args, **kwargs):
+        """Прохождение курса текущим пользователем: процент и время по урокам (с задержкой до записи буфера)"""
+        course = get_object_or_404(Course.objects.only("id", "lesson_count"), pk=kwargs["pk"])
+        progress = CourseProgress.objects.filter(user=request.user, course=course).first() or CourseProgress(
+            user=request.user, course=course
+        )
+        progress.course = course
+        lessons = LessonProgress.objects.filter(user=request.user, lesson__course=course).order_by(
+            "lesson__order", "lesson_id"
+        )
+        return Response(
+            {
+                "course": course.pk,
+                "lesson_count": course.lesson_count,
+                "completed_lessons": progress.completed_lessons,
+                "percent": progress.percent,
+                "lessons": LessonProgressSerializer(lessons, many=True).data,
+            }
+        )
+
 
-class LessonViewSet(viewsets.ModelViewSet):
+class LessonViewSet(ConditionalGetMixin, ValuesListMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = LessonSerializer
     queryset = Lesson.objects.all()
+    pagination_class = LessonPagination
 
-    # pagination_class = None
     # permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == "neighbours":
+            queryset = queryset.only("id", "course_id", "order")
+        elif self.action == "heartbeat":
+            queryset = queryset.select_related("course").only("id", "owner_id", "course__id", "course__is_paid")
+        return queryset
+
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
+    @action(detail=True, methods=["get"])
+    def neighbours(self, request, *args, **kwargs):
+        """Предыдущий и следующий уроки курса в порядке order (null, если урок первый или последний)"""
+        previous, following = get_lesson_neighbours(self.get_object())
+        return Response(
+            {
+                "previous": LessonNeighbourSerializer(previous).data if previous else None,
+                "next": LessonNeighbourSerializer(following).data if following else None,
+            }
+        )
+
+    @action(detail=True, methods=["post"], permission_classes=[IsAuthenticated])
+    def heartbeat(self, request, *args, **kwargs):
+        """
+        Отметка присутствия на открытом уроке, страница урока шлёт её каждые PROGRESS_HEARTBEAT_INTERVAL секунд:
+        {"seconds": секунды с прошлой отметки, "completed": true, если урок пройден}.
+        Отметка попадает в буфер процесса и записывается в БД пачкой вместе с остальными. Прохождение
+        до PROGRESS_COMPLETE_MIN_SECONDS на уроке отклоняется с 400, время отметки при этом учитывается
+        """
+        lesson = self.get_object()
+        if not get_entitlements(request.user).has_course(lesson.course) and lesson.owner_id != request.user.id:
+            raise PermissionDenied("У вас нет доступа к этому уроку")
+        serializer = HeartbeatSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        completed = record_heartbeat(request.user.pk, lesson.pk, **serializer.validated_data)
+        if serializer.validated_data["completed"] and not completed:
+            min_seconds = settings.PROGRESS_COMPLETE_MIN_SECONDS
+            raise ValidationError({"completed": f"Урок можно отметить пройденным после {min_seconds} с на нём"})
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=["post", "patch"], permission_classes=[IsAuthenticated])
+    def bulk(self, request, *args, **kwargs):
+        """
+        Массовое создание (POST) и частичное изменение (PATCH, у каждого элемента "id") уроков списком
+        до LESSON_BULK_MAX_ITEMS элементов. Ошибки — по номерам элементов, при ошибке ничего не сохраняется
+        """
+        partial = request.method == "PATCH"
+        serializer = LessonBulkItemSerializer(
+            data=request.data,
+            many=True,
+            partial=partial,
+            max_length=LESSON_BULK_MAX_ITEMS,
+            context=self.get_serializer_context(),
+        )
+        serializer.is_valid(raise_exception=True)
+        if partial:
+            serializer.save()
+        else:
+            serializer.save(owner=request.user)
+        return Response(serializer.data, status=status.HTTP_200_OK if partial else status.HTTP_201_CREATED)
+
+
+class CourseAsyncAPIView(ReplicaReadMixin, View):
+    """
+    Асинхронные список и детальный просмотр курсов: ответ тот же, что у CourseViewSet
+    (включая ?fields=, ?expand=lessons и курсорную пагинацию), но записи выбираются через асинхронный ORM
+    """
+
+    async def get(self, request, pk=None):
+        drf_request = Request(request)
+        viewset = CourseViewSet(
+            request=drf_request, action="list" if pk is None else "retrieve", format_kwarg=None, args=(), kwargs={}
+        )
+        queryset = viewset.get_queryset()
+        representation_key = ("api_courses", sorted(request.GET.lists()))
+        last_modified = None
+
+        try:
+            if pk is None:
+                paginator = viewset.paginator
+                page_queryset = paginator.get_page_queryset(queryset, drf_request, viewset)
+                rows = [row async for row in page_queryset.prefetch_related(None).values_list("id", "updated_at")]
+                etag = make_etag(representation_key, rows)
+                if response := not_modified(request, etag):
+                    return response
+
+                page = paginator.set_page([course async for course in page_queryset])
+                data = paginator.get_paginated_response(viewset.get_serializer(page, many=True).data).data
+            else:
+                last_modified = await Course.objects.filter(pk=pk).values_list("updated_at", flat=True).afirst()
+                if last_modified is None:
+                    raise NotFound()
+                etag = make_etag(representation_key, pk, last_modified)
+                if response := not_modified(request, etag, last_modified):
+                    return response
+
+                try:
+                    course = await queryset.aget(pk=pk)
+                except Course.DoesNotExist:
+                    raise NotFound()
+                data = viewset.get_serializer(course).data
+        except APIException as e:
+            return HttpResponse(
+                JSONRenderer().render({"detail": e.detail}), status=e.status_code, content_type="application/json"
+            )
+
+        response = HttpResponse(JSONRenderer().render(data), content_type="application/json")
+        return set_validators(response, etag, last_modified)
+
 
 class CourseSubscriptionAPIView(APIView):
     permission_classes = [IsAuthenticated]
@@ -55,33 +425,61 @@ class CourseSubscriptionAPIView(APIView):
             return Response({"message": "Курс уже начат!"}, status=200)
 
 
-class CourseListView(ListView):
-    model = Course
-    template_name = "paperskill/course/list.html"
-    context_object_name = "courses"
+class CourseListView(AnonymousPageCacheMixin, ReplicaReadMixin, AsyncTemplateView):
+    """Список курсов; с параметром ?q= — результаты полнотекстового поиска по курсам и урокам"""
 
-    def get_queryset(self):
-        return Course.objects.prefetch_related("lessons").annotate(lesson_count=Count("lessons"))
+    template_name = "paperskill/course/list.html"
+    search_limit = 30
+
+    async def get_context_data(self, **kwargs):
+        context = await super().get_context_data(**kwargs)
+        query = self.request.GET.get("q", "").strip()
+        context["query"] = query
+        if query:
+            context["courses"] = await sync_to_async(search_courses)(query, limit=self.search_limit)
+        else:
+            context["courses"] = [course async for course in Course.objects.select_related("owner")]
+        return context
 
 
-class CourseDetailView(DetailView):
-    model = Course
+class CourseDetailView(AnonymousPageCacheMixin, ReplicaReadMixin, AsyncTemplateView):
     template_name = "paperskill/course/detail.html"
-    context_object_name = "course"
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        course = self.object
-        user = self.request.user
+    def get_page_cache_tags(self):
+        return (course_page_tag(self.kwargs["pk"]),)
+
+    async def get(self, request, *args, **kwargs):
+        """Курс нужен в любом случае; при совпадении ETag не выбираются уроки и не рендерится шаблон"""
+        request.user = await request.auser()
+        try:
+            self.course = await Course.objects.select_related("owner").aget(pk=self.kwargs["pk"])
+        except Course.DoesNotExist:
+            raise Http404("Курс не найден")
+        self.entitlements = await aget_entitlements(request.user)
+
+        etag = page_etag(
+            request,
+            self.course.pk,
+            self.course.updated_at,
+            self.entitlements.has_course(self.course),
+            self.entitlements.is_owner(self.course),
+            self.entitlements.is_bought(self.course),
+        )
+        response = not_modified(request, etag, private=True) or await super().get(request, *args, **kwargs)
+        return set_validators(response, etag, private=True)
 
-        has_access = False
-        if user.is_authenticated:
-            has_access = (
-                not course.is_paid or course in user.bought_courses.all() or course.owner == user or user.is_superuser
-            )
+    async def get_context_data(self, **kwargs):
+        context = await super().get_context_data(**kwargs)
+        course, entitlements = self.course, self.entitlements
 
-        context["has_access_to_lessons"] = has_access
-        context["is_owner"] = user.is_authenticated and (course.owner == user or user.is_superuser)
+        context["course"] = course
+        context["has_access_to_lessons"] = entitlements.has_course(course)
+        context["is_owner"] = entitlements.is_owner(course)
+        context["is_bought"] = entitlements.is_bought(course)
+
+        # Уроки показываются только пользователям с доступом
+        if context["has_access_to_lessons"]:
+            await aprefetch_related_objects([course], "lessons")
 
         return context
 
@@ -175,38 +573,46 @@ class LessonDetailView(DetailView):
     context_object_name = "lesson"
 
     def get_object(self, queryset=None):
-        lesson_id = self.kwargs.get("lesson_id")
-        return Lesson.objects.get(pk=lesson_id)
+        if getattr(self, "object", None) is None:
+            lesson_id = self.kwargs.get("lesson_id")
+            self.object = Lesson.objects.select_related("course").get(pk=lesson_id)
+        return self.object
 
     def dispatch(self, request, *args, **kwargs):
         lesson = self.get_object()
-        course = lesson.course
         user = request.user
 
-        has_access = False
-        if user.is_authenticated:
-            has_access = (
-                not course.is_paid
-                or course in user.bought_courses.all()
-                or course.owner == user
-                or lesson.owner == user
-                or user.is_superuser
-            )
+        has_access = get_entitlements(user).has_course(lesson.course) or (
+            user.is_authenticated and lesson.owner_id == user.id
+        )
 
         if not has_access:
             raise PermissionDenied("У вас нет доступа к этому уроку. Купите курс для получения полного доступа.")
 
         return super().dispatch(request, *args, **kwargs)
 
+    def get(self, request, *args, **kwargs):
+        lesson = self.get_object()
+        etag = page_etag(
+            request,
+            lesson.pk,
+            lesson.updated_at,
+            lesson.course.updated_at,
+            get_entitlements(request.user).is_owner(lesson.course),
+        )
+        response = not_modified(request, etag, private=True) or super().get(request, *args, **kwargs)
+        return set_validators(response, etag, private=True)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         lesson = self.get_object()
         context["course"] = lesson.course
 
         user = self.request.user
-        context["can_edit"] = user.is_authenticated and (
-            user.is_superuser or lesson.owner == user or lesson.course.owner == user
-        )
+        context["is_owner"] = get_entitlements(user).is_owner(lesson.course)
+        context["can_edit"] = context["is_owner"] or (user.is_authenticated and lesson.owner_id == user.id)
+        # Порядок уроков меняет updated_at курса, поэтому соседи уже учтены в ETag страницы
+        context["previous_lesson"], context["next_lesson"] = get_lesson_neighbours(lesson)
 
         return context
 
@@ -1,10 +1,11 @@
 from django.contrib import admin
 
+from paperskill.admin import LargeTableAdminMixin
 from users.models import User
 
 
 @admin.register(User)
-class UsersAdmin(admin.ModelAdmin):
+class UsersAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = (
         "username",
         "id",
@@ -14,16 +15,17 @@ class UsersAdmin(admin.ModelAdmin):
         "phone_number",
     )
     list_filter = (
-        "first_name",
-        "last_name",
-        "email",
-        "country",
+        "is_staff",
+        "is_active",
     )
+    # Поиск по началу значения использует индексы varchar_pattern_ops, которые PostgreSQL создаёт для уникальных полей
     search_fields = (
-        "first_name",
-        "last_name",
-        "username",
-        "country",
-        "email",
-        "phone_number",
+        "phone_number__startswith",
+        "email__startswith",
+        "username__startswith",
+    )
+    autocomplete_fields = (
+        "courses",
+        "bought_courses",
+        "completed_courses",
     )
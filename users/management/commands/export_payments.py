@@ -0,0 +1,43 @@
+import sys
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from users.models import Payment
+from users.services import PAYMENT_EXPORT_FORMATS, iter_payments_export, payments_for_export
+
+
+class Command(BaseCommand):
+    help = "Выгружает платежи для бухгалтерии в CSV или JSON Lines, читая их из БД пачками"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=PAYMENT_EXPORT_FORMATS, default="csv", help="Формат файла")
+        parser.add_argument("--output", default="-", help="Файл выгрузки; по умолчанию — стандартный вывод")
+        parser.add_argument("--paid-course", type=int, help="id оплаченного курса")
+        parser.add_argument("--payment-method", choices=[value for value, _ in Payment.PAYMENT_METHODS])
+        parser.add_argument("--date-from", type=date.fromisoformat, help="Начало периода, ГГГГ-ММ-ДД")
+        parser.add_argument("--date-to", type=date.fromisoformat, help="Конец периода включительно, ГГГГ-ММ-ДД")
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.EXPORT_CHUNK_SIZE, help="Сколько платежей читать за раз"
+        )
+
+    def handle(self, *args, **options):
+        payments = payments_for_export(
+            paid_course=options["paid_course"],
+            payment_method=options["payment_method"],
+            date_from=options["date_from"],
+            date_to=options["date_to"],
+        )
+        parts = iter_payments_export(payments, options["format"], options["batch_size"])
+
+        if options["output"] == "-":
+            for part in parts:
+                sys.stdout.buffer.write(part)
+            sys.stdout.buffer.flush()
+            return
+
+        with open(options["output"], "wb") as output:
+            for part in parts:
+                output.write(part)
+        self.stderr.write(self.style.SUCCESS(f"Выгрузка записана в {options['output']}"))
@@ -0,0 +1,37 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from users.services import process_stripe_events
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Обрабатывает входящие вебхуки Stripe пачками"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Сколько событий обрабатывать за раз")
+        parser.add_argument("--sleep", type=float, default=1.0, help="Пауза (сек.), когда входящих событий нет")
+        parser.add_argument("--once", action="store_true", help="Обработать входящие события и завершиться")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        while True:
+            try:
+                processed = process_stripe_events(batch_size)
+            except Exception:
+                # Сбой (например, БД недоступна) не останавливает обработку: события будут взяты снова после паузы
+                logger.exception("Не удалось обработать события Stripe")
+                close_old_connections()
+                processed = 0
+            if options["once"]:
+                if processed == batch_size:
+                    continue
+                self.stdout.write(self.style.SUCCESS("Входящие события обработаны"))
+                return
+            if not processed:
+                time.sleep(options["sleep"])
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from users.services import rebuild_revenue
+
+
+class Command(BaseCommand):
+    help = "Пересобирает сводку выручки по курсам и дням из истории платежей частями по целым дням"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=10000, help="Сколько платежей (примерно) пересобирать за транзакцию"
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        for day_from, day_to, processed in rebuild_revenue(options["batch_size"]):
+            total += processed
+            self.stdout.write(f"{day_from or '…'} — {day_to or '…'}: платежей {processed}")
+        self.stdout.write(self.style.SUCCESS(f"Сводка выручки пересобрана, платежей: {total}"))
@@ -0,0 +1,35 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from users.services import send_outgoing_emails
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Отправляет письма из исходящих пачками через одно SMTP-соединение"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100, help="Сколько писем отправлять за раз")
+        parser.add_argument("--sleep", type=float, default=5.0, help="Пауза (сек.), когда исходящих нет")
+        parser.add_argument("--once", action="store_true", help="Отправить одну пачку и завершиться")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        while True:
+            try:
+                processed = send_outgoing_emails(batch_size)
+            except Exception:
+                # Сбой (например, БД недоступна) не останавливает воркер: пачка будет взята снова после паузы
+                logger.exception("Не удалось обработать исходящие письма")
+                close_old_connections()
+                processed = 0
+            if options["once"]:
+                self.stdout.write(self.style.SUCCESS(f"Обработано писем: {processed}"))
+                return
+            if not processed:
+                time.sleep(options["sleep"])
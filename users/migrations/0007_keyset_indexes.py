@@ -0,0 +1,21 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0006_user_username"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(fields=["payment_date", "id"], name="payment_date_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(fields=["date_joined", "id"], name="user_date_joined_id_idx"),
+        ),
+    ]
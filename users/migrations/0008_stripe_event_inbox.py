@@ -0,0 +1,40 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0007_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="payment",
+            name="session_id",
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True, verbose_name="ID сессии"),
+        ),
+        migrations.CreateModel(
+            name="StripeEvent",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("event_id", models.CharField(max_length=255, unique=True, verbose_name="ID события")),
+                ("type", models.CharField(max_length=100, verbose_name="Тип события")),
+                ("payload", models.JSONField(verbose_name="Данные события")),
+                ("created_at", models.DateTimeField(auto_now_add=True, verbose_name="Дата получения")),
+                ("processed_at", models.DateTimeField(blank=True, null=True, verbose_name="Дата обработки")),
+            ],
+            options={
+                "verbose_name": "Событие Stripe",
+                "verbose_name_plural": "События Stripe",
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("processed_at__isnull", True)),
+                        fields=["id"],
+                        name="stripe_event_pending_idx",
+                    )
+                ],
+            },
+        ),
+    ]
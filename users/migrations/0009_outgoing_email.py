@@ -0,0 +1,46 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:35
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0008_stripe_event_inbox"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutgoingEmail",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("subject", models.CharField(max_length=255, verbose_name="Тема")),
+                ("body", models.TextField(verbose_name="Текст")),
+                ("from_email", models.CharField(blank=True, max_length=255, verbose_name="Отправитель")),
+                ("recipients", models.JSONField(default=list, verbose_name="Получатели")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("pending", "Ожидает отправки"), ("sent", "Отправлено"), ("dead", "Не доставлено")],
+                        default="pending",
+                        max_length=20,
+                        verbose_name="Статус",
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0, verbose_name="Попытки")),
+                (
+                    "next_attempt_at",
+                    models.DateTimeField(default=django.utils.timezone.now, verbose_name="Следующая попытка"),
+                ),
+                ("last_error", models.TextField(blank=True, verbose_name="Последняя ошибка")),
+                ("created_at", models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")),
+                ("sent_at", models.DateTimeField(blank=True, null=True, verbose_name="Дата отправки")),
+            ],
+            options={
+                "verbose_name": "Исходящее письмо",
+                "verbose_name_plural": "Исходящие письма",
+                "indexes": [models.Index(fields=["status", "next_attempt_at"], name="email_status_next_attempt_idx")],
+            },
+        ),
+    ]
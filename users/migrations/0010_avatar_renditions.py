@@ -0,0 +1,20 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0009_outgoing_email"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="avatar_renditions",
+            field=models.JSONField(
+                blank=True, default=dict, editable=False, verbose_name="Производные изображения аватара"
+            ),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("paperskill", "0015_progress"),
+        ("users", "0010_avatar_renditions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RevenueRollup",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("day", models.DateField(verbose_name="День")),
+                (
+                    "payment_method",
+                    models.CharField(
+                        choices=[("cash", "Наличные"), ("transfer", "Перевод")],
+                        max_length=50,
+                        verbose_name="Метод оплаты",
+                    ),
+                ),
+                (
+                    "payment_status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "В ожидании"),
+                            ("succeeded", "Успешно"),
+                            ("failed", "Неудачно"),
+                            ("canceled", "Отменено"),
+                        ],
+                        max_length=20,
+                        verbose_name="Статус платежа",
+                    ),
+                ),
+                ("payment_count", models.IntegerField(default=0, verbose_name="Количество платежей")),
+                (
+                    "amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name="Сумма платежей"),
+                ),
+                (
+                    "course",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="revenue",
+                        to="paperskill.course",
+                        verbose_name="Курс",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Выручка за день",
+                "verbose_name_plural": "Выручка по дням",
+                "indexes": [models.Index(fields=["day"], name="revenue_rollup_day_idx")],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("course", "day", "payment_method", "payment_status"),
+                        name="revenue_rollup_unique",
+                        nulls_distinct=False,
+                    )
+                ],
+            },
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.db import models
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 
 from paperskill.models import Course
@@ -43,6 +44,9 @@ class User(AbstractUser):
     email = models.EmailField(unique=True, verbose_name="email")
     phone_number = PhoneNumberField(unique=True, verbose_name="Номер телефона")
     avatar = models.ImageField(upload_to="avatars/", blank=True, null=True, verbose_name="Аватар")
+    avatar_renditions = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Производные изображения аватара"
+    )
     country = models.CharField(max_length=100, blank=True, null=True, verbose_name="Страна")
 
     courses = models.ManyToManyField("paperskill.Course", blank=True, related_name="users")
@@ -62,6 +66,9 @@ class User(AbstractUser):
     def __str__(self):
         return f"{self.phone_number}"
 
+    class Meta(AbstractUser.Meta):
+        indexes = [models.Index(fields=["date_joined", "id"], name="user_date_joined_id_idx")]
+
 
 class Payment(models.Model):
     PAYMENT_METHODS = [("cash", "Наличные"), ("transfer", "Перевод")]
@@ -97,9 +104,95 @@ class Payment(models.Model):
     )
     price_id = models.CharField(max_length=255, blank=True, null=True, verbose_name="ID цены")
     product_id = models.CharField(max_length=255, blank=True, null=True, verbose_name="ID продукта")
-    session_id = models.CharField(max_length=255, blank=True, null=True, verbose_name="ID сессии")
+    session_id = models.CharField(max_length=255, blank=True, null=True, db_index=True, verbose_name="ID сессии")
     payment_url = models.URLField(max_length=500, blank=True, null=True, verbose_name="Ссылка на оплату")
 
     class Meta:
         verbose_name = "Платеж"
         verbose_name_plural = "Платежи"
+        indexes = [models.Index(fields=["payment_date", "id"], name="payment_date_id_idx")]
+
+
+class RevenueRollup(models.Model):
+    """
+    Выручка по курсу, дню (в часовом поясе проекта), методу и статусу оплаты: количество и сумма платежей.
+    Обновляется приращениями при создании, смене статуса и удалении платежа (users.services.apply_revenue_changes),
+    пересобирается по истории командой rebuild_revenue_rollups
+    """
+
+    course = models.ForeignKey(
+        Course, blank=True, null=True, on_delete=models.CASCADE, related_name="revenue", verbose_name="Курс"
+    )
+    day = models.DateField(verbose_name="День")
+    payment_method = models.CharField(max_length=50, choices=Payment.PAYMENT_METHODS, verbose_name="Метод оплаты")
+    payment_status = models.CharField(max_length=20, choices=Payment.PAYMENT_STATUS, verbose_name="Статус платежа")
+    payment_count = models.IntegerField(default=0, verbose_name="Количество платежей")
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Сумма платежей")
+
+    def __str__(self):
+        return f"{self.course_id} {self.day} {self.payment_method} {self.payment_status}: {self.amount}"
+
+    class Meta:
+        verbose_name = "Выручка за день"
+        verbose_name_plural = "Выручка по дням"
+        constraints = [
+            # Платежи без курса тоже сводятся в одну строку на день, метод и статус
+            models.UniqueConstraint(
+                fields=["course", "day", "payment_method", "payment_status"],
+                name="revenue_rollup_unique",
+                nulls_distinct=False,
+            )
+        ]
+        indexes = [models.Index(fields=["day"], name="revenue_rollup_day_idx")]
+
+
+class StripeEvent(models.Model):
+    """Входящий вебхук Stripe. Уникальный event_id отсекает повторные доставки одного события"""
+
+    event_id = models.CharField(max_length=255, unique=True, verbose_name="ID события")
+    type = models.CharField(max_length=100, verbose_name="Тип события")
+    payload = models.JSONField(verbose_name="Данные события")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата получения")
+    processed_at = models.DateTimeField(blank=True, null=True, verbose_name="Дата обработки")
+
+    def __str__(self):
+        return f"{self.type} [{self.event_id}]"
+
+    class Meta:
+        verbose_name = "Событие Stripe"
+        verbose_name_plural = "События Stripe"
+        indexes = [
+            models.Index(fields=["id"], condition=models.Q(processed_at__isnull=True), name="stripe_event_pending_idx")
+        ]
+
+
+class OutgoingEmail(models.Model):
+    """Письмо в исходящих. Отправляется воркером пачками (manage.py send_emails)"""
+
+    STATUS_PENDING = "pending"
+    STATUS_SENT = "sent"
+    STATUS_DEAD = "dead"
+    STATUSES = [
+        (STATUS_PENDING, "Ожидает отправки"),
+        (STATUS_SENT, "Отправлено"),
+        (STATUS_DEAD, "Не доставлено"),
+    ]
+
+    subject = models.CharField(max_length=255, verbose_name="Тема")
+    body = models.TextField(verbose_name="Текст")
+    from_email = models.CharField(max_length=255, blank=True, verbose_name="Отправитель")
+    recipients = models.JSONField(default=list, verbose_name="Получатели")
+    status = models.CharField(max_length=20, choices=STATUSES, default=STATUS_PENDING, verbose_name="Статус")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попытки")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Следующая попытка")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    sent_at = models.DateTimeField(blank=True, null=True, verbose_name="Дата отправки")
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)} [{self.status}]"
+
+    class Meta:
+        verbose_name = "Исходящее письмо"
+        verbose_name_plural = "Исходящие письма"
+        indexes = [models.Index(fields=["status", "next_attempt_at"], name="email_status_next_attempt_idx")]
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 
+from paperskill.models import Course, CourseProgress
 from users.models import Payment, User
+from users.services import DASHBOARD_COURSE_FIELDS, PAYMENT_EXPORT_FORMATS
 
 
 class CustomUserSerializer(serializers.ModelSerializer):
@@ -46,12 +48,29 @@ class PaymentSerializer(serializers.ModelSerializer):
             "product_id",
             "price_id",
         ]
+        extra_kwargs = {"payment_amount": {"required": False}}
 
     def validate_payment_amount(self, value):
         if value <= 0:
             raise serializers.ValidationError("Сумма платежа должна быть больше 0.")
         return value
 
+    def validate(self, data):
+        """
+        Сумма платежа — это то, что спишет Stripe: цена курса (Course.price), если она задана. Сумма клиента
+        принимается только для курса без цены, у созданного платежа сумма не меняется
+        """
+        if self.instance is not None:
+            data.pop("payment_amount", None)
+            return data
+
+        paid_course = data.get("paid_course")
+        if paid_course is not None and paid_course.price:
+            data["payment_amount"] = paid_course.price
+        elif "payment_amount" not in data:
+            raise serializers.ValidationError({"payment_amount": "Укажите сумму платежа: у курса нет цены."})
+        return data
+
     # def validate(self, data):
     #     paid_course = data.get("paid_course")
     #     paid_lesson = data.get("paid_lesson")
@@ -61,3 +80,105 @@ class PaymentSerializer(serializers.ModelSerializer):
     #     if paid_course and paid_lesson:
     #         raise serializers.ValidationError("Можно оплатить либо за курс, либо за урок.")
     #     return data
+
+
+class DashboardCourseSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Course
+        fields = [field for field in DASHBOARD_COURSE_FIELDS if field != "image_renditions"]
+        read_only_fields = fields
+
+
+class DashboardProgressSerializer(serializers.ModelSerializer):
+    course = DashboardCourseSerializer(read_only=True)
+    percent = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = CourseProgress
+        fields = ["course", "completed_lessons", "percent", "updated_at"]
+        read_only_fields = fields
+
+
+class PeriodSerializer(serializers.Serializer):
+    """Период отчёта или выгрузки по дням, включительно"""
+
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def validate(self, data):
+        if data.get("date_from") and data.get("date_to") and data["date_from"] > data["date_to"]:
+            raise serializers.ValidationError("Начало периода позже его окончания.")
+        return data
+
+
+class PaymentExportSerializer(PeriodSerializer):
+    """Параметры выгрузки платежей: фильтры списка платежей, период и формат файла"""
+
+    paid_course = serializers.IntegerField(required=False)
+    payment_method = serializers.ChoiceField(choices=Payment.PAYMENT_METHODS, required=False)
+    file_format = serializers.ChoiceField(choices=PAYMENT_EXPORT_FORMATS, default="csv")
+
+
+class RevenueQuerySerializer(PeriodSerializer):
+    """Параметры отчёта о выручке: период, статус платежей и курс"""
+
+    payment_status = serializers.ChoiceField(choices=Payment.PAYMENT_STATUS, default="succeeded")
+    course = serializers.IntegerField(required=False)
+
+
+class RevenueTotalSerializer(serializers.Serializer):
+    payments = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class RevenueDaySerializer(RevenueTotalSerializer):
+    day = serializers.DateField()
+
+
+class RevenueCourseSerializer(RevenueTotalSerializer):
+    course = serializers.IntegerField(source="course_id", allow_null=True)
+    course_name = serializers.CharField(allow_null=True)
+
+
+class RevenueMethodSerializer(RevenueTotalSerializer):
+    payment_method = serializers.CharField()
+
+
+class RevenueSerializer(serializers.Serializer):
+    """Отчёт о выручке (users.services.revenue_report)"""
+
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+    payment_status = serializers.CharField()
+    total = RevenueTotalSerializer()
+    by_day = RevenueDaySerializer(many=True)
+    by_course = RevenueCourseSerializer(many=True)
+    by_method = RevenueMethodSerializer(many=True)
+
+
+class DashboardPaymentSerializer(serializers.ModelSerializer):
+    course_name = serializers.CharField(source="paid_course.name", default=None, read_only=True)
+
+    class Meta:
+        model = Payment
+        fields = [
+            "id",
+            "payment_date",
+            "paid_course",
+            "course_name",
+            "payment_amount",
+            "payment_method",
+            "payment_status",
+        ]
+        read_only_fields = fields
+
+
+class DashboardSerializer(serializers.Serializer):
+    """Панель обучения пользователя (users.services.get_dashboard) для мобильного приложения"""
+
+    bought_count = serializers.IntegerField()
+    started_count = serializers.IntegerField()
+    completed_count = serializers.IntegerField()
+    purchased_courses = DashboardCourseSerializer(many=True)
+    started_courses = DashboardProgressSerializer(many=True)
+    recent_payments = DashboardPaymentSerializer(many=True)
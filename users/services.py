@@ -1,35 +1,99 @@
+import csv
+import io
+import logging
 import os
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from itertools import islice
 
 import stripe
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.db.models import Count, F, FilteredRelation, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from config.routers import replica_alias, replica_reads
+from paperskill.models import Course, CourseProgress
+from paperskill.renderers import render_jsonl
+from paperskill.services import DASHBOARD_CACHE_KEY, invalidate_dashboards, invalidate_entitlements
+from users.models import OutgoingEmail, Payment, RevenueRollup, StripeEvent, User
+
+logger = logging.getLogger(__name__)
+
+# Поля курсов, которые показывает панель обучения в профиле
+DASHBOARD_COURSE_FIELDS = ("id", "name", "description", "image", "image_renditions", "created_at", "lesson_count")
+# Поля платежа, от которых зависит сводка выручки
+REVENUE_FIELDS = ("paid_course_id", "payment_date", "payment_method", "payment_status", "payment_amount")
 
 stripe.api_key = os.getenv("STRIPE_API_KEY")
 
 
-def create_stripe_product(product_name):
+def create_stripe_product(product_name, idempotency_key=None):
     """Создаёт продукт в Stripe"""
-    product = stripe.Product.create(name=f"Курс {product_name}")
+    product = stripe.Product.create(name=f"Курс {product_name}", idempotency_key=idempotency_key)
 
     return product
 
 
-def create_stripe_price(product, amount):
+def create_stripe_price(product_id, amount, idempotency_key=None):
     """Создаёт цену в Stripe"""
-    # product_id = stripe.Product.retrieve(product_id)
     price = stripe.Price.create(
         currency="rub",
         unit_amount=int(amount * 100),
-        product_data={"name": product.get("name")},
+        product=product_id,
+        idempotency_key=idempotency_key,
     )
 
     return price
 
 
-def create_stripe_session(price, success_url, cancel_url):
+def get_course_stripe_price(course_id, amount):
+    """
+    Возвращает (product_id, price_id) курса в Stripe.
+    Продукт и цена создаются один раз и хранятся в курсе; новая цена создаётся только после изменения Course.price.
+    Оплата идёт по Course.price: amount (сумма платежа) используется только для курса без цены, и такая
+    разовая цена в курсе не сохраняется.
+    Запросы к Stripe выполняются без блокировки курса. Параллельные воркеры получают от Stripe один и тот же
+    объект по ключу идемпотентности, а в курс id записывается условным UPDATE, только если его там ещё нет
+    """
+    course = Course.objects.only("name", "price", "product_id", "price_id").get(pk=course_id)
+    if course.product_id and course.price_id:
+        return course.product_id, course.price_id
+
+    product_id = course.product_id
+    if not product_id:
+        product_id = create_stripe_product(course.name, idempotency_key=f"course-{course_id}-product").get("id")
+        if not Course.objects.filter(pk=course_id, product_id__isnull=True).update(
+            product_id=product_id, updated_at=timezone.now()
+        ):
+            product_id = Course.objects.values_list("product_id", flat=True).get(pk=course_id) or product_id
+
+    if not course.price:
+        return product_id, create_stripe_price(product_id, amount).get("id")
+
+    price_id = course.price_id or create_stripe_price(
+        product_id, course.price, idempotency_key=f"course-{course_id}-price-{product_id}-{course.price}"
+    ).get("id")
+    # Цена записывается, только если Course.price не изменилась за время запроса к Stripe
+    if not Course.objects.filter(pk=course_id, price=course.price, price_id__isnull=True).update(
+        price_id=price_id, updated_at=timezone.now()
+    ):
+        price_id = (
+            Course.objects.filter(pk=course_id, price=course.price).values_list("price_id", flat=True).first()
+            or price_id
+        )
+    return product_id, price_id
+
+
+def create_stripe_session(price_id, success_url, cancel_url):
     """Создаёт сессию в Stripe"""
     session = stripe.checkout.Session.create(
         success_url=success_url + "?session_id={CHECKOUT_SESSION_ID}",
         cancel_url=cancel_url,
-        line_items=[{"price": price.get("id"), "quantity": 1}],
+        line_items=[{"price": price_id, "quantity": 1}],
         mode="payment",
         payment_method_types=["card"],
     )
@@ -40,3 +104,472 @@ def check_payment_status(session_id):
     """Проверяет статус платежа"""
     session = stripe.checkout.Session.retrieve(session_id)
     return session.payment_status
+
+
+def process_stripe_events(batch_size=500):
+    """
+    Обрабатывает пачку необработанных вебхуков Stripe: оплаченные сессии группируются по пользователям,
+    статусы платежей и купленные курсы обновляются массовыми запросами.
+    Возвращает количество обработанных событий
+    """
+    with transaction.atomic():
+        events = list(
+            StripeEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .order_by("id")[:batch_size]
+        )
+        if not events:
+            return 0
+
+        session_ids = [
+            event.payload["data"]["object"]["id"]
+            for event in events
+            if event.type == "checkout.session.completed"
+            and event.payload["data"]["object"].get("payment_status") == "paid"
+        ]
+        # Платежи блокируются, чтобы прежний статус для сводки выручки не изменился до конца транзакции
+        payments = list(
+            Payment.objects.select_for_update()
+            .filter(session_id__in=session_ids)
+            .only("id", "user_id", *REVENUE_FIELDS)
+            .order_by("id")
+        )
+        Payment.objects.filter(pk__in=[payment.pk for payment in payments]).update(payment_status="succeeded")
+        apply_revenue_changes(
+            change
+            for payment in payments
+            if payment.payment_status != "succeeded"
+            for change in revenue_status_changes(payment, "succeeded")
+        )
+
+        grants = {}
+        for payment in payments:
+            if payment.paid_course_id:
+                grants.setdefault(payment.user_id, set()).add(payment.paid_course_id)
+
+        BoughtCourse = User.bought_courses.through
+        BoughtCourse.objects.bulk_create(
+            [
+                BoughtCourse(user_id=user_id, course_id=course_id)
+                for user_id, ids in grants.items()
+                for course_id in ids
+            ],
+            ignore_conflicts=True,
+        )
+        StripeEvent.objects.filter(pk__in=[event.pk for event in events]).update(processed_at=timezone.now())
+        transaction.on_commit(lambda: invalidate_entitlements(*grants))
+        # Статусы платежей изменены через update(), сигналы post_save не срабатывают: выручка учтена выше
+        transaction.on_commit(lambda: invalidate_dashboards(*{payment.user_id for payment in payments}))
+
+    return len(events)
+
+
+def confirm_payment(payment_id):
+    """
+    Проводит оплаченный платёж со страницы возврата из Stripe: статус succeeded, сводка выручки и купленный курс.
+    Строка платежа блокируется, поэтому одновременная обработка вебхука (process_stripe_events) не проведёт
+    платёж второй раз. Возвращает True, если платёж проведён этим вызовом
+    """
+    with transaction.atomic():
+        payment = (
+            Payment.objects.select_for_update().filter(pk=payment_id).only("id", "user_id", *REVENUE_FIELDS).first()
+        )
+        if payment is None or payment.payment_status == "succeeded":
+            return False
+
+        Payment.objects.filter(pk=payment.pk).update(payment_status="succeeded")
+        apply_revenue_changes(revenue_status_changes(payment, "succeeded"))
+        if payment.paid_course_id:
+            User.bought_courses.through.objects.bulk_create(
+                [User.bought_courses.through(user_id=payment.user_id, course_id=payment.paid_course_id)],
+                ignore_conflicts=True,
+            )
+            transaction.on_commit(lambda: invalidate_entitlements(payment.user_id))
+        transaction.on_commit(lambda: invalidate_dashboards(payment.user_id))
+    return True
+
+
+def queue_email(subject, message, recipient_list, from_email=None):
+    """Кладёт письмо в исходящие вместо синхронной отправки по SMTP"""
+    return OutgoingEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        recipients=list(recipient_list),
+    )
+
+
+def _email_failed(email, error, now):
+    """Откладывает письмо с экспоненциальной задержкой, после EMAIL_OUTBOX_MAX_ATTEMPTS попыток — в недоставленные"""
+    email.last_error = repr(error)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutgoingEmail.STATUS_DEAD
+    else:
+        delay = settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1)
+        email.next_attempt_at = now + timedelta(seconds=delay)
+
+
+def send_outgoing_emails(batch_size=100):
+    """
+    Отправляет пачку писем из исходящих через одно SMTP-соединение.
+    Неудачные письма откладываются с экспоненциальной задержкой,
+    после EMAIL_OUTBOX_MAX_ATTEMPTS попыток помечаются как недоставленные.
+    Возвращает количество обработанных писем
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutgoingEmail.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        if not emails:
+            return 0
+
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as e:
+            # SMTP-сервер недоступен: попытка засчитывается всей пачке, письма откладываются как при ошибке отправки
+            logger.warning("Не удалось подключиться к SMTP-серверу (писем в пачке: %s): %r", len(emails), e)
+            for email in emails:
+                email.attempts += 1
+                _email_failed(email, e, now)
+        else:
+            try:
+                for email in emails:
+                    message = EmailMessage(email.subject, email.body, email.from_email, email.recipients)
+                    email.attempts += 1
+                    try:
+                        connection.send_messages([message])
+                    except Exception as e:
+                        logger.warning("Не удалось отправить письмо %s: %r", email.pk, e)
+                        _email_failed(email, e, now)
+                    else:
+                        email.status = OutgoingEmail.STATUS_SENT
+                        email.sent_at = timezone.now()
+            finally:
+                try:
+                    connection.close()
+                except Exception:
+                    logger.warning("Не удалось закрыть SMTP-соединение", exc_info=True)
+
+        OutgoingEmail.objects.bulk_update(
+            emails, ["status", "attempts", "next_attempt_at", "last_error", "sent_at"], batch_size=batch_size
+        )
+
+    return len(emails)
+
+
+def _load_dashboard(user):
+    """
+    Панель обучения четырьмя запросами при любом числе курсов: купленные курсы, начатые курсы (подписка
+    или прохождение) с числом пройденных уроков, количество завершённых курсов и последние платежи
+    """
+    purchased = list(Course.objects.filter(buyers=user).only(*DASHBOARD_COURSE_FIELDS).order_by("-id"))
+
+    subscribed = User.courses.through.objects.filter(user_id=user.pk).values("course_id")
+    started_courses = (
+        Course.objects.annotate(own_progress=FilteredRelation("progress", condition=Q(progress__user_id=user.pk)))
+        .filter(Q(pk__in=subscribed) | Q(own_progress__isnull=False))
+        .annotate(
+            completed_lessons=Coalesce(F("own_progress__completed_lessons"), 0),
+            last_activity=F("own_progress__updated_at"),
+        )
+        .only(*DASHBOARD_COURSE_FIELDS)
+        .order_by(F("last_activity").desc(nulls_last=True), "-id")
+    )
+    started = [
+        CourseProgress(
+            user_id=user.pk,
+            course=course,
+            completed_lessons=course.completed_lessons,
+            updated_at=course.last_activity,
+        )
+        for course in started_courses
+    ]
+
+    payments = list(
+        Payment.objects.filter(user_id=user.pk)
+        .select_related("paid_course")
+        .only(
+            "id",
+            "payment_date",
+            "payment_amount",
+            "payment_method",
+            "payment_status",
+            "paid_course__id",
+            "paid_course__name",
+        )
+        .order_by("-payment_date", "-id")[: settings.DASHBOARD_RECENT_PAYMENTS]
+    )
+
+    return {
+        "bought_count": len(purchased),
+        "started_count": len(started),
+        "completed_count": user.completed_courses.count(),
+        "purchased_courses": purchased,
+        "started_courses": started,
+        "recent_payments": payments,
+    }
+
+
+def get_dashboard(user):
+    """
+    Панель обучения пользователя из кэша (DASHBOARD_CACHE_TIMEOUT). Кэш сбрасывается при покупке, подписке,
+    завершении курса, изменении платежей и прохождении уроков; время последнего занятия может отставать
+    """
+    key = DASHBOARD_CACHE_KEY.format(user_id=user.pk)
+    dashboard = cache.get(key)
+    if dashboard is None:
+        # Из основной БД: со старой реплики в кэш попали бы данные, которые уже сброшены
+        with replica_reads(False):
+            dashboard = _load_dashboard(user)
+        cache.set(key, dashboard, settings.DASHBOARD_CACHE_TIMEOUT)
+    return dashboard
+
+
+PAYMENT_EXPORT_FORMATS = ("csv", "jsonl")
+PAYMENT_EXPORT_COLUMNS = (
+    "id",
+    "payment_date",
+    "payment_status",
+    "payment_method",
+    "payment_amount",
+    "user_id",
+    "user_phone_number",
+    "user_email",
+    "paid_course_id",
+    "paid_course_name",
+    "session_id",
+)
+# Текст, который вводят пользователи: в CSV он экранируется, чтобы Excel не принял его за формулу
+PAYMENT_EXPORT_TEXT_COLUMNS = ("user_email", "paid_course_name")
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def payments_for_export(paid_course=None, payment_method=None, date_from=None, date_to=None):
+    """
+    Платежи для бухгалтерской выгрузки в порядке даты платежа, с пользователем и курсом в том же запросе.
+    Период date_from — date_to включительно, даты — в часовом поясе проекта
+    """
+    payments = Payment.objects.select_related("user", "paid_course").only(
+        "id",
+        "payment_date",
+        "payment_status",
+        "payment_method",
+        "payment_amount",
+        "session_id",
+        "user__id",
+        "user__phone_number",
+        "user__email",
+        "paid_course__id",
+        "paid_course__name",
+    )
+    if paid_course is not None:
+        payments = payments.filter(paid_course=paid_course)
+    if payment_method is not None:
+        payments = payments.filter(payment_method=payment_method)
+    if date_from is not None:
+        payments = payments.filter(payment_date__gte=_day_start(date_from))
+    if date_to is not None:
+        payments = payments.filter(payment_date__lt=_day_start(date_to + timedelta(days=1)))
+    return payments.order_by("payment_date", "id")
+
+
+def _payment_row(payment):
+    return {
+        "id": payment.id,
+        "payment_date": timezone.localtime(payment.payment_date).isoformat(),
+        "payment_status": payment.payment_status,
+        "payment_method": payment.payment_method,
+        # Сумма строкой: JSON-число превратилось бы в float
+        "payment_amount": str(payment.payment_amount),
+        "user_id": payment.user_id,
+        "user_phone_number": str(payment.user.phone_number),
+        "user_email": payment.user.email,
+        "paid_course_id": payment.paid_course_id,
+        "paid_course_name": payment.paid_course.name if payment.paid_course else None,
+        "session_id": payment.session_id,
+    }
+
+
+def _csv_row(row):
+    """Ячейки строки выгрузки для CSV; текст, начинающийся как формула, предваряется апострофом"""
+    cells = []
+    for column in PAYMENT_EXPORT_COLUMNS:
+        value = row[column]
+        if column in PAYMENT_EXPORT_TEXT_COLUMNS and value and value.startswith(CSV_FORMULA_PREFIXES):
+            value = "'" + value
+        cells.append(value)
+    return cells
+
+
+def iter_payments_export(payments, file_format, chunk_size):
+    """
+    Выгрузка платежей в CSV или JSON Lines частями bytes по chunk_size записей. Строки читаются курсором
+    на сервере БД (iterator), поэтому память не растёт с размером выгрузки. Заголовок CSV отдаётся
+    до первого запроса к БД, с BOM — чтобы Excel открыл файл в UTF-8
+    """
+    if file_format == "csv":
+        yield ("\ufeff" + ",".join(PAYMENT_EXPORT_COLUMNS) + "\r\n").encode()
+
+    # Реплика выбирается один раз на весь обход
+    rows = (_payment_row(payment) for payment in payments.using(replica_alias()).iterator(chunk_size=chunk_size))
+    while chunk := list(islice(rows, chunk_size)):
+        if file_format == "csv":
+            output = io.StringIO()
+            csv.writer(output).writerows(_csv_row(row) for row in chunk)
+            yield output.getvalue().encode()
+        else:
+            yield render_jsonl(chunk)
+
+
+def revenue_change(payment, sign=1, payment_status=None):
+    """
+    Приращение сводки выручки от платежа: (курс, день, метод, статус, количество, сумма).
+    sign=1 — платёж добавляется в сводку, -1 — исключается из неё
+    """
+    return (
+        payment.paid_course_id,
+        timezone.localdate(payment.payment_date),
+        payment.payment_method,
+        payment_status or payment.payment_status,
+        sign,
+        sign * Decimal(str(payment.payment_amount)),
+    )
+
+
+def revenue_status_changes(payment, payment_status):
+    """Приращения сводки выручки при смене статуса платежа"""
+    return [revenue_change(payment, -1), revenue_change(payment, 1, payment_status)]
+
+
+def apply_revenue_changes(changes):
+    """
+    Добавляет приращения (revenue_change) в сводку выручки одним INSERT ... ON CONFLICT.
+    Приращения с одинаковым ключом складываются, взаимно погасившиеся не записываются
+    """
+    totals = {}
+    for *key, count, amount in changes:
+        old_count, old_amount = totals.get(tuple(key), (0, 0))
+        totals[tuple(key)] = (old_count + count, old_amount + amount)
+    # Строки блокируются в одном порядке, иначе параллельные платежи могли бы взаимно заблокироваться
+    rows = [
+        (*key, count, amount)
+        for key, (count, amount) in sorted(totals.items(), key=lambda item: (item[0][0] or 0, *item[0][1:]))
+        if count or amount
+    ]
+    if not rows:
+        return
+
+    table = connection.ops.quote_name(RevenueRollup._meta.db_table)
+    values = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(rows))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} (course_id, day, payment_method, payment_status, payment_count, amount)
+            SELECT v.course_id::bigint, v.day::date, v.payment_method, v.payment_status, v.count::integer,
+                v.amount::numeric
+            FROM (VALUES {values}) AS v (course_id, day, payment_method, payment_status, count, amount)
+            ON CONFLICT (course_id, day, payment_method, payment_status) DO UPDATE SET
+                payment_count = {table}.payment_count + EXCLUDED.payment_count,
+                amount = {table}.amount + EXCLUDED.amount
+            """,
+            [value for row in rows for value in row],
+        )
+
+
+@transaction.atomic
+def rebuild_revenue_days(day_from=None, day_to=None):
+    """
+    Пересобирает сводку выручки за дни с day_from по day_to (не включая) из платежей; None — без границы.
+    На время пересборки сводка закрыта для записи: приращения параллельных транзакций ждут и ложатся
+    поверх пересобранных строк. Возвращает количество учтённых платежей
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {connection.ops.quote_name(RevenueRollup._meta.db_table)} IN EXCLUSIVE MODE")
+
+    rollups = RevenueRollup.objects.all()
+    payments = Payment.objects.all()
+    if day_from is not None:
+        rollups = rollups.filter(day__gte=day_from)
+        payments = payments.filter(payment_date__gte=_day_start(day_from))
+    if day_to is not None:
+        rollups = rollups.filter(day__lt=day_to)
+        payments = payments.filter(payment_date__lt=_day_start(day_to))
+    rollups.delete()
+
+    rows = (
+        payments.annotate(day=TruncDate("payment_date"))
+        .values("paid_course_id", "day", "payment_method", "payment_status")
+        .annotate(payment_count=Count("id"), amount=Sum("payment_amount"))
+        .order_by()
+    )
+    created = RevenueRollup.objects.bulk_create(
+        [
+            RevenueRollup(
+                course_id=row["paid_course_id"],
+                day=row["day"],
+                payment_method=row["payment_method"],
+                payment_status=row["payment_status"],
+                payment_count=row["payment_count"],
+                amount=row["amount"],
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+    return sum(rollup.payment_count for rollup in created)
+
+
+def rebuild_revenue(batch_size=10000):
+    """
+    Пересобирает всю сводку выручки частями по целым дням примерно по batch_size платежей, каждая часть —
+    в своей транзакции. Генератор: после каждой части отдаёт (первый день, день после последнего, платежей)
+    """
+    day_from = None
+    while True:
+        payments = Payment.objects.order_by("payment_date", "id")
+        if day_from is not None:
+            payments = payments.filter(payment_date__gte=_day_start(day_from))
+        last = payments.values_list("payment_date", flat=True)[batch_size - 1 : batch_size].first()
+        day_to = timezone.localdate(last) + timedelta(days=1) if last else None
+        yield day_from, day_to, rebuild_revenue_days(day_from, day_to)
+        if day_to is None:
+            return
+        day_from = day_to
+
+
+def revenue_report(date_from, date_to, payment_status="succeeded", course_ids=None):
+    """
+    Выручка за период date_from — date_to включительно: итог, по дням, по курсам и по методам оплаты.
+    Читает только сводку, поэтому время не зависит от числа платежей. course_ids — ограничение по курсам
+    (id или запрос), None — все курсы и платежи без курса
+    """
+    rollups = RevenueRollup.objects.filter(day__range=(date_from, date_to), payment_status=payment_status)
+    if course_ids is not None:
+        rollups = rollups.filter(course_id__in=course_ids)
+    totals = {"payments": Sum("payment_count"), "revenue": Sum("amount")}
+
+    by_day = list(rollups.values("day").annotate(**totals).order_by("day"))
+    by_course = list(
+        rollups.values("course_id", course_name=F("course__name")).annotate(**totals).order_by("-revenue", "course_id")
+    )
+    by_method = list(rollups.values("payment_method").annotate(**totals).order_by("payment_method"))
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "payment_status": payment_status,
+        "total": {
+            "payments": sum(row["payments"] for row in by_day),
+            "revenue": sum((row["revenue"] for row in by_day), Decimal("0")),
+        },
+        "by_day": by_day,
+        "by_course": by_course,
+        "by_method": by_method,
+    }
@@ -0,0 +1,53 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from paperskill.models import Course
+from paperskill.services import invalidate_dashboards
+from users.models import Payment
+from users.services import REVENUE_FIELDS, apply_revenue_changes, revenue_change
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def payment_changed(sender, instance, **kwargs):
+    """Последние платежи показываются в панели обучения"""
+    invalidate_dashboards(instance.user_id)
+
+
+@receiver(pre_save, sender=Payment)
+def remember_payment_revenue(sender, instance, raw, update_fields, **kwargs):
+    """
+    Запоминает, как платёж учтён в сводке выручки до сохранения. Без транзакции строка не блокируется:
+    смену статуса, которая может совпасть с обработкой вебхука, проводит users.services.confirm_payment
+    """
+    instance._old_revenue = None
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not {*REVENUE_FIELDS, "paid_course"} & set(update_fields):
+        return
+    payments = Payment.objects.filter(pk=instance.pk).only(*REVENUE_FIELDS)
+    if transaction.get_connection().in_atomic_block:
+        # Строка заблокирована до конца транзакции: параллельная смена статуса не прочитает тот же прежний статус
+        payments = payments.select_for_update()
+    old = payments.first()
+    instance._old_revenue = old and revenue_change(old, -1)
+
+
+@receiver(post_save, sender=Payment)
+def payment_revenue_saved(sender, instance, created, raw, update_fields, **kwargs):
+    """Переносит платёж в сводке выручки: новый добавляется, у изменённого прежний ключ заменяется новым"""
+    if raw:
+        return
+    old_revenue = instance.__dict__.pop("_old_revenue", None)
+    if created or old_revenue:
+        apply_revenue_changes([change for change in (old_revenue, revenue_change(instance)) if change])
+
+
+@receiver(post_delete, sender=Payment)
+def payment_revenue_deleted(sender, instance, origin, **kwargs):
+    """Исключает удалённый платёж из сводки выручки"""
+    # При удалении курса его строки сводки удаляются каскадом
+    if isinstance(origin, Course) or getattr(origin, "model", None) is Course:
+        return
+    apply_revenue_changes([revenue_change(instance, -1)])
@@ -0,0 +1,45 @@
+from django.db import transaction
+
+from jobs.services import job
+from paperskill.services import invalidate_dashboards
+from users.models import Payment
+from users.services import (
+    REVENUE_FIELDS,
+    apply_revenue_changes,
+    create_stripe_session,
+    get_course_stripe_price,
+    revenue_status_changes,
+)
+
+
+def mark_payment_failed(payment_id, **kwargs):
+    """Помечает платёж неудачным, если сессию оплаты так и не удалось создать"""
+    with transaction.atomic():
+        payment = (
+            Payment.objects.select_for_update()
+            .filter(pk=payment_id, payment_status="pending")
+            .only("id", "user_id", *REVENUE_FIELDS)
+            .first()
+        )
+        if payment is None:
+            return
+        Payment.objects.filter(pk=payment_id).update(payment_status="failed")
+        apply_revenue_changes(revenue_status_changes(payment, "failed"))
+    invalidate_dashboards(payment.user_id)
+
+
+@job("users.create_checkout_session", on_failure=mark_payment_failed)
+def create_checkout_session(payment_id, success_url, cancel_url):
+    """Создаёт сессию оплаты Stripe для платежа, используя продукт и цену курса"""
+    payment = Payment.objects.get(pk=payment_id)
+    if payment.payment_url:
+        return
+
+    product_id, price_id = get_course_stripe_price(payment.paid_course_id, payment.payment_amount)
+    session = create_stripe_session(price_id, success_url, cancel_url)
+
+    payment.session_id = session.get("id")
+    payment.payment_url = session.get("url")
+    payment.product_id = product_id
+    payment.price_id = price_id
+    payment.save(update_fields=["session_id", "payment_url", "product_id", "price_id"])
@@ -1,7 +1,33 @@
+import csv
+import io
+import json
+import tempfile
+from datetime import datetime
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
 
 # users/tests.py
-from django.test import TestCase
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from jobs.services import run_pending_jobs
+from paperskill.models import Course, CourseProgress, Lesson
+from paperskill.serializers import ValuesSerializer
+from users.models import OutgoingEmail, Payment, RevenueRollup, StripeEvent
+from users.serializers import CustomUserSerializer
+from users.services import get_course_stripe_price, get_dashboard, process_stripe_events, send_outgoing_emails
+from users.tasks import mark_payment_failed
+from users.views import RegisterView
 
 User = get_user_model()
 
@@ -35,3 +61,612 @@ class UserModelTest(TestCase):
         user = User.objects.create_user(phone_number="+79876543210", password="testpassword123", username="testuser")
 
         self.assertEqual(str(user), "+79876543210")
+
+
+class PaymentPaginationTest(TestCase):
+    """Тесты курсорной пагинации платежей вместе с фильтрами и сортировкой"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(phone_number="+79876543210", password="testpassword123")
+        self.course = Course.objects.create(name="Курс")
+        self.payments = [
+            Payment.objects.create(user=self.user, paid_course=self.course, payment_amount=100, payment_method=method)
+            for method in ["transfer", "cash", "transfer", "transfer", "cash", "transfer"]
+        ]
+
+    def test_cursor_with_ordering_and_filter(self):
+        """Тест обхода страниц с ?ordering= и фильтром по методу оплаты"""
+        url = reverse("users:payments-list")
+        params = {"page_size": 2, "ordering": "payment_date", "payment_method": "transfer"}
+
+        response = self.client.get(url, params).json()
+        ids = [payment["id"] for payment in response["results"]]
+        while response["next"]:
+            response = self.client.get(response["next"]).json()
+            ids += [payment["id"] for payment in response["results"]]
+
+        expected = [payment.id for payment in self.payments if payment.payment_method == "transfer"]
+        self.assertEqual(ids, expected)
+
+    def test_values_list_matches_serializer(self):
+        """Тест: быстрый список платежей совпадает с ответом PaymentSerializer побайтно"""
+        url = reverse("users:payments-list")
+        params = {"page_size": 4, "ordering": "payment_date"}
+
+        response = self.client.get(url, params)
+        with mock.patch.object(ValuesSerializer, "for_serializer", return_value=None):
+            expected = self.client.get(url, params)
+
+        self.assertEqual(response.content, expected.content)
+
+
+class PaymentCheckoutTest(TestCase):
+    """Тесты создания сессии оплаты в фоновой задаче"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(phone_number="+79876543210", password="testpassword123")
+        self.client.force_authenticate(self.user)
+        self.course = Course.objects.create(name="Курс", is_paid=True, price=1000)
+
+    @mock.patch("users.tasks.create_stripe_session", return_value={"id": "cs_1", "url": "https://stripe.test/cs_1"})
+    @mock.patch("users.services.create_stripe_price", return_value={"id": "price_1"})
+    @mock.patch("users.services.create_stripe_product", return_value={"id": "prod_1", "name": "Курс"})
+    def test_checkout_created_in_background(self, *mocks):
+        """Тест: API сразу отвечает 202, ссылка на оплату появляется после работы воркера"""
+        response = self.client.post(
+            reverse("users:payments-list"), {"paid_course": self.course.id, "payment_amount": "1000.00"}
+        )
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["payment_status"], "pending")
+        status_url = reverse("users:payments-checkout-status", kwargs={"pk": response.json()["id"]})
+        self.assertIsNone(self.client.get(status_url).json()["payment_url"])
+
+        run_pending_jobs()
+
+        self.assertEqual(self.client.get(status_url).json()["payment_url"], "https://stripe.test/cs_1")
+
+        other = User.objects.create_user(phone_number="+79876543219", email="other@example.com")
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(status_url).status_code, 404)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(status_url).status_code, 401)
+
+    def test_payment_amount_taken_from_course_price(self):
+        """Тест: сумма платежа за курс с ценой берётся из Course.price, клиент не может её задать или изменить"""
+        url = reverse("users:payments-list")
+        response = self.client.post(url, {"paid_course": self.course.id, "payment_amount": "1.00"})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["payment_amount"], "1000.00")
+
+        payment_url = reverse("users:payments-detail", kwargs={"pk": response.json()["id"]})
+        self.assertEqual(self.client.patch(payment_url, {"payment_amount": "1.00"}).status_code, 200)
+        self.assertEqual(Payment.objects.get(pk=response.json()["id"]).payment_amount, 1000)
+
+        free = Course.objects.create(name="Без цены")
+        self.assertEqual(self.client.post(url, {"paid_course": free.id}).status_code, 400)
+        response = self.client.post(url, {"paid_course": free.id, "payment_amount": "300.00"})
+        self.assertEqual(response.json()["payment_amount"], "300.00")
+
+    @mock.patch("users.tasks.create_stripe_session", return_value={"id": "cs", "url": "https://stripe.test/cs"})
+    @mock.patch("users.services.create_stripe_price", side_effect=[{"id": "price_1"}, {"id": "price_2"}])
+    @mock.patch("users.services.create_stripe_product", return_value={"id": "prod_1"})
+    def test_stripe_product_and_price_reused(self, create_product, create_price, create_session):
+        """Тест: продукт и цена Stripe создаются один раз на курс, новая цена только после смены Course.price"""
+        url = reverse("users:payments-list")
+        for _ in range(2):
+            self.client.post(url, {"paid_course": self.course.id, "payment_amount": "1000.00"})
+        run_pending_jobs()
+
+        self.assertEqual(create_product.call_count, 1)
+        self.assertEqual(create_price.call_count, 1)
+        self.assertEqual(create_session.call_count, 2)
+
+        self.course.refresh_from_db()
+        self.course.price = 1500
+        self.course.save()
+        self.client.post(url, {"paid_course": self.course.id, "payment_amount": "1500.00"})
+        run_pending_jobs()
+
+        self.course.refresh_from_db()
+        self.assertEqual(create_product.call_count, 1)
+        self.assertEqual(create_price.call_count, 2)
+        self.assertEqual((self.course.product_id, self.course.price_id), ("prod_1", "price_2"))
+
+    def test_stripe_ids_written_only_if_missing(self):
+        """Тест: id из Stripe не перезаписывают записанные параллельным воркером, разовая цена не сохраняется"""
+
+        def create_product(name, idempotency_key=None):
+            # Другой воркер успел записать продукт, пока шёл запрос к Stripe
+            Course.objects.filter(pk=self.course.pk).update(product_id="prod_other")
+            return {"id": "prod_1"}
+
+        with (
+            mock.patch("users.services.create_stripe_product", side_effect=create_product),
+            mock.patch("users.services.create_stripe_price", return_value={"id": "price_1"}) as create_price,
+        ):
+            self.assertEqual(get_course_stripe_price(self.course.pk, 1000), ("prod_other", "price_1"))
+            self.assertEqual(create_price.call_args.args, ("prod_other", self.course.price))
+
+            free = Course.objects.create(name="Без цены", product_id="prod_free")
+            self.assertEqual(get_course_stripe_price(free.pk, 300), ("prod_free", "price_1"))
+            self.assertEqual(create_price.call_args.args, ("prod_free", 300))
+
+        free.refresh_from_db()
+        self.assertIsNone(free.price_id)
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.product_id, self.course.price_id), ("prod_other", "price_1"))
+
+
+class StripeWebhookTest(TestCase):
+    """Тесты входящих вебхуков Stripe"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(phone_number="+79876543210", password="testpassword123")
+        self.course = Course.objects.create(name="Курс", is_paid=True, price=1000)
+        self.payment = Payment.objects.create(
+            user=self.user, paid_course=self.course, payment_amount=1000, session_id="cs_1"
+        )
+
+    def _send(self, event):
+        with mock.patch("users.views.stripe.Webhook.construct_event", return_value=event):
+            return self.client.post(
+                reverse("users:stripe_webhook"), json.dumps(event), content_type="application/json"
+            )
+
+    def test_event_deduplicated_and_processed_in_batch(self):
+        """Тест: повторная доставка не дублирует событие, курс выдаётся после обработки входящих"""
+        event = {
+            "id": "evt_1",
+            "type": "checkout.session.completed",
+            "data": {"object": {"id": "cs_1", "payment_status": "paid"}},
+        }
+
+        self.assertEqual(self._send(event).status_code, 200)
+        self.assertEqual(self._send(event).status_code, 200)
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertFalse(self.user.bought_courses.exists())
+
+        self.assertEqual(process_stripe_events(), 1)
+        self.assertEqual(process_stripe_events(), 0)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.payment_status, "succeeded")
+        self.assertTrue(self.user.bought_courses.filter(pk=self.course.pk).exists())
+
+    def test_worker_survives_errors(self):
+        """Тест: ошибка БД записывается в лог, обработка событий не завершается"""
+        with (
+            mock.patch(
+                "users.management.commands.process_stripe_events.process_stripe_events", side_effect=OperationalError
+            ),
+            self.assertLogs("users.management.commands.process_stripe_events", "ERROR"),
+        ):
+            call_command("process_stripe_events", "--once", stdout=io.StringIO())
+
+
+@override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+class OutgoingEmailTest(TestCase):
+    """Тесты исходящих писем"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            phone_number="+79876543210", password="testpassword123", username="student", email="student@test.com"
+        )
+
+    def test_welcome_email_sent_by_worker(self):
+        """Тест: приветственное письмо ставится в исходящие и отправляется воркером"""
+        RegisterView().send_welcome_email(self.user)
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(send_outgoing_emails(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["student@test.com"])
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.STATUS_SENT)
+
+    @override_settings(EMAIL_OUTBOX_RETRY_DELAY=0)
+    def test_retry_and_dead_letter(self):
+        """Тест повторной отправки и перевода письма в недоставленные"""
+        RegisterView().send_welcome_email(self.user)
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=OSError):
+            send_outgoing_emails()
+            email = OutgoingEmail.objects.get()
+            self.assertEqual((email.status, email.attempts), (OutgoingEmail.STATUS_PENDING, 1))
+
+            send_outgoing_emails()
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), (OutgoingEmail.STATUS_DEAD, 2))
+
+    def test_connection_failure_postpones_batch(self):
+        """Тест: при недоступном SMTP-сервере попытка засчитывается и письма откладываются"""
+        RegisterView().send_welcome_email(self.user)
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.open", side_effect=ConnectionRefusedError):
+            self.assertEqual(send_outgoing_emails(), 1)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.STATUS_PENDING, 1))
+        self.assertIn("ConnectionRefusedError", email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertEqual(send_outgoing_emails(), 0)
+
+    def test_worker_survives_errors(self):
+        """Тест: ошибка пачки записывается в лог, воркер не завершается"""
+        with (
+            mock.patch("users.management.commands.send_emails.send_outgoing_emails", side_effect=OSError),
+            self.assertLogs("users.management.commands.send_emails", "ERROR"),
+        ):
+            call_command("send_emails", "--once", stdout=io.StringIO())
+
+
+class UsersAdminTest(TestCase):
+    """Тесты админки пользователей"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            phone_number="+79990000000", email="admin@test.com", password="testpass123"
+        )
+        self.user = User.objects.create_user(phone_number="+79995554433", email="student@test.com")
+        self.client.force_login(self.admin)
+
+    def test_search_by_prefix(self):
+        """Тест поиска пользователя по началу номера телефона и email"""
+        url = reverse("admin:users_user_changelist")
+
+        for term in ("+7999555", "student@"):
+            response = self.client.get(url, {"q": term})
+            self.assertEqual(list(response.context["cl"].result_list), [self.user])
+
+
+# Кэш default в памяти процесса: тесты числа запросов не считают обращения к таблице кэша
+IN_MEMORY_CACHE = {**settings.CACHES, "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=IN_MEMORY_CACHE)
+class DashboardTest(TestCase):
+    """Тесты панели обучения в профиле"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(phone_number="+79876543220", password="testpassword123")
+        self.bought = Course.objects.create(name="Купленный курс", is_paid=True, price=1000)
+        self.subscribed = Course.objects.create(name="Начатый курс")
+        self.learning = Course.objects.create(name="Курс в процессе")
+        for order in range(4):
+            Lesson.objects.create(name=f"Урок {order}", description="-", course=self.learning, order=order)
+        self.user.bought_courses.add(self.bought)
+        self.user.courses.add(self.subscribed)
+        CourseProgress.objects.create(user=self.user, course=self.learning, completed_lessons=1)
+        Payment.objects.create(user=self.user, paid_course=self.bought, payment_amount=1000, payment_method="transfer")
+
+    def test_fixed_number_of_queries_and_cache(self):
+        """Тест: панель собирается фиксированным числом запросов и берётся из кэша"""
+        with self.assertNumQueries(4):
+            dashboard = get_dashboard(self.user)
+        self.assertEqual(
+            (dashboard["bought_count"], dashboard["started_count"], dashboard["completed_count"]), (1, 2, 0)
+        )
+        self.assertEqual(dashboard["purchased_courses"], [self.bought])
+        self.assertEqual(
+            [progress.course for progress in dashboard["started_courses"]], [self.learning, self.subscribed]
+        )
+        self.assertEqual(dashboard["started_courses"][0].percent, 25)
+        self.assertEqual(dashboard["recent_payments"][0].paid_course.name, "Купленный курс")
+
+        with self.assertNumQueries(0):
+            get_dashboard(self.user)
+
+    def test_invalidated_on_enrollment_and_payment(self):
+        """Тест: кэш сбрасывается при покупке, завершении курса и новом платеже"""
+        get_dashboard(self.user)
+        self.user.completed_courses.add(self.subscribed)
+        self.assertEqual(get_dashboard(self.user)["completed_count"], 1)
+
+        Payment.objects.create(user=self.user, paid_course=self.learning, payment_amount=10, payment_method="cash")
+        self.assertEqual(len(get_dashboard(self.user)["recent_payments"]), 2)
+
+        self.bought.buyers.clear()
+        self.assertEqual(get_dashboard(self.user)["bought_count"], 0)
+
+    def test_profile_page_and_api(self):
+        """Тест: страница профиля и JSON для мобильного приложения показывают одни данные"""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("users:profile"))
+        self.assertContains(response, "Курс в процессе")
+        self.assertContains(response, "25% завершено")
+
+        api = APIClient()
+        api.force_authenticate(self.user)
+        data = api.get(reverse("users:users-dashboard")).json()
+        self.assertEqual(data["started_count"], 2)
+        self.assertEqual(data["started_courses"][0]["percent"], 25)
+        self.assertEqual(data["started_courses"][0]["course"]["name"], "Курс в процессе")
+        self.assertEqual(data["recent_payments"][0]["course_name"], "Купленный курс")
+
+
+class UserListExportTest(TestCase):
+    """Тесты списка пользователей и потоковой выгрузки"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_superuser(phone_number="+79876543230", password="admin123", username="admin")
+        self.courses = [Course.objects.create(name=f"Курс {i}") for i in range(3)]
+        for i in range(5):
+            user = User.objects.create_user(phone_number=f"+7987654324{i}", email=f"user{i}@example.com")
+            user.courses.add(*self.courses[: i % 3])
+            user.bought_courses.add(*self.courses[i % 3 :])
+
+    def _expected(self):
+        request = APIClient().get("/").wsgi_request
+        return CustomUserSerializer(User.objects.order_by("id"), many=True, context={"request": request}).data
+
+    def test_list_queries_independent_of_page_size(self):
+        """Тест: id курсов выбираются одним запросом на связь для всей страницы"""
+        url = reverse("users:users-list")
+        with CaptureQueriesContext(connection) as one:
+            self.client.get(url, {"page_size": 1})
+        with self.assertNumQueries(len(one.captured_queries)):
+            response = self.client.get(url, {"page_size": 100})
+
+        results = {item["id"]: item for item in response.json()["results"]}
+        for expected in json.loads(json.dumps(self._expected())):
+            self.assertEqual(results[expected["id"]], expected)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_export_jsonl(self):
+        """Тест: выгрузка в JSON Lines по частям совпадает с сериализатором, доступна только администраторам"""
+        url = reverse("users:users-export")
+        self.client.force_authenticate(User.objects.exclude(pk=self.admin.pk).first())
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(url)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], json.loads(json.dumps(self._expected())))
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    async def test_export_jsonl_async_client(self):
+        """Тест: под ASGI выгрузка читается до конца, части формируются в потоках sync_to_async"""
+        await self.async_client.aforce_login(self.admin)
+        response = await self.async_client.get(reverse("users:users-export"))
+        self.assertEqual(response.status_code, 200)
+        content = b"".join([part async for part in response.streaming_content])
+
+        expected = await sync_to_async(self._expected)()
+        lines = content.decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], json.loads(json.dumps(expected)))
+
+
+class PaymentExportTest(TestCase):
+    """Тесты потоковой выгрузки платежей для бухгалтерии"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_superuser(phone_number="+79876543250", password="admin123", username="admin")
+        self.user = User.objects.create_user(phone_number="+79876543251", email="buyer@example.com")
+        self.course = Course.objects.create(name='Курс, "бухгалтерия"')
+        other_course = Course.objects.create(name="Другой курс")
+        self.payments = [
+            Payment.objects.create(user=self.user, paid_course=course, payment_amount="1990.50", payment_method=method)
+            for course, method in [
+                (self.course, "transfer"),
+                (self.course, "cash"),
+                (other_course, "transfer"),
+                (self.course, "transfer"),
+            ]
+        ]
+        for payment, day in zip(self.payments, [1, 2, 3, 4]):
+            Payment.objects.filter(pk=payment.pk).update(
+                payment_date=timezone.make_aware(datetime(2024, 3, day, 23, 30))
+            )
+
+    def _export(self, **params):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse("users:payments-export"), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content)
+
+    @override_settings(EXPORT_CHUNK_SIZE=1)
+    def test_export_csv_with_filters(self):
+        """Тест: CSV по частям с фильтрами курса, метода оплаты и периода включительно"""
+        response, content = self._export(
+            paid_course=self.course.pk, payment_method="transfer", date_from="2024-03-01", date_to="2024-03-03"
+        )
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        rows = list(csv.DictReader(io.StringIO(content.decode("utf-8-sig"))))
+        self.assertEqual([int(row["id"]) for row in rows], [self.payments[0].pk])
+        self.assertEqual(rows[0]["paid_course_name"], self.course.name)
+        self.assertEqual(rows[0]["payment_amount"], "1990.50")
+        self.assertEqual(rows[0]["user_email"], "buyer@example.com")
+        self.assertTrue(rows[0]["payment_date"].startswith("2024-03-01T23:30:00"))
+
+    def test_export_csv_escapes_formulas(self):
+        """Тест: название курса и email, которые Excel принял бы за формулу, экранируются апострофом"""
+        Course.objects.filter(pk=self.course.pk).update(name='=HYPERLINK("http://example.com")')
+        User.objects.filter(pk=self.user.pk).update(email="@buyer@example.com")
+        _, content = self._export(paid_course=self.course.pk)
+
+        row = next(csv.DictReader(io.StringIO(content.decode("utf-8-sig"))))
+        self.assertEqual(row["paid_course_name"], '\'=HYPERLINK("http://example.com")')
+        self.assertEqual(row["user_email"], "'@buyer@example.com")
+        self.assertEqual(row["user_phone_number"], "+79876543251")
+
+    async def test_export_csv_async_client(self):
+        """Тест: под ASGI CSV-выгрузка читается до конца"""
+        await self.async_client.aforce_login(self.admin)
+        response = await self.async_client.get(reverse("users:payments-export"), {"file_format": "csv"})
+        self.assertEqual(response.status_code, 200)
+        content = b"".join([part async for part in response.streaming_content])
+
+        rows = list(csv.DictReader(io.StringIO(content.decode("utf-8-sig"))))
+        self.assertEqual([int(row["id"]) for row in rows], [payment.pk for payment in self.payments])
+
+    def test_export_jsonl(self):
+        """Тест: JSON Lines в порядке даты платежа, пользователь и курс — в том же запросе"""
+        with self.assertNumQueries(1):
+            response, content = self._export(file_format="jsonl")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        items = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([item["id"] for item in items], [payment.pk for payment in self.payments])
+        self.assertEqual(items[2]["paid_course_name"], "Другой курс")
+        self.assertEqual(items[0]["user_phone_number"], "+79876543251")
+
+    def test_export_validation_and_permissions(self):
+        """Тест: выгрузка только для администраторов, неверные параметры отклоняются"""
+        url = reverse("users:payments-export")
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.client.get(url, {"file_format": "xlsx"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"date_from": "2024-03-05", "date_to": "2024-03-01"}).status_code, 400)
+
+    def test_export_command(self):
+        """Тест: команда export_payments пишет ту же выгрузку в файл"""
+        with tempfile.NamedTemporaryFile(suffix=".csv") as output:
+            call_command(
+                "export_payments",
+                "--output",
+                output.name,
+                "--date-from",
+                "2024-03-02",
+                "--batch-size",
+                "1",
+                stderr=io.StringIO(),
+            )
+            rows = list(csv.DictReader(io.StringIO(output.read().decode("utf-8-sig"))))
+        self.assertEqual([int(row["id"]) for row in rows], [payment.pk for payment in self.payments[1:]])
+
+
+class RevenueRollupTest(TestCase):
+    """Тесты сводки выручки по курсам и дням"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(phone_number="+79876543260", email="owner@example.com")
+        self.user = User.objects.create_user(phone_number="+79876543261", email="payer@example.com")
+        self.course = Course.objects.create(name="Курс автора", owner=self.owner)
+        self.other_course = Course.objects.create(name="Чужой курс")
+
+    def _pay(self, course, amount, day, **kwargs):
+        payment = Payment.objects.create(user=self.user, paid_course=course, payment_amount=amount, **kwargs)
+        payment.payment_date = timezone.make_aware(datetime(2024, 3, day, 1, 30))
+        payment.save(update_fields=["payment_date"])
+        return payment
+
+    def _rollup(self):
+        return {
+            (row.course_id, row.day, row.payment_method, row.payment_status): (row.payment_count, row.amount)
+            for row in RevenueRollup.objects.exclude(payment_count=0, amount=0)
+        }
+
+    def _rebuilt(self):
+        rollup = self._rollup()
+        call_command("rebuild_revenue_rollups", "--batch-size", "1", stdout=io.StringIO())
+        return rollup, self._rollup()
+
+    def test_incremental_rollup_matches_rebuild(self):
+        """Тест: создание, смена статуса, изменение и удаление платежей дают ту же сводку, что пересборка"""
+        first = self._pay(self.course, "100.50", 1)
+        second = self._pay(self.course, 200, 1, payment_method="cash")
+        third = self._pay(None, 300, 2)
+        self._pay(self.other_course, 400, 3)
+
+        first.payment_status = "succeeded"
+        first.save()
+        second.payment_amount = 250
+        second.save(update_fields=["payment_amount"])
+        third.delete()
+        Payment.objects.create(user=self.user, payment_amount=50, payment_status="succeeded")
+
+        incremental, rebuilt = self._rebuilt()
+        self.assertEqual(incremental, rebuilt)
+        # День — по часовому поясу проекта: 01:30 по Москве, хотя в UTC это ещё предыдущий день
+        self.assertEqual(rebuilt[self.course.pk, datetime(2024, 3, 1).date(), "transfer", "succeeded"], (1, 100.5))
+        self.assertEqual(rebuilt[self.course.pk, datetime(2024, 3, 1).date(), "cash", "pending"], (1, 250))
+
+    def test_bulk_status_changes(self):
+        """Тест: статусы, изменённые через update() (вебхуки Stripe, неудачная сессия), учтены в сводке"""
+        paid = self._pay(self.course, 1000, 1, session_id="cs_1")
+        failed = self._pay(self.course, 500, 1)
+        StripeEvent.objects.create(
+            event_id="evt_1",
+            type="checkout.session.completed",
+            payload={"data": {"object": {"id": "cs_1", "payment_status": "paid"}}},
+        )
+        StripeEvent.objects.create(
+            event_id="evt_2",
+            type="checkout.session.completed",
+            payload={"data": {"object": {"id": "cs_1", "payment_status": "paid"}}},
+        )
+        process_stripe_events()
+        mark_payment_failed(failed.pk)
+        mark_payment_failed(failed.pk)
+
+        incremental, rebuilt = self._rebuilt()
+        self.assertEqual(incremental, rebuilt)
+        day = timezone.localdate(Payment.objects.get(pk=paid.pk).payment_date)
+        self.assertEqual(rebuilt[self.course.pk, day, "transfer", "succeeded"], (1, 1000))
+        self.assertEqual(rebuilt[self.course.pk, day, "transfer", "failed"], (1, 500))
+        self.assertNotIn((self.course.pk, day, "transfer", "pending"), rebuilt)
+
+    def test_success_page_and_webhook_confirm_once(self):
+        """Тест: страница возврата и вебхук проводят платёж один раз, курс выдаётся"""
+        payment = self._pay(self.course, 1000, 1, session_id="cs_1")
+        StripeEvent.objects.create(
+            event_id="evt_1",
+            type="checkout.session.completed",
+            payload={"data": {"object": {"id": "cs_1", "payment_status": "paid"}}},
+        )
+        self.client.force_login(self.user)
+        url = reverse("users:payment_success", kwargs={"payment_id": payment.pk})
+        with mock.patch("users.views.stripe.checkout.Session.retrieve", return_value=mock.Mock(payment_status="paid")):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.get(url, {"session_id": "cs_1"})
+            self.client.get(url, {"session_id": "cs_1"})
+        process_stripe_events()
+
+        self.assertTrue(self.user.bought_courses.filter(pk=self.course.pk).exists())
+        incremental, rebuilt = self._rebuilt()
+        self.assertEqual(incremental, rebuilt)
+        self.assertEqual(
+            rebuilt[self.course.pk, timezone.localdate(payment.payment_date), "transfer", "succeeded"], (1, 1000)
+        )
+
+    def test_course_deleted(self):
+        """Тест: при удалении курса его сводка удаляется вместе с платежами"""
+        self._pay(self.course, 100, 1)
+        self._pay(self.other_course, 200, 1)
+        self.course.delete()
+        connection.check_constraints()
+        self.assertEqual({key[0] for key in self._rollup()}, {self.other_course.pk})
+
+    def test_revenue_report(self):
+        """Тест: автор видит выручку своих курсов, администратор — всю, отчёт читает только сводку"""
+        for course, amount, day in [(self.course, 100, 1), (self.course, 150, 2), (self.other_course, 400, 2)]:
+            self._pay(course, amount, day, payment_status="succeeded")
+        self._pay(self.course, 999, 2)
+        url = reverse("users:users-revenue")
+        period = {"date_from": "2024-03-01", "date_to": "2024-03-31"}
+
+        self.client.force_authenticate(self.owner)
+        with self.assertNumQueries(3):
+            report = self.client.get(url, period).json()
+        self.assertEqual(report["total"], {"payments": 2, "revenue": "250.00"})
+        self.assertEqual([row["day"] for row in report["by_day"]], ["2024-03-01", "2024-03-02"])
+        self.assertEqual(
+            report["by_course"],
+            [{"payments": 2, "revenue": "250.00", "course": self.course.pk, "course_name": "Курс автора"}],
+        )
+
+        self.client.force_authenticate(User.objects.create_superuser(phone_number="+79876543262", password="admin"))
+        report = self.client.get(url, {**period, "course": self.other_course.pk}).json()
+        self.assertEqual(report["total"], {"payments": 1, "revenue": "400.00"})
+        report = self.client.get(url, {**period, "payment_status": "pending"}).json()
+        self.assertEqual(report["by_method"], [{"payments": 1, "revenue": "999.00", "payment_method": "transfer"}])
+        self.assertEqual(self.client.get(url, {"date_from": "2024-03-05", "date_to": "2024-03-01"}).status_code, 400)
@@ -15,7 +15,10 @@ router.register(r"payments", views.PaymentViewSet, basename="payments")
 urlpatterns = [
     path("users/create/", views.UserCreateAPIView.as_view(), name="users-create"),
     path("users/", views.UserListAPIView.as_view(), name="users-list"),
+    path("users/export/", views.UserExportAPIView.as_view(), name="users-export"),
     path("users/update/<int:pk>/", views.UserUpdateAPIView.as_view(), name="users-update"),
+    path("users/dashboard/", views.DashboardAPIView.as_view(), name="users-dashboard"),
+    path("users/revenue/", views.RevenueAPIView.as_view(), name="users-revenue"),
     path("accounts/profile/", views.ProfileView.as_view(), name="profile"),
     path("register/", views.RegisterView.as_view(), name="register"),
     path(
@@ -28,4 +31,5 @@ urlpatterns = [
     path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
     path("payment/success/<int:payment_id>/", views.PaymentSuccessView.as_view(), name="payment_success"),
     path("payment/cancel/<int:payment_id>/", views.PaymentCancelView.as_view(), name="payment_cancel"),
+    path("payment/webhook/", views.StripeWebhookView.as_view(), name="stripe_webhook"),
 ] + router.urls
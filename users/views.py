@@ -1,25 +1,54 @@
+import json
+from datetime import timedelta
+
 import stripe
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import Prefetch
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 from django.urls import reverse, reverse_lazy
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import FormView, TemplateView
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import generics, viewsets
-from rest_framework.exceptions import ValidationError
+from rest_framework import generics, status, viewsets
+from rest_framework.decorators import action
 from rest_framework.filters import OrderingFilter
-
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from config.routers import replica_alias
+from jobs.services import enqueue
+from paperskill.models import Course
+from paperskill.paginators import PaymentPagination, UserPagination
+from paperskill.renderers import JSONL_CONTENT_TYPE, render_jsonl
+from paperskill.serializers import ValuesSerializer
+from paperskill.views import ValuesListMixin, streaming_export
 from users.forms import CustomUserCreationForm
-from users.models import Payment, User
-from users.serializers import CustomUserSerializer, PaymentSerializer
-from users.services import create_stripe_price, create_stripe_product, create_stripe_session
+from users.models import Payment, StripeEvent, User
+from users.serializers import (
+    CustomUserSerializer,
+    DashboardSerializer,
+    PaymentExportSerializer,
+    PaymentSerializer,
+    RevenueQuerySerializer,
+    RevenueSerializer,
+)
+from users.services import (
+    confirm_payment,
+    get_dashboard,
+    iter_payments_export,
+    payments_for_export,
+    queue_email,
+    revenue_report,
+)
 
 
 class UserCreateAPIView(generics.CreateAPIView):
@@ -31,45 +60,132 @@ class UserUpdateAPIView(generics.UpdateAPIView):
     queryset = User.objects.all()
 
 
-class UserListAPIView(generics.ListAPIView):
+class UserListAPIView(ValuesListMixin, generics.ListAPIView):
+    """
+    Список пользователей по страницам: строки через .values(), id курсов и купленных курсов —
+    одним запросом на связь для всей страницы
+    """
+
     serializer_class = CustomUserSerializer
-    queryset = User.objects.all()
+    queryset = User.objects.prefetch_related(
+        Prefetch("courses", queryset=Course.objects.only("id")),
+        Prefetch("bought_courses", queryset=Course.objects.only("id")),
+    )
+    pagination_class = UserPagination
+
+
+class UserExportAPIView(APIView):
+    """
+    Выгрузка всех пользователей в JSON Lines (по записи CustomUserSerializer на строку). Записи читаются
+    курсором на сервере БД частями по EXPORT_CHUNK_SIZE и сразу отдаются клиенту
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        values_serializer = ValuesSerializer(CustomUserSerializer(context={"request": request}))
+        return streaming_export(
+            request, _export_jsonl(values_serializer, User.objects.order_by("id")), JSONL_CONTENT_TYPE, "users.jsonl"
+        )
 
 
-class PaymentViewSet(viewsets.ModelViewSet):
+def _export_jsonl(values_serializer, queryset):
+    # Выгрузка читает с реплики, выбранной один раз на весь обход
+    for chunk in values_serializer.iter_chunks(queryset.using(replica_alias()), settings.EXPORT_CHUNK_SIZE):
+        yield render_jsonl(chunk)
+
+
+class PaymentViewSet(ValuesListMixin, viewsets.ModelViewSet):
     serializer_class = PaymentSerializer
     queryset = Payment.objects.all()
+    pagination_class = PaymentPagination
 
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_fields = ["paid_course", "payment_method"]
     ordering_fields = ["payment_date"]
 
+    def create(self, request, *args, **kwargs):
+        """Создаёт платёж в статусе pending; сессия оплаты Stripe создаётся фоновой задачей"""
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
+    @transaction.atomic
     def perform_create(self, serializer):
-        try:
-            payment = serializer.save(user=self.request.user)
-
-            request = self.request
-            success_url = request.build_absolute_uri(
-                reverse("users:payment_success", kwargs={"payment_id": payment.id})
-            )
-            cancel_url = request.build_absolute_uri(reverse("users:payment_cancel", kwargs={"payment_id": payment.id}))
-
-            product = create_stripe_product(payment.paid_course.name)
-            price = create_stripe_price(product, payment.payment_amount)
-            session = create_stripe_session(price, success_url, cancel_url)
-
-            payment.session_id = session.get("id")
-            payment.payment_url = session.get("url")
-            payment.product_id = product.get("id")
-            payment.price_id = price.get("id")
-            payment.save()
-        except Exception as e:
-            raise ValidationError(f"Ошибка при создании сессии оплаты: {str(e)}")
+        payment = serializer.save(user=self.request.user, payment_status="pending")
+
+        request = self.request
+        success_url = request.build_absolute_uri(reverse("users:payment_success", kwargs={"payment_id": payment.id}))
+        cancel_url = request.build_absolute_uri(reverse("users:payment_cancel", kwargs={"payment_id": payment.id}))
+        enqueue("users.create_checkout_session", payment_id=payment.id, success_url=success_url, cancel_url=cancel_url)
+
+    @action(detail=True, methods=["get"], url_path="status", permission_classes=[IsAuthenticated])
+    def checkout_status(self, request, pk=None):
+        """Статус своего платежа и ссылка на оплату, когда сессия Stripe готова"""
+        payment = get_object_or_404(
+            Payment.objects.only("id", "payment_status", "payment_url"), pk=pk, user=request.user
+        )
+        return Response(
+            {"id": payment.id, "payment_status": payment.payment_status, "payment_url": payment.payment_url}
+        )
+
+    @action(detail=False, methods=["get"], permission_classes=[IsAdminUser])
+    def export(self, request):
+        """
+        Выгрузка платежей для бухгалтерии в CSV или JSON Lines (file_format) с фильтрами paid_course,
+        payment_method и периодом date_from — date_to. Файл отдаётся по частям по мере чтения из БД
+        """
+        params = PaymentExportSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        file_format = params.validated_data.pop("file_format")
+        parts = iter_payments_export(
+            payments_for_export(**params.validated_data), file_format, settings.EXPORT_CHUNK_SIZE
+        )
+        content_type = "text/csv; charset=utf-8" if file_format == "csv" else JSONL_CONTENT_TYPE
+        return streaming_export(request, parts, content_type, f"payments.{file_format}")
+
+
+class DashboardAPIView(APIView):
+    """Панель обучения текущего пользователя: те же данные, что на странице профиля"""
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        return Response(DashboardSerializer(get_dashboard(request.user), context={"request": request}).data)
+
 
+class RevenueAPIView(APIView):
+    """
+    Выручка за период (по умолчанию REVENUE_REPORT_DAYS последних дней) из сводки по курсам и дням:
+    администраторам — по всем платежам, остальным — по их курсам
+    """
 
-class ProfileView(TemplateView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        params = RevenueQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        date_to = params.validated_data.get("date_to") or timezone.localdate()
+        date_from = params.validated_data.get("date_from") or date_to - timedelta(
+            days=settings.REVENUE_REPORT_DAYS - 1
+        )
+
+        course_ids = None if request.user.is_staff else Course.objects.filter(owner=request.user).values("id")
+        if course := params.validated_data.get("course"):
+            course_ids = [course] if course_ids is None else course_ids.filter(pk=course)
+
+        report = revenue_report(date_from, date_to, params.validated_data["payment_status"], course_ids)
+        return Response(RevenueSerializer(report).data)
+
+
+class ProfileView(LoginRequiredMixin, TemplateView):
     template_name = "users/profile.html"
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(get_dashboard(self.request.user))
+        return context
+
 
 class RegisterView(FormView):
     template_name = "users/register.html"
@@ -85,9 +201,10 @@ class RegisterView(FormView):
     def send_welcome_email(self, user):
         if user.email:
             subject = "Добро пожаловать в PaperSkill!"
-            message = f"{user.display_name.title()}, спасибо, что зарегистрировались на нашем сайте!"
+            name = user.first_name or user.username or "Пользователь"
+            message = f"{name.title()}, спасибо, что зарегистрировались на нашем сайте!"
             recipient_list = [user.email]
-            send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, recipient_list)
+            queue_email(subject, message, recipient_list, settings.DEFAULT_FROM_EMAIL)
 
 
 class PaymentSuccessView(LoginRequiredMixin, TemplateView):
@@ -103,13 +220,7 @@ class PaymentSuccessView(LoginRequiredMixin, TemplateView):
             session = stripe.checkout.Session.retrieve(session_id)
 
             if session.payment_status == "paid":
-                payment.payment_status = "succeeded"
-                payment.save()
-
-                if payment.paid_course and payment.paid_course not in request.user.bought_courses.all():
-                    request.user.bought_courses.add(payment.paid_course)
-                    request.user.save()
-
+                confirm_payment(payment.pk)
                 messages.success(request, "Платеж успешно завершен! Курс добавлен в вашу библиотеку.")
             else:
                 messages.warning(request, "Платеж не подтвержден. Пожалуйста, проверьте статус позже.")
@@ -168,28 +279,11 @@ class StripeWebhookView(View):
         except stripe.error.SignatureVerificationError:
             return JsonResponse({"error": "Invalid signature"}, status=400)
 
-        # Обработка события
-        if event["type"] == "checkout.session.completed":
-            session = event["data"]["object"]
-
-            # Находим платеж по сессии
-            session_id = session.get("id")
-            try:
-                from .models import Payment
-
-                payment = Payment.objects.get(session_id=session_id)
-
-                # Обновляем статус
-                if session.get("payment_status") == "paid":
-                    payment.payment_status = "succeeded"
-                    payment.save()
-
-                    # Добавляем курс в купленные
-                    if payment.paid_course and payment.paid_course not in payment.user.bought_courses.all():
-                        payment.user.bought_courses.add(payment.paid_course)
-                        payment.user.save()
-
-            except Payment.DoesNotExist:
-                pass
+        # Событие только сохраняется во входящие и обрабатывается пачками (manage.py process_stripe_events).
+        # Повторная доставка того же события не создаёт дубликат благодаря уникальному event_id
+        StripeEvent.objects.bulk_create(
+            [StripeEvent(event_id=event["id"], type=event["type"], payload=json.loads(payload))],
+            ignore_conflicts=True,
+        )
 
         return JsonResponse({"status": "success"})